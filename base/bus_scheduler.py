@@ -0,0 +1,84 @@
+#######################################################################################
+###### Scheduling of the transactions of all the devices on one GPIB board.  #########
+###### A board can only carry one transaction at a time, the scheduler hands #########
+###### out turns by priority so that short settings queries are not stuck    #########
+###### behind the long curve transfers of another device                     #########
+#######################################################################################
+
+import threading
+
+
+##Transaction priorities, lower numbers are served first
+PRIORITY_HIGH = 0   # short settings queries
+PRIORITY_NORMAL = 1 # plain writes and reads
+PRIORITY_BULK = 2   # the chunks of long transfers (i.e. curve?)
+##
+
+# after this many turns handed to later arrivals, the oldest waiter is served next
+# no matter its priority, so bulk transfers are slowed down but never starved
+STARVATION_LIMIT = 8
+
+
+class BusScheduler:
+    """
+    Serializes the transactions on one board. Waiting transactions are served
+    by priority and in arrival order within a priority, with STARVATION_LIMIT
+    keeping the low priorities moving
+    """
+    def __init__(self, starvation_limit=STARVATION_LIMIT):
+        self.condition = threading.Condition()
+        self.starvation_limit = starvation_limit
+        self.busy = False
+        self.waiting = list() # (priority, ticket) of every waiting transaction
+        self.next_ticket = 0
+        self.bypassed = 0     # turns handed out since the oldest waiter arrived
+        self.transactions = 0
+
+    def _next(self):
+        """The (priority, ticket) that gets the next turn"""
+        oldest = min(self.waiting, key=lambda waiter: waiter[1])
+        if self.bypassed >= self.starvation_limit:
+            return oldest
+        return min(self.waiting)
+
+    def acquire(self, priority=PRIORITY_NORMAL):
+        """Waits for this transaction's turn on the board"""
+        self.condition.acquire()
+        try:
+            waiter = (priority, self.next_ticket)
+            self.next_ticket = self.next_ticket + 1
+            self.waiting.append(waiter)
+            while self.busy or self._next() != waiter:
+                self.condition.wait()
+            if waiter[1] == min([other[1] for other in self.waiting]):
+                self.bypassed = 0
+            else:
+                self.bypassed = self.bypassed + 1
+            self.waiting.remove(waiter)
+            self.busy = True
+            self.transactions = self.transactions + 1
+        finally:
+            self.condition.release()
+
+    def release(self):
+        """Ends the current transaction and hands the board to the next one"""
+        self.condition.acquire()
+        try:
+            self.busy = False
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+
+_schedulers = dict() # board -> BusScheduler
+_schedulers_lock = threading.Lock()
+
+def getBusScheduler(board):
+    """The scheduler shared by every device on board"""
+    _schedulers_lock.acquire()
+    try:
+        if board not in _schedulers:
+            _schedulers[board] = BusScheduler()
+        return _schedulers[board]
+    finally:
+        _schedulers_lock.release()
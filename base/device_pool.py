@@ -0,0 +1,122 @@
+#######################################################################################
+###### Process wide pool of open GPIB devices. Opening a device (gpib.find)  #########
+###### is slow, so devices are shared by name, reference counted and only     #########
+###### closed after they have been idle for a while                          #########
+#######################################################################################
+
+import threading
+import time
+
+from .gpib_base import GpibDevice
+from .transport import LinuxGpibTransport
+
+
+DEFAULT_IDLE_TIMEOUT = 300.0 # seconds an unused device stays open
+
+
+class DevicePool:
+    """
+    Hands out shared GpibDevice objects keyed by device name.
+
+    acquire opens a device the first time its name is asked for and returns
+    the same object (and so the same transport and lock) afterwards, release
+    gives it back. A device nobody holds is closed once it has been idle for
+    idle_timeout seconds (None keeps it open until closeAll).
+
+    Before an open device is handed out again it is checked with health_check
+    (a function taking the device, by default the transport's isHealthy),
+    an unhealthy device is closed and opened again
+    """
+    def __init__(self, idle_timeout=DEFAULT_IDLE_TIMEOUT, health_check=None):
+        self.idle_timeout = idle_timeout
+        self.health_check = health_check
+        self.entries = dict() # name -> [device, reference count, time it became idle]
+        self.retired = list() # [device, reference count] of replaced devices still held by someone
+        self.lock = threading.Lock()
+
+    def _healthy(self, device):
+        try:
+            if self.health_check is not None:
+                return self.health_check(device)
+            return device.transport.isHealthy()
+        except Exception:
+            return False
+
+    def acquire(self, name, factory=LinuxGpibTransport):
+        """
+        The shared device called name, opened with the transport factory(name)
+        if it is not open yet
+        """
+        self.lock.acquire()
+        try:
+            self._reap()
+            entry = self.entries.get(name)
+            if entry is not None and not self._healthy(entry[0]):
+                del self.entries[name]
+                if entry[1] == 0:
+                    entry[0].close()
+                else:
+                    self.retired.append([entry[0], entry[1]]) # closed when its last holder releases it
+                entry = None
+            if entry is None:
+                entry = [GpibDevice(name, factory(name)), 0, None]
+                self.entries[name] = entry
+            entry[1] = entry[1] + 1
+            entry[2] = None
+            return entry[0]
+        finally:
+            self.lock.release()
+
+    def release(self, device):
+        """Give back a device obtained from acquire"""
+        self.lock.acquire()
+        try:
+            for retired in self.retired:
+                if retired[0] is device:
+                    retired[1] = retired[1] - 1
+                    if retired[1] <= 0:
+                        self.retired.remove(retired)
+                        device.close()
+                    return
+            entry = self.entries.get(device.name)
+            if entry is None or entry[0] is not device:
+                device.close() # not pooled
+                return
+            entry[1] = entry[1] - 1
+            if entry[1] <= 0:
+                entry[1] = 0
+                entry[2] = time.time()
+            self._reap()
+        finally:
+            self.lock.release()
+
+    def _reap(self):
+        """Closes the devices that have been idle too long. Call with self.lock held"""
+        if self.idle_timeout is None:
+            return
+        now = time.time()
+        for name in list(self.entries):
+            device, references, idle_since = self.entries[name]
+            if references == 0 and idle_since is not None and now - idle_since >= self.idle_timeout:
+                del self.entries[name]
+                device.close()
+
+    def reap(self):
+        """Closes the devices that have been idle longer than idle_timeout"""
+        self.lock.acquire()
+        try:
+            self._reap()
+        finally:
+            self.lock.release()
+
+    def closeAll(self):
+        """Closes every pooled device, whether it is in use or not"""
+        self.lock.acquire()
+        try:
+            for name in list(self.entries):
+                self.entries.pop(name)[0].close()
+        finally:
+            self.lock.release()
+
+
+DEFAULT_POOL = DevicePool() # the pool used by the drivers
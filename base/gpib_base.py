@@ -1,24 +1,230 @@
-import gpib
+from .transport import LinuxGpibTransport, STB_MAV, STB_ESB, STB_RQS
+from .bus_scheduler import getBusScheduler, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_BULK
+from .instrumentation import OP_WRITE, OP_READ, OP_READ_BINARY, OP_QUERY, OP_QUERY_BATCH, OP_SERIAL_POLL
+import threading
+import time
+
+# asyncio is only needed for the ...Async methods, trollius is its python 2 backport
+try:
+	import asyncio
+except ImportError:
+	try:
+		import trollius as asyncio
+	except ImportError:
+		asyncio = None
 """test!"""
 """test3!"""
 """test2!"""
 
+BATCH_SEPARATOR = ';'	# separates the commands of a compound command and their responses
+BATCH_ROOT = ':'	# a leading colon makes every command of a compound command start at the root
+COMMON_COMMAND_PREFIX = '*'	# IEEE 488.2 common commands (*cls, *opc?...) are not in the tree, a colon in front of them is an error
+RESPONSE_TERMINATOR = '\n'
+BULK_CHUNK_SIZE = 65536	# largest read of a long transfer done in one turn on the board
+STATUS_POLL_INTERVAL = 0.005	# seconds between the serial polls of waitStatus
+
+
+def splitResponse(response, separator=BATCH_SEPARATOR):
+	"""
+	Splits a response on separator, ignoring separators
+	that are inside quoted strings
+	"""
+	fields = list()
+	current = ''
+	quoted = False
+	for char in response:
+		if char == '"':
+			quoted = not quoted
+		if char == separator and not quoted:
+			fields.append(current)
+			current = ''
+		else:
+			current = current + char
+	fields.append(current)
+	return fields
+
+
+def joinCommands(commands):
+	"""
+	Joins commands into one compound command, every tree command starts at the root
+	and the common commands are left as they are
+	"""
+	joined = list()
+	for command in commands:
+		command = command.lstrip(BATCH_ROOT)
+		if not command.startswith(COMMON_COMMAND_PREFIX):
+			command = BATCH_ROOT + command
+		joined.append(command)
+	return BATCH_SEPARATOR.join(joined)
+
+
 class GpibDevice:
 	"""Generic lowelevel GPIB device for the Budker-phys gpib python library"""
 	DEFAULT_READ_LENGTH=1000
-	def __init__(self, name):
-		self.device = gpib.find(name)
+	def __init__(self, name, transport=None, scheduler=None):
+		"""
+		transport is the link used to talk to the device (see base/transport.py),
+		by default the device is looked up with linux-gpib.
+		scheduler hands out turns on the board, by default it is the one shared
+		by every device on transport.board (see base/bus_scheduler.py)
+		"""
+		if transport is None:
+			transport = LinuxGpibTransport(name)
+		if scheduler is None:
+			scheduler = getBusScheduler(transport.board)
+		self.name = name
+		self.transport = transport
+		self.scheduler = scheduler
 		self.read_length = self.DEFAULT_READ_LENGTH
+		self.lock = threading.RLock()	# held while a thread has a transaction going with this device
+		self.executor = None	# executor of the ...Async calls, None uses the event loop's default
+		self.instrumentation = None	# see setInstrumentation
+		self.instrument_state = None	# kept by the drivers of the instrument, shared by every driver using this device
 	def setReadLength(self, length):
 		"""Sets the read_length for this GPIB device"""
 		self.read_length = length
-	def write(self, command):
+	def setInstrumentation(self, instrumentation):
+		"""
+		Record the time and bytes of every transaction in instrumentation
+		(a base/instrumentation.py Instrumentation), None turns it off.
+		Only the time on the bus is measured, not the wait for a turn
+		"""
+		self.instrumentation = instrumentation
+	def _transaction(self, priority, operation, num_of_bytes, function, *args):
+		"""_onBus, timed when instrumentation is on"""
+		if self.instrumentation is None:
+			return self._onBus(priority, function, *args)
+		return self._onBus(priority, self.instrumentation.call, operation, num_of_bytes, function, *args)
+	def _onBus(self, priority, function, *args):
+		"""
+		Run function(*args) holding this device and a turn on its board.
+		Hold self.lock around several calls to keep other threads from
+		talking to this device in between
+		"""
+		self.lock.acquire()
+		try:
+			self.scheduler.acquire(priority)
+			try:
+				return function(*args)
+			finally:
+				self.scheduler.release()
+		finally:
+			self.lock.release()
+	def write(self, command, priority=PRIORITY_NORMAL):
 		"""Write a lowlevel gpib command"""
-		gpib.write(self.device, command)
-	def read(self, length=self.read_length):
+		self._transaction(priority, OP_WRITE, len(command), self.transport.write, command)
+	def read(self, length=None, priority=PRIORITY_NORMAL):
 		"""Read from the gpib device, number of characters, defined by read_length"""
-		return gpib.read(self.device, length)
-	def readBinary(self,length=self.read_length):
-		return gpib.readbin(self.device,length)
-
+		if length is None:
+			length = self.read_length
+		return self._transaction(priority, OP_READ, None, self.transport.read, length)
+	def readBinary(self,length=None, priority=PRIORITY_NORMAL):
+		"""
+		Read raw binary data from the gpib device, at most length bytes.
+		With PRIORITY_BULK the read is capped at BULK_CHUNK_SIZE bytes, so that
+		other devices get the board between the chunks of a long transfer
+		"""
+		if length is None:
+			length = self.read_length
+		if priority == PRIORITY_BULK:
+			length = min(length, BULK_CHUNK_SIZE)
+		return self._transaction(priority, OP_READ_BINARY, None, self.transport.readBinary, length)
+	def _query(self, command, length):
+		self.transport.write(command)
+		return self.transport.read(length)
+	def query(self, command, length=None, priority=PRIORITY_HIGH):
+		"""
+		Write command and read the response as one transaction,
+		nothing else happens on the board in between
+		"""
+		if length is None:
+			length = self.read_length
+		return self._transaction(priority, OP_QUERY, None, self._query, command, length)
+	def _readResponse(self, terminator):
+		chunks = list()
+		while True:
+			chunk = self.transport.read(self.read_length)
+			chunks.append(chunk)
+			if not chunk or chunk[-1:] == terminator:
+				break
+		return ''.join(chunks)
+	def readResponse(self, terminator=RESPONSE_TERMINATOR):
+		"""Read read_length sized chunks until the response ends with terminator"""
+		return self._onBus(PRIORITY_NORMAL, self._readResponse, terminator)
+	def _queryBatch(self, command):
+		self.transport.write(command)
+		return self._readResponse(RESPONSE_TERMINATOR)
+	def queryBatch(self, queries, priority=PRIORITY_HIGH):
+		"""
+		Send several queries as one compound command and split the single
+		response back up, so that n queries cost one round-trip instead of n.
+		Returns a list with one response (newline terminated, as a single query
+		would return it) per query
+		"""
+		command = joinCommands(queries)
+		response = self._transaction(priority, OP_QUERY_BATCH, None, self._queryBatch, command)
+		fields = splitResponse(response.rstrip(RESPONSE_TERMINATOR))
+		if len(fields) != len(queries):
+			raise Exception("Compound query returned %d responses for %d queries" % (len(fields), len(queries)))
+		return [field.strip() + RESPONSE_TERMINATOR for field in fields]
+	def serialPoll(self, priority=PRIORITY_HIGH):
+		"""Read the device's status byte (see the STB_* bits in base/transport.py)"""
+		return self._transaction(priority, OP_SERIAL_POLL, 1, self.transport.serialPoll)
+	def waitStatus(self, mask, timeout, interval=STATUS_POLL_INTERVAL):
+		"""
+		Serial polls the device every interval seconds until one of the bits
+		in mask is set in its status byte. Returns that status byte, or None if
+		timeout seconds pass first. The board is free between the polls
+		"""
+		deadline = time.time() + timeout
+		while True:
+			status = self.serialPoll()
+			if status & mask:
+				return status
+			if time.time() >= deadline:
+				return None
+			time.sleep(interval)
+	def waitSRQ(self, timeout):
+		"""
+		Wait at most timeout seconds for the device to request service,
+		returns its status byte or None if the wait timed out. The transport
+		waits on the SRQ line, the serial polls take a turn on the board like
+		any other transaction
+		"""
+		deadline = time.time() + timeout
+		while True:
+			self.transport.waitSRQ(max(0.0, deadline - time.time()))
+			status = self.serialPoll()
+			if status & STB_RQS:
+				return status
+			if time.time() >= deadline:
+				return None
+	def close(self):
+		"""Release the link to the device"""
+		self.transport.close()
 
+	"""
+	The following methods are asyncio counterparts of the methods above, they run the
+	blocking call on an executor so that the event loop keeps running while the device
+	answers. Each returns an awaitable future. Calls to different devices run at the same
+	time, calls to the same device are serialized by self.lock
+	"""
+	def callAsync(self, function, *args):
+		"""Run function(*args) on the executor while holding this device's lock"""
+		if asyncio is None:
+			raise Exception("asyncio (or trollius on python 2) is required for the async methods")
+		def locked():
+			self.lock.acquire()
+			try:
+				return function(*args)
+			finally:
+				self.lock.release()
+		return asyncio.get_event_loop().run_in_executor(self.executor, locked)
+	def writeAsync(self, command):
+		return self.callAsync(self.write, command)
+	def readAsync(self, length=None):
+		return self.callAsync(self.read, length)
+	def readBinaryAsync(self, length=None):
+		return self.callAsync(self.readBinary, length)
+	def queryAsync(self, command, length=None):
+		return self.callAsync(self.query, command, length)
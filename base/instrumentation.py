@@ -0,0 +1,101 @@
+#######################################################################################
+###### Opt-in timing of the hot paths (bus transactions, curve decoding).    #########
+###### An Instrumentation object collects call counts, bytes and a latency    #########
+###### histogram per operation. Nothing is measured unless one is attached,  #########
+###### see GpibDevice.setInstrumentation and TDS540_Base.setInstrumentation  #########
+#######################################################################################
+
+import bisect
+import threading
+from timeit import default_timer
+
+
+##Operations recorded by GpibDevice
+OP_WRITE = 'write'
+OP_READ = 'read'
+OP_READ_BINARY = 'readBinary'
+OP_QUERY = 'query'
+OP_QUERY_BATCH = 'queryBatch'
+OP_SERIAL_POLL = 'serialPoll'
+##
+
+# upper edges of the latency histogram buckets in seconds,
+# one more bucket counts everything slower than the last edge
+HISTOGRAM_BOUNDS = (1e-5, 3e-5, 1e-4, 3e-4, 1e-3, 3e-3, 1e-2, 3e-2, 0.1, 0.3, 1.0, 3.0)
+
+
+class Instrumentation:
+    """
+    Collects per operation statistics: the number of calls, bytes moved,
+    total and largest time and a histogram of the call times (buckets bounded
+    by bounds). One object can be shared by several devices and scopes,
+    it is thread safe.
+
+    callback, if set, is called as callback(operation, seconds, num_of_bytes)
+    after every recorded call, on the thread that made the call
+    """
+    def __init__(self, callback=None, bounds=HISTOGRAM_BOUNDS):
+        self.callback = callback
+        self.bounds = tuple(bounds)
+        self.stats = dict() # operation -> [calls, bytes, seconds, max seconds, histogram counts]
+        self.lock = threading.Lock()
+
+    def record(self, operation, seconds, num_of_bytes=0):
+        """Adds one call of operation that took seconds and moved num_of_bytes"""
+        bucket = bisect.bisect_left(self.bounds, seconds)
+        self.lock.acquire()
+        try:
+            entry = self.stats.get(operation)
+            if entry is None:
+                entry = [0, 0, 0.0, 0.0, [0] * (len(self.bounds) + 1)]
+                self.stats[operation] = entry
+            entry[0] = entry[0] + 1
+            entry[1] = entry[1] + num_of_bytes
+            entry[2] = entry[2] + seconds
+            entry[3] = max(entry[3], seconds)
+            entry[4][bucket] = entry[4][bucket] + 1
+        finally:
+            self.lock.release()
+        if self.callback is not None:
+            self.callback(operation, seconds, num_of_bytes)
+
+    def call(self, operation, num_of_bytes, function, *args):
+        """
+        Returns function(*args) and records the time it took as a call of operation.
+        num_of_bytes None counts the length of the result
+        """
+        start = default_timer()
+        result = function(*args)
+        seconds = default_timer() - start
+        if num_of_bytes is None:
+            num_of_bytes = len(result)
+        self.record(operation, seconds, num_of_bytes)
+        return result
+
+    def snapshot(self):
+        """
+        The statistics so far as a dictionary of operation -> dictionary with
+        calls, bytes, seconds, mean_seconds, max_seconds and histogram,
+        a list of (upper edge in seconds, count) where the last edge is None
+        """
+        self.lock.acquire()
+        try:
+            snapshot = dict()
+            edges = list(self.bounds) + [None]
+            for operation in self.stats:
+                calls, num_of_bytes, seconds, max_seconds, histogram = self.stats[operation]
+                snapshot[operation] = {'calls' : calls, 'bytes' : num_of_bytes,
+                                       'seconds' : seconds, 'mean_seconds' : seconds / calls,
+                                       'max_seconds' : max_seconds,
+                                       'histogram' : list(zip(edges, histogram))}
+            return snapshot
+        finally:
+            self.lock.release()
+
+    def reset(self):
+        """Forgets everything recorded so far"""
+        self.lock.acquire()
+        try:
+            self.stats.clear()
+        finally:
+            self.lock.release()
@@ -20,9 +20,15 @@
 
 import sys
 
+# numpy is optional for the library, the modules that need it import it from here
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 def _functionId(obj, nFramesUp):
     """ Create a string naming the function n frames up on the stak."""
-    fr = sys.__getframe(nFramesUp+1)
+    fr = sys._getframe(nFramesUp+1)
     co = fr.f_code
     return "%s.%s" % (obj.__class__,co.co_name)
 
@@ -30,3 +36,8 @@ def abstractMethod(obj=None):
     """Use this to make a method abstract, it will throw an exception if 
     the method isnt implemented in a deriving class"""
     raise Exception("Unimplemented abstract method: %s" % _functionId(obj,1))
+
+def requireNumpy(feature):
+    """Raises an exception naming feature if numpy is not installed"""
+    if numpy is None:
+        raise Exception("numpy is required for %s" % feature)
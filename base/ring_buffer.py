@@ -0,0 +1,145 @@
+#######################################################################################
+###### Fixed capacity ring buffer of numpy records, used to hand waveform     #########
+###### frames from an acquisition thread to the code consuming them in        #########
+###### constant memory                                                       #########
+#######################################################################################
+
+import threading
+import time
+
+from .interface import numpy, requireNumpy
+
+
+##Overflow policies, what put/reserve do when the buffer is full
+OVERFLOW_DROP_OLDEST = 'drop-oldest' # overwrite the oldest record that was not read yet
+OVERFLOW_BLOCK = 'block'             # wait until the consumer has read a record
+##
+
+
+class RingBuffer:
+    """
+    A first in first out queue of at most capacity numpy records of type dtype.
+    All the memory is allocated when the buffer is created.
+
+    One producer thread fills records and one consumer thread reads them.
+    The producer either fills a record in place (reserve, then commit) or
+    copies one in (put), the consumer gets a copy of the oldest record (get).
+    self.dropped counts the records lost to OVERFLOW_DROP_OLDEST
+    """
+    def __init__(self, capacity, dtype, overflow=OVERFLOW_DROP_OLDEST):
+        requireNumpy("RingBuffer")
+        if overflow not in (OVERFLOW_DROP_OLDEST, OVERFLOW_BLOCK):
+            raise Exception("Unknown overflow policy: %s" % overflow)
+        if capacity < 1:
+            raise Exception("RingBuffer capacity must be at least 1")
+        self.records = numpy.zeros(capacity, dtype)
+        self.capacity = capacity
+        self.overflow = overflow
+        self.head = 0     # index of the oldest record
+        self.count = 0    # number of committed records that were not read yet
+        self.reserved = False
+        self.dropped = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def __len__(self):
+        return self.count
+
+    def reserve(self, timeout=None):
+        """
+        Returns the next free record to be filled in place, it becomes readable
+        once commit is called. When the buffer is full the oldest record is dropped
+        or, with OVERFLOW_BLOCK, this waits until there is room.
+        Returns None if the buffer is closed, or if timeout seconds pass without room
+        """
+        index = self._reserveIndex(timeout)
+        if index is None:
+            return None
+        return self.records[index]
+
+    def _reserveIndex(self, timeout):
+        deadline = self._deadline(timeout)
+        self.condition.acquire()
+        try:
+            if self.reserved:
+                raise Exception("RingBuffer record reserved twice without commit")
+            while self.count == self.capacity and not self.closed:
+                if self.overflow == OVERFLOW_DROP_OLDEST:
+                    self.head = (self.head + 1) % self.capacity
+                    self.count = self.count - 1
+                    self.dropped = self.dropped + 1
+                    break
+                if not self._wait(deadline):
+                    return None
+            if self.closed:
+                return None
+            self.reserved = True
+            return (self.head + self.count) % self.capacity
+        finally:
+            self.condition.release()
+
+    def commit(self):
+        """Makes the record returned by reserve readable"""
+        self.condition.acquire()
+        try:
+            if not self.reserved:
+                raise Exception("RingBuffer commit without reserve")
+            self.reserved = False
+            self.count = self.count + 1
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+    def put(self, record, timeout=None):
+        """Copies record into the buffer, returns False if it could not be added"""
+        index = self._reserveIndex(timeout)
+        if index is None:
+            return False
+        self.records[index] = record
+        self.commit()
+        return True
+
+    def get(self, timeout=None):
+        """
+        Removes the oldest record from the buffer and returns a copy of it,
+        waiting for one if the buffer is empty. Returns None once the buffer
+        is closed and empty, or if timeout seconds pass without a record
+        """
+        deadline = self._deadline(timeout)
+        self.condition.acquire()
+        try:
+            while self.count == 0:
+                if self.closed or not self._wait(deadline):
+                    return None
+            record = self.records[self.head].copy()
+            self.head = (self.head + 1) % self.capacity
+            self.count = self.count - 1
+            self.condition.notifyAll()
+            return record
+        finally:
+            self.condition.release()
+
+    def close(self):
+        """No more records will be added, wakes up everyone waiting on the buffer"""
+        self.condition.acquire()
+        try:
+            self.closed = True
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+    def _deadline(self, timeout):
+        if timeout is None:
+            return None
+        return time.time() + timeout
+
+    def _wait(self, deadline):
+        """Waits for a change, returns False if the deadline has passed. Call with the condition held"""
+        if deadline is None:
+            self.condition.wait()
+            return True
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        self.condition.wait(remaining)
+        return True
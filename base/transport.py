@@ -0,0 +1,122 @@
+#######################################################################################
+###### Transports for the generic GPIB device. A transport is the lowlevel    #########
+###### link to one instrument, GpibDevice sends every command through one.   #########
+###### Swapping the transport lets the library run against a simulated       #########
+###### instrument (see drivers/TDS_540_sim.py) instead of a real bus          #########
+#######################################################################################
+
+import time
+
+from .interface import *
+
+
+IBA_PAD = 0x1 # linux-gpib ibask option for the primary address
+IBA_TMO = 0x3 # linux-gpib ibask option for the timeout code
+IBA_BNA = 0x200 # linux-gpib ibask option for the index of the board a device is on
+
+# linux-gpib timeout codes, index i is the code of GPIB_TIMEOUTS[i] seconds (0 waits forever)
+GPIB_TIMEOUTS = (None, 10e-6, 30e-6, 100e-6, 300e-6, 1e-3, 3e-3, 10e-3, 30e-3, 100e-3, 300e-3,
+                 1.0, 3.0, 10.0, 30.0, 100.0, 300.0, 1000.0)
+IB_RQS = 0x800 # ibwait mask bit, the device requested service
+IB_TIMO = 0x4000 # ibwait mask bit, the wait timed out
+
+##IEEE 488.2 status byte bits
+STB_MAV = 0x10 # message available, there is a response to read
+STB_ESB = 0x20 # an enabled bit of the standard event status register (*esr?) is set
+STB_RQS = 0x40 # the instrument is requesting service
+##
+
+SRQ_POLL_INTERVAL = 0.005 # seconds a transport without an SRQ line waits before the device polls again
+
+
+def _timeoutCode(seconds):
+    """The shortest linux-gpib timeout code that lasts at least seconds"""
+    for code in range(1, len(GPIB_TIMEOUTS)):
+        if GPIB_TIMEOUTS[code] >= seconds:
+            return code
+    return len(GPIB_TIMEOUTS) - 1
+
+
+class Transport:
+    """
+    Interface for a link to a single instrument
+
+    board identifies the GPIB board (bus) the instrument is on,
+    instruments on the same board share the bus
+    """
+    board = 0
+
+    def write(self, command):
+        """Send command to the instrument"""
+        abstractMethod(self)
+
+    def read(self, length):
+        """Read at most length characters of the instrument's response"""
+        abstractMethod(self)
+
+    def readBinary(self, length):
+        """Read at most length bytes of the instrument's response as raw binary data"""
+        abstractMethod(self)
+
+    def serialPoll(self):
+        """The instrument's status byte (see the STB_* bits), read with a serial poll"""
+        abstractMethod(self)
+
+    def waitSRQ(self, timeout):
+        """
+        Waits at most timeout seconds on the SRQ line without any bus traffic,
+        the caller serial polls afterwards to see whether the instrument asked for service.
+        The default has no SRQ line, it just sleeps SRQ_POLL_INTERVAL (at most timeout)
+        """
+        time.sleep(max(0.0, min(timeout, SRQ_POLL_INTERVAL)))
+
+    def close(self):
+        """Release the link to the instrument, the default does nothing"""
+        pass
+
+    def isHealthy(self):
+        """Whether the link can still be used, checked before an open link is reused"""
+        return True
+
+
+class LinuxGpibTransport(Transport):
+    """
+    Transport on top of the linux-gpib python bindings,
+    name is the device name from /etc/gpib.conf
+    """
+    def __init__(self, name):
+        import gpib # imported here so that the other transports work without linux-gpib
+        self.gpib = gpib
+        self.name = name
+        self.device = gpib.find(name)
+        self.board = gpib.ask(self.device, IBA_BNA) # devices on other boards get their own BusScheduler
+
+    def write(self, command):
+        self.gpib.write(self.device, command)
+
+    def read(self, length):
+        return self.gpib.read(self.device, length)
+
+    def readBinary(self, length):
+        return self.gpib.readbin(self.device, length)
+
+    def serialPoll(self):
+        return self.gpib.serial_poll(self.device)
+
+    def waitSRQ(self, timeout):
+        previous = self.gpib.ask(self.device, IBA_TMO)
+        self.gpib.timeout(self.device, _timeoutCode(timeout))
+        try:
+            self.gpib.wait(self.device, IB_RQS | IB_TIMO) # sleeps on the SRQ line, no bus traffic
+        finally:
+            self.gpib.timeout(self.device, previous)
+
+    def close(self):
+        self.gpib.close(self.device)
+
+    def isHealthy(self):
+        try:
+            self.gpib.ask(self.device, IBA_PAD) # a local configuration query, nothing goes on the bus
+            return True
+        except Exception:
+            return False
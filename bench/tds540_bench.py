@@ -0,0 +1,182 @@
+#######################################################################################
+###### Benchmarks for the TDS540 driver, run against the simulated scope in   #########
+###### drivers/TDS_540_sim.py so that no GPIB bus is needed.                  #########
+######                                                                        #########
+###### Run from the directory above the library with                          #########
+######     python -m <library>.bench.tds540_bench --output results.json       #########
+###### and compare the json files of two versions to spot regressions         #########
+#######################################################################################
+
+import argparse
+import json
+import platform
+import sys
+import time
+import timeit
+
+from ..drivers import TDS_540
+from ..drivers.TDS_540_sim import SimulatedTDS540
+
+
+RECORD_LENGTHS = (500, 5000, 15000, 50000)
+DATA_WIDTHS = (1, 2)
+SOURCE_COUNTS = (1, 2, 3, 4)
+SOURCES = (TDS_540.DATA_SOURCE_CH1, TDS_540.DATA_SOURCE_CH2,
+           TDS_540.DATA_SOURCE_CH3, TDS_540.DATA_SOURCE_CH4)
+
+DEFAULT_REPEAT = 5
+
+
+def _timeCall(function, repeat):
+    """Calls function repeat times, returns the (best, mean) time of one call in seconds"""
+    times = list()
+    for i in range(repeat):
+        start = timeit.default_timer()
+        function()
+        times.append(timeit.default_timer() - start)
+    return min(times), sum(times) / len(times)
+
+
+def _makeScope(record_length=500, latency=0.0, byte_time=0.0, cache_max_age=TDS_540.DEFAULT_CACHE_MAX_AGE):
+    transport = SimulatedTDS540(record_length=record_length, latency=latency, byte_time=byte_time)
+    return TDS_540.TDS540_Base('simulated', cache_max_age, transport), transport
+
+
+def benchmarkWaveforms(record_lengths=RECORD_LENGTHS, data_widths=DATA_WIDTHS,
+                       source_counts=SOURCE_COUNTS, repeat=DEFAULT_REPEAT,
+                       latency=0.0, byte_time=0.0):
+    """
+    Points per second of readBinaryWaveformData (with every available decode mode)
+    and readAsciiWaveformData for every combination of record length,
+    data width and number of sources
+    """
+    decode_modes = [TDS_540.DECODE_TUPLE]
+    if TDS_540.numpy is not None:
+        decode_modes.append(TDS_540.DECODE_ARRAY)
+    results = list()
+    for record_length in record_lengths:
+        scope, transport = _makeScope(record_length, latency, byte_time)
+        scope.setReadLengthPoints(1, record_length)
+        for width in data_widths:
+            scope.setDataWidth(str(width) + '\n')
+            for count in source_counts:
+                scope.setReadChannels(SOURCES[:count])
+                points = record_length * count
+                calls = list()
+                for decode in decode_modes:
+                    calls.append(('readBinaryWaveformData', decode,
+                                  lambda decode=decode: scope.readBinaryWaveformData(decode)))
+                calls.append(('readAsciiWaveformData', None, scope.readAsciiWaveformData))
+                for method, decode, call in calls:
+                    call() # warm up, the first call also switches the encoding
+                    transactions = transport.transactions
+                    best, mean = _timeCall(call, repeat)
+                    results.append({'method' : method, 'decode' : decode,
+                                    'record_length' : record_length, 'data_width' : width,
+                                    'sources' : count, 'points' : points,
+                                    'transactions_per_call' : float(transport.transactions - transactions) / repeat,
+                                    'best_seconds' : best, 'mean_seconds' : mean,
+                                    'points_per_second' : points / best})
+    return results
+
+
+def benchmarkSettings(repeat=DEFAULT_REPEAT, latency=0.0, byte_time=0.0):
+    """
+    Latency of set/verify pairs, with the state cache on and off.
+    'changed' sets alternate between two values so that every call is sent to the scope,
+    'unchanged' sets repeat the current value
+    """
+    pairs = (('acquire_mode', lambda scope: scope.setAcquireModeAverage(),
+                              lambda scope: scope.setAcquireModeSample()),
+             ('data_width', lambda scope: scope.setDataWidth16Bit(),
+                            lambda scope: scope.setDataWidth8Bit()),
+             ('horizontal_scale', lambda scope: scope.setHorizontalScale('1.0E-3'),
+                                  lambda scope: scope.setHorizontalScale('5.0E-4')),
+             ('vertical_scale', lambda scope: scope.setCH1VerticalScale('5.0E-2'),
+                                lambda scope: scope.setCH1VerticalScale('1.0E-1')),
+             ('trigger_level', lambda scope: scope.setTriggerLevel('1.0E-1'),
+                               lambda scope: scope.setTriggerLevel('0.0E+0')))
+    results = list()
+    for cache_max_age, cache in ((TDS_540.DEFAULT_CACHE_MAX_AGE, 'on'), (0, 'off')):
+        scope, transport = _makeScope(latency=latency, byte_time=byte_time, cache_max_age=cache_max_age)
+        for name, first, second in pairs:
+            state = {'flip' : False}
+            def changed():
+                state['flip'] = not state['flip']
+                if state['flip']:
+                    first(scope)
+                else:
+                    second(scope)
+            for kind, call in (('changed', changed), ('unchanged', lambda: first(scope))):
+                call()
+                transactions = transport.transactions
+                best, mean = _timeCall(call, repeat)
+                results.append({'setting' : name, 'kind' : kind, 'cache' : cache,
+                                'transactions_per_call' : float(transport.transactions - transactions) / repeat,
+                                'best_seconds' : best, 'mean_seconds' : mean})
+        transactions = transport.transactions
+        best, mean = _timeCall(scope.verifyAllFields, repeat)
+        results.append({'setting' : 'verifyAllFields', 'kind' : 'verify', 'cache' : cache,
+                        'transactions_per_call' : float(transport.transactions - transactions) / repeat,
+                        'best_seconds' : best, 'mean_seconds' : mean})
+    return results
+
+
+def benchmarkInit(repeat=DEFAULT_REPEAT, latency=0.0, byte_time=0.0):
+    """Time it takes to connect to (and sync the driver with) a scope"""
+    transports = list()
+    def connect():
+        scope, transport = _makeScope(latency=latency, byte_time=byte_time)
+        transports.append(transport)
+    best, mean = _timeCall(connect, repeat)
+    return {'best_seconds' : best, 'mean_seconds' : mean,
+            'transactions' : transports[-1].transactions}
+
+
+def runBenchmarks(record_lengths=RECORD_LENGTHS, data_widths=DATA_WIDTHS,
+                  source_counts=SOURCE_COUNTS, repeat=DEFAULT_REPEAT,
+                  latency=0.0, byte_time=0.0):
+    """Runs every benchmark, returns the results as a json serializable dictionary"""
+    return {'environment' : {'python' : sys.version.split()[0],
+                             'platform' : platform.platform(),
+                             'numpy' : TDS_540.numpy is not None and TDS_540.numpy.__version__,
+                             'time' : time.strftime('%Y-%m-%dT%H:%M:%S')},
+            'parameters' : {'repeat' : repeat, 'latency' : latency, 'byte_time' : byte_time},
+            'init' : benchmarkInit(repeat, latency, byte_time),
+            'settings' : benchmarkSettings(repeat, latency, byte_time),
+            'waveforms' : benchmarkWaveforms(record_lengths, data_widths, source_counts,
+                                             repeat, latency, byte_time)}
+
+
+def _intList(text):
+    return [int(value) for value in text.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the TDS540 driver against a simulated scope')
+    parser.add_argument('--output', help='write the results to this json file instead of stdout')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='timed calls per measurement')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='simulated turnaround time of every bus transaction in seconds')
+    parser.add_argument('--byte-time', type=float, default=0.0,
+                        help='simulated time to move one byte over the bus in seconds')
+    parser.add_argument('--record-lengths', type=_intList, default=RECORD_LENGTHS)
+    parser.add_argument('--data-widths', type=_intList, default=DATA_WIDTHS)
+    parser.add_argument('--sources', type=_intList, default=SOURCE_COUNTS,
+                        help='numbers of sources to read at once')
+    arguments = parser.parse_args(argv)
+    results = runBenchmarks(arguments.record_lengths, arguments.data_widths, arguments.sources,
+                            arguments.repeat, arguments.latency, arguments.byte_time)
+    if arguments.output:
+        output = open(arguments.output, 'w')
+        try:
+            json.dump(results, output, indent=1, sort_keys=True)
+        finally:
+            output.close()
+    else:
+        json.dump(results, sys.stdout, indent=1, sort_keys=True)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
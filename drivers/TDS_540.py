@@ -9,7 +9,21 @@
 
 # import the generic gpib driver from the "base" package
 from ..base import gpib_base as lldriver
-from struct import unpack
+from ..base import device_pool
+from ..base import ring_buffer
+from ..base.instrumentation import Instrumentation
+from ..scope import capture
+from ..scope import averaging
+from struct import unpack_from
+import threading
+import time
+try:
+    import Queue as queue # python 2
+except ImportError:
+    import queue
+
+# numpy is optional, it is only needed for the array decode modes
+from ..base.interface import numpy, requireNumpy
 
 
 #######################List of known commnads for this device#########################
@@ -35,6 +49,54 @@ ACQUIRE_MODE_HIRES='HIR\n'						   # |
 ACQUIRE_MODE_AVERAGE='AVE\n'						   # |
 ACQUIRE_MODE_PEAKDETECT='PEAK\n'					   # |
 ACQUIRE_MODE_ENVELOPE='ENVE\n'					   # |
+								   # |
+SET_ACQUIRE_NUMAVG='acquire:numavg ' # acquisitions per average    # |
+QUERY_ACQUIRE_NUMAVG='acquire:numavg?'				   # |
+#--------------------------------------------------------------------
+
+
+#-----Single sequence acquisition commands---------------------------
+SET_ACQUIRE_STOPAFTER='acquire:stopafter '			   # |
+QUERY_ACQUIRE_STOPAFTER='acquire:stopafter?'			   # |
+ACQUIRE_STOPAFTER_SEQUENCE='SEQ\n'				   # |
+ACQUIRE_STOPAFTER_RUNSTOP='RUNST\n'				   # |
+SET_ACQUIRE_STATE_RUN='acquire:state run'			   # |
+								   # |
+CLEAR_STATUS='*cls'						   # |
+SET_EVENT_STATUS_ENABLE='*ese '					   # |
+SET_SERVICE_REQUEST_ENABLE='*sre '				   # |
+QUERY_EVENT_STATUS='*esr?'					   # |
+SET_OPERATION_COMPLETE='*opc'					   # |
+QUERY_OPERATION_COMPLETE='*opc?'				   # |
+ESR_OPC=1 # operation complete bit of the event status register   # |
+#--------------------------------------------------------------------
+
+
+#-----Measurement commands, the scope's own measurement slots--------
+MEASUREMENT_SLOTS=4 # MEAS1 to MEAS4				   # |
+SET_MEASUREMENT_TYPE='measurement:meas%d:type '			   # |
+QUERY_MEASUREMENT_TYPE='measurement:meas%d:type?'		   # |
+SET_MEASUREMENT_SOURCE='measurement:meas%d:source1 '		   # |
+QUERY_MEASUREMENT_SOURCE='measurement:meas%d:source1?'		   # |
+SET_MEASUREMENT_STATE='measurement:meas%d:state '		   # |
+QUERY_MEASUREMENT_STATE='measurement:meas%d:state?'		   # |
+QUERY_MEASUREMENT_VALUE='measurement:meas%d:value?'		   # |
+								   # |
+MEASUREMENT_STATE_ON='1\n'					   # |
+MEASUREMENT_STATE_OFF='0\n'					   # |
+								   # |
+MEASUREMENT_TYPE_AMPLITUDE='AMP\n'				   # |
+MEASUREMENT_TYPE_FALL='FALL\n'					   # |
+MEASUREMENT_TYPE_FREQUENCY='FREQ\n'				   # |
+MEASUREMENT_TYPE_MAXIMUM='MAXI\n'				   # |
+MEASUREMENT_TYPE_MEAN='MEAN\n'					   # |
+MEASUREMENT_TYPE_MINIMUM='MINI\n'				   # |
+MEASUREMENT_TYPE_PERIOD='PERI\n'				   # |
+MEASUREMENT_TYPE_PK2PK='PK2\n'					   # |
+MEASUREMENT_TYPE_RISE='RIS\n'					   # |
+MEASUREMENT_TYPE_RMS='RMS\n'					   # |
+								   # |
+MEASUREMENT_INVALID=9.9E37 # the value of a measurement that could not be made
 #--------------------------------------------------------------------
 
 
@@ -84,6 +146,7 @@ QUERY_DATA_STOP='data:stop?'
 SET_DATA_WIDTH='data:width '		 #  |
 SET_DATA_WIDTH_8BIT='data:width 1'       #  |
 SET_DATA_WIDTH_16BIT='data:width 2'      #  |
+QUERY_DATA_WIDTH='data:width?'
 
 DATA_WIDTH_8BIT = '1\n'					 #  |
 DATA_WIDTH_16BIT= '2\n'
@@ -156,6 +219,7 @@ VERTICAL_CH1='CH1'
 VERTICAL_CH2='CH2'
 VERTICAL_CH3='CH3'
 VERTICAL_CH4='CH4'
+VERTICAL_CHANNELS=(VERTICAL_CH1, VERTICAL_CH2, VERTICAL_CH3, VERTICAL_CH4)
 
 #-------Vertical Position
 SET_VERTICAL_POSITION=':position '
@@ -164,6 +228,11 @@ QUERY_VERTICAL_POSITION=':position?'
 
 QUERY_WAVEFORM_PREAMBLE='wfmpre:'
 
+# fields of the per-waveform preamble, in the order the scope sends them
+PREAMBLE_FIELDS = ('WFID', 'NR_PT', 'PT_FMT', 'XUNIT', 'XINCR', 'PT_OFF',
+                   'YUNIT', 'YMULT', 'YOFF', 'YZERO')
+PREAMBLE_NUMERIC_FIELDS = ('NR_PT', 'XINCR', 'PT_OFF', 'YMULT', 'YOFF', 'YZERO')
+
 
 ##Misc Constants related to GPIB queries
 BINARY_DATA_END_INDICATOR = '\n' # just newline
@@ -171,14 +240,160 @@ BINARY_DATA_MORE_INDICATOR = ',' #a comma
 BINARY_DATA_WAVEFORM_START = '#' 
 
 ASCII_DATA_END_INDICATOR = '\n' #just another newline
+ASCII_READ_CHUNK = 65536 # characters asked for by every read of an ascii curve
+
+CURVE_READ_CHUNK = 65536 # bytes asked for when the size of the rest of a curve is unknown
 
 ## Various python constants that come in handy
 STRUCT_SIGNED_BYTE = 'b'
 STRUCT_SIGNED_SHORT = 'h'
 
 STRUCT_BIG_ENDIAN = '>'
+
+NUMPY_SIGNED_BYTE = '>i1'   # numpy dtypes matching the struct patterns above
+NUMPY_SIGNED_SHORT = '>i2'
 ##
 
+## Every setting the driver keeps track of, read with one compound query
+## by __init__ and verifyAllFields
+FIELD_QUERIES = ([QUERY_DATA_ENCODING, QUERY_ACQUIRE_MODE, QUERY_DATA_WIDTH,
+                  QUERY_HORIZONTAL_SCALE, QUERY_HORIZONTAL_RECORDLENGTH,
+                  QUERY_DATA_START, QUERY_DATA_STOP, QUERY_DATA_SOURCE,
+                  QUERY_HORIZONTAL_POSITION, QUERY_TRIGGER_SOURCE,
+                  QUERY_TRIGGER_LEVEL, QUERY_TRIGGER_TYPE] +
+                 [channel + QUERY_VERTICAL_SCALE for channel in VERTICAL_CHANNELS] +
+                 [channel + QUERY_VERTICAL_POSITION for channel in VERTICAL_CHANNELS])
+##
+
+## State cache
+DEFAULT_CACHE_MAX_AGE = 1.0 # seconds a cached setting is trusted before it is queried again
+##
+
+## Decode modes for readBinaryWaveformData
+DECODE_TUPLE = 'tuple'      # a list with one tuple of ints per source (default)
+DECODE_ARRAY = 'array'      # a list with one numpy array per source
+DECODE_ARRAY_2D = 'array2d' # a single numpy array of shape (sources, points)
+##
+
+## How captureSingle waits for the end of the acquisition
+WAIT_OPC_QUERY = 'opc?'      # *opc? and serial polls until the answer is there
+WAIT_SERIAL_POLL = 'poll'    # *opc and serial polls until the event status bit is set
+WAIT_SRQ = 'srq'             # *opc and sleep until the scope requests service
+##
+DEFAULT_CAPTURE_TIMEOUT = 10.0 # seconds to wait for a single sequence to trigger
+
+## Operations recorded by the instrumentation, besides the bus transactions
+OP_DECODE = 'decode'          # binary curve blocks to tuples/arrays
+OP_PARSE_ASCII = 'parseAscii' # ascii curve text to tuples/arrays
+##
+
+DEFAULT_RECORD_FLUSH = 100 # frames recordToDisk writes between flushes
+
+EPOCH_HISTORY = 64 # settings epochs whose preambles and conversions are kept
+
+DEFAULT_STREAM_CAPACITY = 16 # frames buffered by streamWaveforms
+DEFAULT_RAW_BUFFERS = 4 # raw curves an AcquisitionWorker can have waiting to be decoded
+WORKER_POLL_INTERVAL = 0.1 # seconds between checks for stop() in the worker threads
+
+
+def _blockBytes(blocks):
+    """The number of sample bytes in the blocks of a curve"""
+    return sum([num_of_bytes for offset, num_of_bytes in blocks])
+
+
+def _sameSetting(a, b):
+    """
+    Compares two setting values the way the scope would,
+    i.e. '5.0E-3\n' and '.005' are the same setting
+    """
+    a = str(a).strip()
+    b = str(b).strip()
+    try:
+        return float(a) == float(b)
+    except ValueError:
+        return a.upper() == b.upper()
+
+
+def scanCurveBlocks(data, length):
+    """
+    Finds the '#y<xxx><data>' blocks of a binary curve? response held in data[:length],
+    where y is the number of chars for <xxx> and <xxx> is the number of bytes in <data>.
+    Blocks are separated by BINARY_DATA_MORE_INDICATOR and the last one is followed
+    by BINARY_DATA_END_INDICATOR.
+
+    Returns (blocks, complete) where blocks is a list with the (offset, number of bytes)
+    of the <data> of every whole block found and complete is True once the end
+    indicator has been seen. Raises an exception if the data is out of sync
+    """
+    blocks = list()
+    position = 0
+    while position < length:
+        if data[position] != ord(BINARY_DATA_WAVEFORM_START):
+            raise Exception("WAVEFORM OUT OF SYNC, expected '%s' at byte %d"
+                            % (BINARY_DATA_WAVEFORM_START, position))
+        if position + 2 > length:
+            break
+        y_length = int(chr(data[position + 1]))
+        data_start = position + 2 + y_length
+        if data_start > length:
+            break
+        num_of_bytes = int(bytes(data[position + 2:data_start]))
+        data_end = data_start + num_of_bytes
+        if data_end >= length: # the indicator byte after the data is not there yet either
+            break
+        blocks.append((data_start, num_of_bytes))
+        indicator = data[data_end]
+        if indicator == ord(BINARY_DATA_END_INDICATOR):
+            return blocks, True
+        if indicator != ord(BINARY_DATA_MORE_INDICATOR):
+            raise Exception("WAVEFORM OUT OF SYNC, BAD INDICATOR BYTE = %r" % chr(indicator))
+        position = data_end + 1
+    return blocks, False
+
+
+def parseWaveformPreamble(preamble):
+    """
+    Parses the response of a wfmpre:<wfm>? query into a dictionary
+    keyed by the names in PREAMBLE_FIELDS
+
+    Works with headers turned on (fields are matched by name) or off
+    (fields are matched by position). Numeric fields are converted to floats,
+    the rest are returned as stripped strings
+    """
+    parsed = dict()
+    fields = lldriver.splitResponse(preamble.strip())
+    for position in range(len(fields)):
+        field = fields[position].strip()
+        name = None
+        if field[:1] not in ('"', '') and ' ' in field:
+            header, value = field.split(' ', 1)
+            header = header.split(':')[-1].upper()
+            for known in PREAMBLE_FIELDS:
+                if header and known.startswith(header):
+                    name = known
+                    field = value.strip()
+                    break
+        if name is None and position < len(PREAMBLE_FIELDS):
+            name = PREAMBLE_FIELDS[position]
+        if name is None:
+            continue
+        if name in PREAMBLE_NUMERIC_FIELDS:
+            parsed[name] = float(field)
+        else:
+            parsed[name] = field.strip('"')
+    return parsed
+
+
+class ScopeState:
+    """
+    What the drivers of one scope know about it. A pooled GpibDevice is shared by
+    every driver opened for the scope, they share this too (as device.instrument_state)
+    so that a setting written by one driver is seen by the others
+    """
+    def __init__(self):
+        self.settings = dict() # query command -> (response, time it was read/written)
+        self.generation = 0    # goes up on every write, see TDS540_Base._checkForeignWrites
+
 
 class TDS540_Base:
     channels_vertical_scale = { VERTICAL_CH1 : '0', VERTICAL_CH2 : '0',
@@ -186,30 +401,59 @@ class TDS540_Base:
 
     channels_vertical_position = {VERTICAL_CH1 : '0', VERTICAL_CH2 : '0',
                                   VERTICAL_CH3 : '0', VERTICAL_CH4 : '0'}
-    def __init__(self, name):
+    def __init__(self, name, cache_max_age=DEFAULT_CACHE_MAX_AGE, transport=None, pool=device_pool.DEFAULT_POOL):
         """
         Initialize the TDS540 Scope
 
         Physical (on scope) controls have precedence over driver set controls
         Intitialization modifies no settings on the scope an instead syncs the driver
         with the settings on the scope
+
+        cache_max_age is the number of seconds a setting read from (or written to)
+        the scope is trusted before it is queried again, None trusts it forever
+        and 0 turns the state cache off
+
+        transport is handed to the GpibDevice, i.e. a SimulatedTDS540 to run without a scope.
+        Without a transport the GpibDevice is shared through pool, so creating a driver
+        for a scope that is already open does not look it up on the bus again.
+        Drivers sharing a device share its state cache too (see ScopeState)
         """
-        self.driver=lldriver.GpibDevice(name)    #initialize a generic GPIB device
-        
-        self.data_mode = self.queryDataMode()
-        self.acquire_mode = self.queryAcquireMode()
-        self.data_width = self.queryDataWidth()
-        self.horizontal_scale = self.queryHorizontalScale()
-        self.record_length = self.queryRecordLength()
-        self.num_of_data_points = self.queryReadLength()
-        self.start_point, self.stop_point = self.queryReadStartStopPoints()
-        self.data_source = self.queryReadChannels()
-        self.verifyAllVerticalScales()
-        self.verifyAllVerticalPositions()
-        self.horizontal_position = self.queryHorizontalPosition()
-        self.trigger_channel = self.queryTriggerChannel()
-        self.trigger_level = self.queryTriggerLevel()
-        self.trigger_type = self.queryTriggerType()
+        self.pool = None
+        if transport is None and pool is not None:
+            self.pool = pool
+            self.driver = pool.acquire(name)
+        else:
+            self.driver=lldriver.GpibDevice(name, transport)    #initialize a generic GPIB device
+        self.driver.lock.acquire()
+        try:
+            if self.driver.instrument_state is None:
+                self.driver.instrument_state = ScopeState()
+        finally:
+            self.driver.lock.release()
+        self.shared_state = self.driver.instrument_state
+        self.state_cache = self.shared_state.settings # shared, see ScopeState
+        self.generation = self.shared_state.generation # the last write this driver knows about
+        self.cache_max_age = cache_max_age
+        self.trust_front_panel = False
+        self.batch_responses = None # responses of the compound query being applied, see _applyBatch
+        self.preamble_cache = dict() # source -> (settings the preamble was read with, parsed preamble)
+        self.settings_epoch = 0 # see currentEpoch
+        self.epoch_key = None   # the settings of the current epoch
+        self.epochs = dict()    # epoch -> [preambles, (multiplier, offset), time axis], filled when needed
+        self.curve_buffer = bytearray() # reused by every binary curve read
+        self.source_samples = None # (sources, points) array reused by readSources
+        self.instrumentation = None # see setInstrumentation
+        self.measurement_slots = list() # (type, source) of the slots set by configureMeasurements
+        # per scope copies, so that several scopes do not share one dictionary
+        self.channels_vertical_scale = dict(self.channels_vertical_scale)
+        self.channels_vertical_position = dict(self.channels_vertical_position)
+
+        try:
+            self._syncFields()
+        except:
+            if self.pool is not None:
+                self.pool.release(self.driver) # the pooled device is not leaked by a failed driver
+            raise
         """
         self.data_mode = DATA_ENCODING_RIB #set the data to ascii
         self.driver.write(SET_DATA_ENCODING + self.data_mode) #inform the scope
@@ -235,21 +479,77 @@ class TDS540_Base:
         self.driver.write(SET_DATA_START + self.start_point)
         self.driver.write(SET_DATA_STOP + self.stop_point)
         """
+
+    def _syncFields(self):
+        """Reads every setting the driver keeps track of from the scope (or the shared cache)"""
+        self._applyBatch(FIELD_QUERIES) # every query below is answered by this one round-trip
+        try:
+            self.data_mode = self.queryDataMode()
+            self.acquire_mode = self.queryAcquireMode()
+            self.data_width = self.queryDataWidth()
+            self.horizontal_scale = self.queryHorizontalScale()
+            self.record_length = self.queryRecordLength()
+            self.num_of_data_points = self.queryReadLength()
+            self.start_point, self.stop_point = self.queryReadStartStopPoints()
+            self.data_source = self.queryReadChannels()
+            self.verifyAllVerticalScales()
+            self.verifyAllVerticalPositions()
+            self.horizontal_position = self.queryHorizontalPosition()
+            self.trigger_channel = self.queryTriggerChannel()
+            self.trigger_level = self.queryTriggerLevel()
+            self.trigger_type = self.queryTriggerType()
+        finally:
+            self.batch_responses = None
         
+    def setInstrumentation(self, instrumentation=None):
+        """
+        Times the bus transactions and the curve decoding of this scope in
+        instrumentation (a new Instrumentation if None) and returns it,
+        read the statistics with its snapshot(). A pooled GpibDevice is shared,
+        its transactions are recorded for every scope using it
+        """
+        if instrumentation is None:
+            instrumentation = Instrumentation()
+        self.instrumentation = instrumentation
+        self.driver.setInstrumentation(instrumentation)
+        return instrumentation
+
+    def clearInstrumentation(self):
+        """Stops recording, the hot paths are back to a single attribute check"""
+        self.instrumentation = None
+        self.driver.setInstrumentation(None)
+
+    def close(self):
+        """Give the GpibDevice back to the pool (or close it if it is not pooled)"""
+        if self.pool is not None:
+            self.pool.release(self.driver)
+        else:
+            self.driver.close()
+
     def verifyAllFields(self):
-        self.verifyDataMode()
-        self.verifyAcquireMode()
-        self.verifyDataWidth()
-        self.verifyHorizontalScale()
-        self.verifyRecordLength()
-        self.verifyReadLength()
-        self.verifyReadChannels()
-        self.verifyAllVerticalScales()
-        self.verifyAllVerticalPositions()
-        self.verifyHorizontalPosition()
-        self.verifyTriggerChannel()
-        self.verifyTriggerLevel()
-        self.verifyTriggerType()
+        """
+        Verifies every setting the driver keeps track of, the settings that are
+        not fresh in the state cache are read with a single compound query.
+        A false result means that the driver had to be synced
+        """
+        self._applyBatch(FIELD_QUERIES)
+        try:
+            results = [self.verifyDataMode(),
+                       self.verifyAcquireMode(),
+                       self.verifyDataWidth(),
+                       self.verifyHorizontalScale(),
+                       self.verifyRecordLength(),
+                       self.verifyReadLength(),
+                       self.verifyReadChannels(),
+                       self.verifyAllVerticalScales(),
+                       self.verifyAllVerticalPositions(),
+                       self.verifyHorizontalPosition(),
+                       self.verifyTriggerChannel(),
+                       self.verifyTriggerLevel(),
+                       self.verifyTriggerType()]
+        finally:
+            self.batch_responses = None
+        return False not in results
 
     def readWaveform(self):
         """
@@ -259,94 +559,385 @@ class TDS540_Base:
         interpret the data the correct way.
         """
          #self.driver.write(WAVEFORM_READ)
-        if data_mode == DATA_ENCODING_ASCII:
+        if self.data_mode == DATA_ENCODING_ASCII:
             return self.readAsciiWaveformData()
-        elif data_mode == DATA_ENCODING_RIB:
-            return self.readBinaryData()
+        elif self.data_mode == DATA_ENCODING_RIB:
+            return self.readBinaryWaveformData()
         else:
             return
     
-    def readAsciiWaveformData(self):
+    def readAsciiWaveformData(self, decode=None):
         """Reads whatever is in the scope buffer as a string
         and returns it as such, not a really great way to extract data
         but can be useful for diagnosing problems or quickly looking
         at numerical data
+
+        decode None returns the text, the DECODE_* modes of readBinaryWaveformData
+        parse it into the same formats (the numpy modes with numpy.fromstring)
         """
+        self._checkForeignWrites()
         if self.data_mode != DATA_ENCODING_ASCII:
-            self.driver.write(SET_DATA_ENCODING_ASCII)
+            self._writeSetting(SET_DATA_ENCODING_ASCII, QUERY_DATA_ENCODING, DATA_ENCODING_ASCII)
             self.data_mode = DATA_ENCODING_ASCII
-        self.driver.write(WAVEFORM_READ)
-        ret_string=''
-        while True:
-            ret_string=ret_string+self.driver.read(1000)
-            if (ret_string[-1]==ASCII_DATA_END_INDICATOR):
-                break
-        return ret_string
-
-    def readBinaryWaveformData(self):
+        self.driver.lock.acquire() # no other thread may talk to the scope until the curve is read
+        try:
+            self.driver.write(WAVEFORM_READ)
+            chunks = list() # joined once at the end, adding up strings is quadratic
+            while True:
+                chunk = self.driver.read(ASCII_READ_CHUNK, lldriver.PRIORITY_BULK)
+                if not chunk:
+                    raise Exception("WAVEFORM INCOMPLETE, the scope stopped sending after %d characters"
+                                    % sum([len(part) for part in chunks]))
+                chunks.append(chunk)
+                if chunk[-1] == ASCII_DATA_END_INDICATOR:
+                    break
+        finally:
+            self.driver.lock.release()
+        ret_string = ''.join(chunks)
+        if decode is None:
+            return ret_string
+        return self.parseAsciiCurve(ret_string, decode)
+
+    def parseAsciiCurve(self, text, decode=DECODE_ARRAY_2D):
+        """
+        Parses the text of an ascii curve? (comma separated values, the sources
+        one after the other) into the format selected by decode,
+        see readBinaryWaveformData
+        """
+        if self.instrumentation is None:
+            return self._parseAsciiCurve(text, decode)
+        return self.instrumentation.call(OP_PARSE_ASCII, len(text), self._parseAsciiCurve, text, decode)
+
+    def _parseAsciiCurve(self, text, decode):
+        if decode != DECODE_TUPLE:
+            requireNumpy("the %s decode mode" % decode)
+        sources = len(self.readSourceNames())
+        text = text.strip()
+        if decode == DECODE_TUPLE:
+            values = [int(value) for value in text.split(',') if value.strip()]
+        else:
+            values = numpy.fromstring(text, numpy.int32, sep=',').astype(self._sampleDtype())
+        if sources == 0 or len(values) % sources != 0:
+            raise Exception("Ascii curve of %d values does not split into %d sources" % (len(values), sources))
+        points = len(values) // sources
+        if decode == DECODE_ARRAY_2D:
+            return values.reshape((sources, points))
+        if decode == DECODE_ARRAY:
+            return list(values.reshape((sources, points)))
+        return [tuple(values[i * points:(i + 1) * points]) for i in range(sources)]
+
+    def readBinaryWaveformData(self, decode=DECODE_TUPLE):
         """This method sets the read mode to Binary (read from the scope as signed bigendian bytes)
            and then reads the waveform data from the scope and returns
            a list of tuples, wich each tuple representing the data of one channel/source
+
+           decode selects the output format, DECODE_TUPLE keeps the list of tuples,
+           DECODE_ARRAY returns a list of numpy arrays (one per source) and
+           DECODE_ARRAY_2D returns one numpy array of shape (sources, points).
+           The numpy modes decode each block with numpy.frombuffer instead of
+           building a python int for every sample.
            """
-        if self.data_mode != DATA_ENCODING_RIB:
-            self.driver.write(SET_DATA_ENCODING_BINARY)
-            self.data_mode = DATA_ENCODING_RIB
+        if decode != DECODE_TUPLE:
+            requireNumpy("the %s decode mode" % decode)
+        self._prepareBinaryRead()
+        data, blocks = self.readRawCurve()
+        return self.decodeCurve(data, blocks, decode)
 
-        count = 0
-        results_list = list()
-        self.verifyDataWidth()
+    def readSources(self):
+        """
+        Reads every source selected with setReadChannels (CH1-CH4, MATH1-3, REF1-4)
+        with a single curve? into self.source_samples, one contiguous
+        (sources, points) numpy array that is allocated once and reused while
+        the sources, read length and data width stay the same.
+
+        Returns a dictionary of source name -> that source's row of self.source_samples,
+        views rather than copies, so they are only valid until the next read.
+        Raises an exception if the scope sends a different number of
+        waveforms than there are sources selected
+        """
+        requireNumpy("readSources")
+        self._prepareBinaryRead()
+        self.verifyReadChannels()
+        sources = self.readSourceNames()
+        data, blocks = self.readRawCurve()
+        if len(blocks) != len(sources):
+            raise Exception("NUMBER OF CHANNELS READ (%d) DOES NOT MATCH NUMBER OF CHANNELS EXPECTED (%s)"
+                            % (len(blocks), ','.join(sources)))
+        width = int(self.data_width)
+        dtype = self._sampleDtype()
+        shape = (len(blocks), 0)
+        if blocks:
+            shape = (len(blocks), blocks[0][1] // width)
+        if (self.source_samples is None or self.source_samples.shape != shape
+                or self.source_samples.dtype != numpy.dtype(dtype)):
+            self.source_samples = numpy.empty(shape, dtype)
+        self.decodeCurveInto(data, blocks, self.source_samples)
+        return dict(zip(sources, self.source_samples))
+
+    def _expectedCurveLength(self):
+        """The number of bytes a curve? response should have with the current settings"""
+        num_of_bytes = self.num_of_data_points * int(self.data_width)
+        block_length = len(BINARY_DATA_WAVEFORM_START) + 1 + len(str(num_of_bytes)) + num_of_bytes + 1
+        return max(1, len(self.readSourceNames())) * block_length
+
+    def readRawCurve(self):
+        """
+        Sends curve? and reads the whole binary response into self.curve_buffer,
+        which is reused from one call to the next. The response is read in as few
+        large reads as possible and the block headers are parsed from memory afterwards
+        instead of being read a few bytes at a time. The reads are bulk priority
+        transactions of at most lldriver.BULK_CHUNK_SIZE bytes, so that other devices
+        on the board get their turn during long transfers.
+
+        Returns (data, blocks) where data is the buffer and blocks is the list
+        of (offset, number of bytes) of every source (see scanCurveBlocks),
+        data is only valid until the next call
+        """
+        data = self.curve_buffer
+        expected = self._expectedCurveLength()
+        length = 0
+        self.driver.lock.acquire() # no other thread may talk to the scope until the curve is read
+        try:
+            self.driver.write(WAVEFORM_READ)
+            while True:
+                chunk = self.driver.readBinary(max(expected - length, CURVE_READ_CHUNK), lldriver.PRIORITY_BULK)
+                if not chunk:
+                    raise Exception("WAVEFORM INCOMPLETE, the scope stopped sending after %d bytes" % length)
+                if len(data) < length + len(chunk):
+                    data.extend(bytearray(length + len(chunk) - len(data)))
+                data[length:length + len(chunk)] = chunk
+                length = length + len(chunk)
+                blocks, complete = scanCurveBlocks(data, length)
+                if complete:
+                    return data, blocks
+        finally:
+            self.driver.lock.release()
+
+    def decodeCurve(self, data, blocks, decode=DECODE_TUPLE):
+        """
+        Decodes the blocks found by readRawCurve in data to the format
+        selected by decode (see readBinaryWaveformData), the data width
+        is taken from self.data_width
+        """
+        if self.instrumentation is None:
+            return self._decodeCurve(data, blocks, decode)
+        return self.instrumentation.call(OP_DECODE, _blockBytes(blocks), self._decodeCurve, data, blocks, decode)
+
+    def _decodeCurve(self, data, blocks, decode):
+        if decode != DECODE_TUPLE:
+            requireNumpy("the %s decode mode" % decode)
+        width = int(self.data_width)
         pattern_char = STRUCT_SIGNED_BYTE # default pattern to read all bytes seperately
         if self.data_width == DATA_WIDTH_16BIT:
             pattern_char = STRUCT_SIGNED_SHORT
-        self.driver.write(WAVEFORM_READ)
-        while True:
-            """
-            Pattern for binary waveform data = '#y<xxx><data>'  where y is the number
-            of chars for <xxx> and <xxx> is the number of bytes in <data>
-            """
-            beginning_char = self.driver.readBinary(1)
-            print beginning_char
-            if beginning_char != BINARY_DATA_WAVEFORM_START:
-                print "WAVEFORM OUT OF SYNC, DO NOT TRUST THIS DATA"
-                #make an error - out of synch message
-            
-            y_length = int(self.driver.readBinary(1))
-            num_of_bytes = int(self.driver.readBinary(y_length))
-            print y_length
-            print num_of_bytes
-            points = self.driver.readBinary(num_of_bytes)
-
-            pattern_length = num_of_bytes/int(self.data_width)
-            
-            print pattern_length
-            print pattern_char
-            pattern = STRUCT_BIG_ENDIAN + pattern_char*pattern_length
-            
-            results_list.append(unpack(pattern, points))
-
-            end_byte = (self.driver.readBinary(1))
-            print end_byte
-            if end_byte == BINARY_DATA_END_INDICATOR:
-                break
-            elif end_byte == BINARY_DATA_MORE_INDICATOR:
-                continue
-            else :
-                print "WAVEFORM OUT OF SYNC DO NOT TRUST THIS DATA"
-                print "BAD INDICATOR BYTE = " + str(end_byte)
-            count = count +1
-        
-        #check to make sure the number of channels matches
-        #if self.number_of_channels != count:
-        #    print "NUMBER OF CHANNELS READ DOES NOT MATCH NUMBER OF CHANNELS EXPECTED"
+        dtype = self._sampleDtype()
+        if decode == DECODE_ARRAY_2D:
+            points = 0
+            if blocks:
+                points = blocks[0][1] // width
+            results = numpy.empty((len(blocks), points), dtype)
+            self._decodeCurveInto(data, blocks, results)
+            return results
+        results_list = list()
+        for offset, num_of_bytes in blocks:
+            count = num_of_bytes // width
+            if decode == DECODE_TUPLE:
+                pattern = '%s%d%s' % (STRUCT_BIG_ENDIAN, count, pattern_char)
+                results_list.append(unpack_from(pattern, data, offset))
+            else:
+                # copied, data is reused by the next read
+                results_list.append(numpy.frombuffer(data, dtype, count, offset).copy())
         return results_list
 
+    def decodeCurveInto(self, data, blocks, samples):
+        """
+        Decodes the blocks found by readRawCurve in data into the numpy array
+        samples, which must have the shape (sources, points) of the curve
+        """
+        if self.instrumentation is None:
+            self._decodeCurveInto(data, blocks, samples)
+        else:
+            self.instrumentation.call(OP_DECODE, _blockBytes(blocks), self._decodeCurveInto,
+                                      data, blocks, samples)
+
+    def _decodeCurveInto(self, data, blocks, samples):
+        width = samples.dtype.itemsize
+        if len(blocks) != samples.shape[0]:
+            raise Exception("Curve has %d sources, expected %d" % (len(blocks), samples.shape[0]))
+        for i in range(len(blocks)):
+            offset, num_of_bytes = blocks[i]
+            if num_of_bytes != samples.shape[1] * width:
+                raise Exception("Curve source %d has %d points, expected %d"
+                                % (i, num_of_bytes // width, samples.shape[1]))
+            samples[i] = numpy.frombuffer(data, samples.dtype, samples.shape[1], offset)
+
+    def frameDtype(self, sources, points):
+        """
+        The numpy record type of one streamed frame, the time it was read,
+        the settings epoch it was read in (see currentEpoch) and the raw samples
+        of every source
+        """
+        return numpy.dtype([('timestamp', 'f8'), ('epoch', 'i8'), ('samples', self._sampleDtype(), (sources, points))])
+
+    def _sampleDtype(self):
+        """The numpy dtype of the samples of a binary curve at the current data width"""
+        if self.data_width == DATA_WIDTH_16BIT:
+            return NUMPY_SIGNED_SHORT
+        return NUMPY_SIGNED_BYTE
+
+    def _prepareBinaryRead(self):
+        """Switches the scope to binary data and makes sure the data width is known"""
+        self._checkForeignWrites()
+        if self.data_mode != DATA_ENCODING_RIB:
+            self._writeSetting(SET_DATA_ENCODING_BINARY, QUERY_DATA_ENCODING, DATA_ENCODING_RIB)
+            self.data_mode = DATA_ENCODING_RIB
+        self.verifyDataWidth()
+
+    def streamWaveforms(self, count=None, capacity=DEFAULT_STREAM_CAPACITY,
+                        overflow=ring_buffer.OVERFLOW_DROP_OLDEST):
+        """
+        Generator that yields count binary waveform frames (forever if count is None)
+        as numpy records (see frameDtype), for acquisitions that have to run
+        for hours in constant memory.
+
+        An AcquisitionWorker keeps reading curves in the background into a RingBuffer
+        of capacity frames, overflow (ring_buffer.OVERFLOW_DROP_OLDEST or OVERFLOW_BLOCK)
+        decides what happens when the consumer falls behind. The sources and read length
+        are fixed by the first frame, do not talk to the scope from other code while
+        streaming. Closing the generator stops the acquisition
+        """
+        worker = AcquisitionWorker(self, count, capacity, overflow)
+        worker.start()
+        try:
+            for frame in worker:
+                yield frame
+        finally:
+            worker.stop()
+
+    """
+    The following methods implement the state cache, every query of a setting
+    goes through _query and every write of a setting through _writeSetting
+    so that unchanged settings cost no GPIB round-trips
+    """
+    def _cachedSetting(self, query):
+        """Returns the cached response to query, or None if it is missing or stale"""
+        if self.batch_responses is not None and query in self.batch_responses:
+            return self.batch_responses[query]
+        if self.trust_front_panel:
+            return None
+        entry = self.state_cache.get(query)
+        if entry is None:
+            return None
+        if self.cache_max_age is not None and time.time() - entry[1] > self.cache_max_age:
+            return None
+        return entry[0]
+
+    def _query(self, query, length):
+        """Query a setting, answered from the state cache if it is fresh"""
+        cached = self._cachedSetting(query)
+        if cached is not None:
+            return cached
+        response = self.driver.query(query, length)
+        self.state_cache[query] = (response, time.time())
+        return response
+
+    def _applyBatch(self, queries):
+        """
+        Reads every query that is not fresh in the cache with one compound query
+        and makes the responses answer _query until batch_responses is reset to None
+        """
+        responses = dict()
+        missing = list()
+        for query in queries:
+            cached = self._cachedSetting(query)
+            if cached is None:
+                missing.append(query)
+            else:
+                responses[query] = cached
+        if missing:
+            now = time.time()
+            for query, response in zip(missing, self.driver.queryBatch(missing)):
+                responses[query] = response
+                self.state_cache[query] = (response, now)
+        self.batch_responses = responses
+
+    def _writeSetting(self, command, query, value, snaps=False):
+        """
+        Write command (which sets the setting read by query to value)
+        unless the cache says the scope already has that value.
+
+        Settings that the scope may snap to a nearby value (scales, positions, levels...)
+        are dropped from the cache instead of being written through, so that the
+        verify that follows reads back what the scope actually accepted.
+        Returns True if the command was sent
+        """
+        cached = self._cachedSetting(query)
+        if cached is not None and _sameSetting(cached, value):
+            return False
+        self.driver.write(command)
+        self._wrote()
+        if snaps:
+            self.state_cache.pop(query, None)
+        else:
+            value = str(value)
+            if value[-1:] != '\n':
+                value = value + '\n'
+            self.state_cache[query] = (value, time.time())
+        return True
+
+    def invalidateStateCache(self, query=None):
+        """
+        Forget the cached value of query (or of every setting if query is None)
+        so that it is read from the scope the next time it is needed
+        """
+        if query is None:
+            self.state_cache.clear()
+        else:
+            self.state_cache.pop(query, None)
+        self._wrote()
+
+    def _wrote(self):
+        """
+        Tells the other drivers sharing the scope (see ScopeState) that a setting changed,
+        without losing a change of theirs this driver has not caught up with yet
+        """
+        self.driver.lock.acquire()
+        try:
+            caught_up = self.generation == self.shared_state.generation
+            self.shared_state.generation = self.shared_state.generation + 1
+            if caught_up:
+                self.generation = self.shared_state.generation
+        finally:
+            self.driver.lock.release()
+
+    def _checkForeignWrites(self):
+        """
+        Syncs the driver if another driver sharing the scope changed a setting
+        since this one last looked, the preambles and the epoch are started over.
+        Costs one comparison when nothing changed
+        """
+        if self.generation == self.shared_state.generation:
+            return
+        self.generation = self.shared_state.generation
+        self.invalidatePreambleCache()
+        self._syncFields()
+
+    def setTrustFrontPanel(self, trust=True):
+        """
+        In trust front panel mode the state cache is dropped and never consulted,
+        every verify goes to the scope and every set is written, use it while
+        someone is turning knobs on the scope
+        """
+        self.trust_front_panel = trust
+        self.invalidateStateCache()
+
     """
     The following methods are used to set the data send mode on the cope
     The intent is that only the specific setDataModeZZZ methods are used
     """
     def setDataMode(self,mode):
         self.data_mode = mode
-        self.driver.write(SET_DATA_ENCODING + mode)
+        self._writeSetting(SET_DATA_ENCODING + mode, QUERY_DATA_ENCODING, mode)
         return self.verifyDataMode()
     
     def setDataModeAscii(self):
@@ -356,8 +947,7 @@ class TDS540_Base:
         return self.setDataMode(DATA_ENCODING_BINARY)
 
     def queryDataMode(self):
-        self.driver.write(QUERY_DATA_ENCODING)
-        return self.driver.read(10)
+        return self._query(QUERY_DATA_ENCODING, 10)
 
     def verifyDataMode(self):
         """
@@ -385,7 +975,7 @@ class TDS540_Base:
         be invoked indirectly through the setAcquireModeZZZ methods
         """
         self.acquire_mode=mode
-        self.driver.write(SET_ACQUIRE_MODE + mode)
+        self._writeSetting(SET_ACQUIRE_MODE + mode, QUERY_ACQUIRE_MODE, mode)
         return self.verifyAcquireMode() # make sure that the scope accepted our request
     
     def setAcquireModeSample(self):
@@ -396,9 +986,60 @@ class TDS540_Base:
         """Set the acquire mode to hires"""
         return self.setAcquireMode(ACQUIRE_MODE_HIRES)
     
-    def setAcquireModeAverage(self):
-        """Set the acquire mode to average"""
+    def setAcquireModeAverage(self, averages=None):
+        """
+        Set the acquire mode to average, of averages acquisitions
+        (acquire:numavg) if it is given
+        """
+        if averages is not None:
+            self._writeSetting(SET_ACQUIRE_NUMAVG + str(averages), QUERY_ACQUIRE_NUMAVG, averages, snaps=True)
         return self.setAcquireMode(ACQUIRE_MODE_AVERAGE)
+
+    def queryAcquireAverages(self):
+        """The number of acquisitions the scope averages in average mode"""
+        return int(self._query(QUERY_ACQUIRE_NUMAVG, 20))
+
+    def averageWaveforms(self, count, accumulator=None, wait=None, timeout=DEFAULT_CAPTURE_TIMEOUT):
+        """
+        Adds count binary curves of the selected sources to accumulator (a new
+        scope/averaging.py Accumulator if None) straight from the raw curve buffer
+        and returns the accumulator, see its mean() and variance().
+
+        With wait (a WAIT_* mode) every curve is a fresh single sequence (see
+        captureSingle), without it the curves are read back to back whether or not
+        the scope has acquired a new one in between.
+
+        In average mode a single sequence is a whole scope average of acquire:numavg
+        acquisitions, the accumulator is told so and its depth() is count times that.
+        Back to back reads would only return copies of the same running average,
+        so in average mode wait defaults to WAIT_SERIAL_POLL
+        """
+        requireNumpy("averageWaveforms")
+        self._prepareBinaryRead()
+        self.verifyReadChannels()
+        self.verifyAcquireMode()
+        frame_averages = 1
+        if self.acquire_mode == ACQUIRE_MODE_AVERAGE:
+            frame_averages = self.queryAcquireAverages()
+            if wait is None:
+                wait = WAIT_SERIAL_POLL
+        dtype = self._sampleDtype()
+        self.driver.lock.acquire()
+        try:
+            for i in range(count):
+                if wait is not None:
+                    self.armSingleSequence(wait)
+                    self.waitForAcquisition(wait, timeout)
+                data, blocks = self.readRawCurve()
+                if accumulator is None:
+                    points = 0
+                    if blocks:
+                        points = blocks[0][1] // int(self.data_width)
+                    accumulator = averaging.Accumulator(len(blocks), points, frame_averages)
+                accumulator.addBlocks(data, blocks, dtype)
+        finally:
+            self.driver.lock.release()
+        return accumulator
     
     def setAcquireModeEnvelope(self):
         """Set the acquire mode to envelope"""
@@ -412,8 +1053,7 @@ class TDS540_Base:
         """
         Get the value of the acquire mode from the scope
         """
-        self.driver.write(QUERY_ACQUIRE_MODE)
-        return self.driver.read(10)
+        return self._query(QUERY_ACQUIRE_MODE, 10)
 
     def verifyAcquireMode(self):
 
@@ -428,6 +1068,124 @@ class TDS540_Base:
             return True
         self.acquire_mode = real_acquire_mode
         return False
+
+    """
+    The following methods take single sequence acquisitions, they wait for the
+    trigger with the scope's status reporting instead of sleeping for the worst case
+    """
+    def armSingleSequence(self, wait=WAIT_SERIAL_POLL):
+        """
+        Sets the scope to stop after one sequence and starts an acquisition,
+        with the status reporting that wait (a WAIT_* mode) needs to tell when
+        it is done. Call waitForAcquisition next
+        """
+        if wait not in (WAIT_OPC_QUERY, WAIT_SERIAL_POLL, WAIT_SRQ):
+            raise Exception("Unknown wait mode: %s" % wait)
+        self._writeSetting(SET_ACQUIRE_STOPAFTER + 'sequence', QUERY_ACQUIRE_STOPAFTER,
+                           ACQUIRE_STOPAFTER_SEQUENCE)
+        if wait == WAIT_OPC_QUERY:
+            commands = [SET_ACQUIRE_STATE_RUN, QUERY_OPERATION_COMPLETE]
+        else:
+            service_request = '0'
+            if wait == WAIT_SRQ:
+                service_request = str(lldriver.STB_ESB)
+            commands = [CLEAR_STATUS, SET_EVENT_STATUS_ENABLE + str(ESR_OPC),
+                        SET_SERVICE_REQUEST_ENABLE + service_request,
+                        SET_ACQUIRE_STATE_RUN, SET_OPERATION_COMPLETE]
+        self.driver.write(lldriver.joinCommands(commands))
+
+    def waitForAcquisition(self, wait=WAIT_SERIAL_POLL, timeout=DEFAULT_CAPTURE_TIMEOUT):
+        """
+        Waits for the acquisition started by armSingleSequence(wait) to finish.
+        Raises an exception if it takes longer than timeout seconds, the scope
+        stays armed in that case
+        """
+        if wait == WAIT_OPC_QUERY:
+            status = self.driver.waitStatus(lldriver.STB_MAV, timeout)
+        elif wait == WAIT_SERIAL_POLL:
+            status = self.driver.waitStatus(lldriver.STB_ESB, timeout)
+        else:
+            status = self.driver.waitSRQ(timeout)
+        if status is None:
+            raise Exception("Acquisition did not complete within %s seconds" % timeout)
+        if wait == WAIT_OPC_QUERY:
+            self.driver.read() # the 1 answering *opc?
+        else:
+            self.driver.query(QUERY_EVENT_STATUS) # reading the register clears it
+
+    def captureSingle(self, decode=DECODE_TUPLE, wait=WAIT_SERIAL_POLL, timeout=DEFAULT_CAPTURE_TIMEOUT):
+        """
+        Takes one single sequence acquisition and reads it as readBinaryWaveformData(decode)
+        does, as soon as the scope has triggered. See armSingleSequence for wait
+        """
+        self.driver.lock.acquire() # the status reporting must not be disturbed while waiting
+        try:
+            self.armSingleSequence(wait)
+            self.waitForAcquisition(wait, timeout)
+            return self.readBinaryWaveformData(decode)
+        finally:
+            self.driver.lock.release()
+
+    """
+    The following methods use the scope's own measurement slots, for when a few
+    numbers per trigger are enough and the whole curve does not need to be moved
+    """
+    def configureMeasurements(self, measurements):
+        """
+        Sets up the measurement slots, measurements is a list of up to MEASUREMENT_SLOTS
+        (type, source) pairs, i.e. [(MEASUREMENT_TYPE_PK2PK, 'CH1'), (MEASUREMENT_TYPE_FREQUENCY, 'CH2')].
+        Slot n gets measurements[n - 1], the slots left over are turned off.
+        Only the settings that differ from the state cache are sent
+        """
+        if len(measurements) > MEASUREMENT_SLOTS:
+            raise Exception("The scope has %d measurement slots, %d measurements asked for"
+                            % (MEASUREMENT_SLOTS, len(measurements)))
+        slots = list()
+        for slot in range(1, MEASUREMENT_SLOTS + 1):
+            if slot > len(measurements):
+                self._writeSetting(SET_MEASUREMENT_STATE % slot + 'off', QUERY_MEASUREMENT_STATE % slot,
+                                   MEASUREMENT_STATE_OFF)
+                continue
+            kind, source = measurements[slot - 1]
+            kind = kind.strip() + '\n'
+            source = source.strip().rstrip(',') + '\n' # accepts DATA_SOURCE_* too
+            self._writeSetting(SET_MEASUREMENT_TYPE % slot + kind, QUERY_MEASUREMENT_TYPE % slot, kind)
+            self._writeSetting(SET_MEASUREMENT_SOURCE % slot + source, QUERY_MEASUREMENT_SOURCE % slot, source)
+            self._writeSetting(SET_MEASUREMENT_STATE % slot + 'on', QUERY_MEASUREMENT_STATE % slot,
+                               MEASUREMENT_STATE_ON)
+            slots.append((kind, source))
+        self.measurement_slots = slots
+
+    def readMeasurements(self):
+        """
+        Reads the value of every slot set up by configureMeasurements with one
+        compound query, returns the values as floats in slot order
+        (nan for a measurement the scope could not make)
+        """
+        if not self.measurement_slots:
+            raise Exception("No measurements configured, call configureMeasurements first")
+        responses = self.driver.queryBatch([QUERY_MEASUREMENT_VALUE % slot
+                                            for slot in range(1, len(self.measurement_slots) + 1)])
+        values = list()
+        for response in responses:
+            value = float(response)
+            if value >= MEASUREMENT_INVALID:
+                value = float('nan')
+            values.append(value)
+        return values
+
+    def captureMeasurements(self, wait=WAIT_SERIAL_POLL, timeout=DEFAULT_CAPTURE_TIMEOUT):
+        """
+        Takes one single sequence acquisition (see captureSingle) and returns
+        readMeasurements of it instead of the curve
+        """
+        self.driver.lock.acquire()
+        try:
+            self.armSingleSequence(wait)
+            self.waitForAcquisition(wait, timeout)
+            return self.readMeasurements()
+        finally:
+            self.driver.lock.release()
          
 
     """
@@ -442,7 +1200,7 @@ class TDS540_Base:
         the setDataWidthZZZ methods.
         """
         self.data_width = width
-        self.driver.write(SET_DATA_WIDTH + width)
+        self._writeSetting(SET_DATA_WIDTH + width, QUERY_DATA_WIDTH, width)
         return self.verifyDataWidth()
     
     def setDataWidth8Bit(self):
@@ -452,8 +1210,7 @@ class TDS540_Base:
         return self.setDataWidth(DATA_WIDTH_16BIT)
 
     def queryDataWidth(self):
-        self.driver.write('data:width?')
-        return self.driver.read(10)
+        return self._query(QUERY_DATA_WIDTH, 10)
     
     def verifyDataWidth(self):
         """
@@ -480,12 +1237,11 @@ class TDS540_Base:
         asked for
         """
         self.horizontal_scale = scale+'\n'
-        self.driver.write(SET_HORIZONTAL_SCALE + scale)
+        self._writeSetting(SET_HORIZONTAL_SCALE + scale, QUERY_HORIZONTAL_SCALE, scale, snaps=True)
         return self.verifyHorizontalScale()
     
     def queryHorizontalScale(self):
-        self.driver.write(QUERY_HORIZONTAL_SCALE)
-        return self.driver.read(15)
+        return self._query(QUERY_HORIZONTAL_SCALE, 15)
     
     def verifyHorizontalScale(self):
         """
@@ -507,12 +1263,12 @@ class TDS540_Base:
 
     def setRecordLength(self,length) :
         self.record_length = str(length) + '\n'
-        self.driver.write(SET_HORIZONTAL_RECORDLENGTH + str(length))
+        self._writeSetting(SET_HORIZONTAL_RECORDLENGTH + str(length), QUERY_HORIZONTAL_RECORDLENGTH,
+                           length, snaps=True)
         return self.verifyRecordLength()
     
     def queryRecordLength(self) : 
-        self.driver.write(QUERY_HORIZONTAL_RECORDLENGTH)
-        return self.driver.read(15)
+        return self._query(QUERY_HORIZONTAL_RECORDLENGTH, 15)
 
     def verifyRecordLength(self) :
         real_record_length = self.queryRecordLength()
@@ -532,15 +1288,13 @@ class TDS540_Base:
         self.start_point = str(start) + '\n'
         self.stop_point = str(stop) + '\n'
         self.num_of_data_points = int(stop) - int(start) + 1 # +1 because the scope sends x->y inclusive
-        self.driver.write(SET_DATA_START + self.start_point)
-        self.driver.write(SET_DATA_STOP + self.stop_point)
+        self._writeSetting(SET_DATA_START + self.start_point, QUERY_DATA_START, start, snaps=True)
+        self._writeSetting(SET_DATA_STOP + self.stop_point, QUERY_DATA_STOP, stop, snaps=True)
         return self.verifyReadLength()
     
     def queryReadStartStopPoints(self):
-        self.driver.write(QUERY_DATA_START)
-        tmpstart = self.driver.read(20)
-        self.driver.write(QUERY_DATA_STOP)
-        tmpstop = self.driver.read(30)
+        tmpstart = self._query(QUERY_DATA_START, 20)
+        tmpstop = self._query(QUERY_DATA_STOP, 30)
         return tmpstart,tmpstop
     
     def queryReadLength(self):
@@ -564,6 +1318,48 @@ class TDS540_Base:
         self.num_of_data_points = int(len)
         return False
 
+    def setReadWindow(self, start, stop):
+        """
+        Points the read at samples start to stop (inclusive, counted from 1) of
+        the record, stop is clipped to the record length. Only the data:start/stop
+        that differ from the cached values are written and nothing is read back,
+        so moving the window costs at most two writes
+        """
+        start = int(start)
+        stop = min(int(stop), int(self.record_length))
+        if start < 1 or stop < start:
+            raise Exception("Invalid read window %d-%d for a record of %s points"
+                            % (start, stop, self.record_length.strip()))
+        self.start_point = str(start) + '\n'
+        self.stop_point = str(stop) + '\n'
+        self.num_of_data_points = stop - start + 1
+        self._writeSetting(SET_DATA_START + str(start), QUERY_DATA_START, start)
+        self._writeSetting(SET_DATA_STOP + str(stop), QUERY_DATA_STOP, stop)
+
+    def readWindow(self, start, stop, decode=DECODE_TUPLE):
+        """
+        Reads samples start to stop (inclusive, counted from 1) of the current
+        record of the selected sources, in the format readBinaryWaveformData
+        returns for decode. The read length stays set to the window afterwards
+        """
+        self.setReadWindow(start, stop)
+        return self.readBinaryWaveformData(decode)
+
+    def readPages(self, page_size, decode=DECODE_TUPLE, start=1, stop=None):
+        """
+        Generator that walks through the record from start to stop (the end of the
+        record if None) in windows of page_size samples, yields (first sample, data)
+        for every window, data as returned by readWindow. The last page may be shorter
+        """
+        if stop is None:
+            stop = int(self.record_length)
+        stop = min(int(stop), int(self.record_length))
+        first = int(start)
+        while first <= stop:
+            last = min(first + int(page_size) - 1, stop)
+            yield first, self.readWindow(first, last, decode)
+            first = last + 1
+
     """
     The following methods are used to set the channels that will be read
     """
@@ -577,12 +1373,11 @@ class TDS540_Base:
             channel_arg = channel_arg[:-1]
         channel_arg = channel_arg+'\n'
         self.data_source = channel_arg
-        self.driver.write(SET_DATA_SOURCE + self.data_source)
+        self._writeSetting(SET_DATA_SOURCE + self.data_source, QUERY_DATA_SOURCE, self.data_source)
         return self.verifyReadChannels()
 
     def queryReadChannels(self):
-        self.driver.write(QUERY_DATA_SOURCE)
-        return self.driver.read(50)
+        return self._query(QUERY_DATA_SOURCE, 50)
     
     def verifyReadChannels(self):
         """
@@ -609,7 +1404,8 @@ class TDS540_Base:
         The intent is to use the specific setZZZVerticalScale method,
         where ZZZ is the channel to be set
         """
-        self.driver.write(channel + SET_VERTICAL_SCALE + scale)
+        self._writeSetting(channel + SET_VERTICAL_SCALE + scale, channel + QUERY_VERTICAL_SCALE,
+                           scale, snaps=True)
         self.channels_vertical_scale[channel] = scale + '\n'
         return self.verifyVerticalScale(channel)
     
@@ -626,8 +1422,7 @@ class TDS540_Base:
         return self.setVerticalScale(VERTICAL_CH4,scale)
 
     def queryVerticalScale(self,channel):
-        self.driver.write(channel + QUERY_VERTICAL_SCALE)
-        return self.driver.read(20)
+        return self._query(channel + QUERY_VERTICAL_SCALE, 20)
 
     def verifyVerticalScale(self,channel):
         """
@@ -657,14 +1452,14 @@ class TDS540_Base:
     """
     
     def setHorizontalPosition(self,position):
-        self.horizontal_position = str(position)
-        self.driver.write(SET_HORIZONTAL_POSITION + position + '\n')
+        self.horizontal_position = str(position) + '\n'
+        self._writeSetting(SET_HORIZONTAL_POSITION + str(position) + '\n', QUERY_HORIZONTAL_POSITION,
+                           position, snaps=True)
         
         return self.verifyHorizontalPosition()
 
     def queryHorizontalPosition(self):
-        self.driver.write(QUERY_HORIZONTAL_POSITION)
-        return self.driver.read(20)
+        return self._query(QUERY_HORIZONTAL_POSITION, 20)
     
     def verifyHorizontalPosition(self):
         """
@@ -684,8 +1479,9 @@ class TDS540_Base:
     The following methods set the vertical position of each channel
     """
     def setVerticalPosition(self,channel,position):
-        channels_vertical_position[channel] = position + '\n'
-        self.driver.write(channel + SET_VERTICAL_POSITION + position)
+        self.channels_vertical_position[channel] = position + '\n'
+        self._writeSetting(channel + SET_VERTICAL_POSITION + position, channel + QUERY_VERTICAL_POSITION,
+                           position, snaps=True)
         return self.verifyVerticalPosition(channel)
 
     def setCH1VerticalPosition(self,position):
@@ -701,8 +1497,7 @@ class TDS540_Base:
         return self.setVerticalPosition(VERTICAL_CH4,position)
 
     def queryVerticalPosition(self,channel):
-        self.driver.write(channel + QUERY_VERTICAL_POSITION)
-        return self.driver.read(20)
+        return self._query(channel + QUERY_VERTICAL_POSITION, 20)
 
     def verifyVerticalPosition(self,channel):
         """
@@ -736,7 +1531,7 @@ class TDS540_Base:
         self.trigger_channel = channel
         if self.trigger_channel[-1] != '\n':
             self.trigger_channel = self.trigger_channel + '\n'
-        self.driver.write(SET_TRIGGER_SOURCE + channel)
+        self._writeSetting(SET_TRIGGER_SOURCE + channel, QUERY_TRIGGER_SOURCE, channel)
         return self.verifyTriggerChannel()
 
     def setTriggerToChannel1(self):
@@ -758,8 +1553,7 @@ class TDS540_Base:
         return self.setTriggerChannel(TRIGGER_SOURCE_LINE)
 
     def queryTriggerChannel(self):
-        self.driver.write(QUERY_TRIGGER_SOURCE)
-        return self.driver.read(30)
+        return self._query(QUERY_TRIGGER_SOURCE, 30)
 
     def verifyTriggerChannel(self):
         """
@@ -785,12 +1579,11 @@ class TDS540_Base:
         self.trigger_level = level
         if self.trigger_level[-1] != '\n':
             self.trigger_level = self.trigger_level + '\n'
-        self.driver.write(SET_TRIGGER_LEVEL + level)
+        self._writeSetting(SET_TRIGGER_LEVEL + level, QUERY_TRIGGER_LEVEL, level, snaps=True)
         return self.verifyTriggerLevel()
 
     def queryTriggerLevel(self):
-        self.driver.write(QUERY_TRIGGER_LEVEL)
-        return self.driver.read(15)
+        return self._query(QUERY_TRIGGER_LEVEL, 15)
 
     def verifyTriggerLevel(self):
         """
@@ -814,7 +1607,7 @@ class TDS540_Base:
         self.trigger_type = type
         if self.trigger_type[-1] != '\n':
             self.trigger_type = self.trigger_type + '\n'
-        self.driver.write(SET_TRIGGER_TYPE + type)
+        self._writeSetting(SET_TRIGGER_TYPE + type, QUERY_TRIGGER_TYPE, type)
         return self.verifyTriggerType()
 
     def setTriggerTypeEdge(self):
@@ -833,8 +1626,7 @@ class TDS540_Base:
         return self.setTriggerType(TRIGGER_TYPE_VIDEO)
 
     def queryTriggerType(self):
-        self.driver.write(QUERY_TRIGGER_TYPE)
-        return self.driver.read(20)
+        return self._query(QUERY_TRIGGER_TYPE, 20)
 
     def verifyTriggerType(self):
         """
@@ -851,8 +1643,375 @@ class TDS540_Base:
 
 
     def queryWaveformPreamble(self, channel):
-        self.driver.write(QUERY_WAVEFORM_PREAMBLE + channel + '?')
-        return self.driver.read(200)
+        return self.driver.query(QUERY_WAVEFORM_PREAMBLE + channel + '?', 200)
+
+    def _preambleSettings(self, source):
+        """
+        The driver settings that the preamble of source depends on,
+        if any of them changes the cached preamble is no longer valid
+        """
+        return (self.data_width, self.acquire_mode, self.horizontal_scale,
+                self.horizontal_position, self.record_length,
+                self.start_point, self.stop_point,
+                self.channels_vertical_scale.get(source),
+                self.channels_vertical_position.get(source))
+
+    def queryWaveformScale(self, source):
+        """
+        Returns the parsed preamble (see parseWaveformPreamble) of source.
+        The preamble is only read from the scope when the settings it depends on
+        have changed since the last time it was read
+        """
+        self._checkForeignWrites()
+        settings = self._preambleSettings(source)
+        cached = self.preamble_cache.get(source)
+        if cached is not None and cached[0] == settings:
+            return cached[1]
+        scale = parseWaveformPreamble(self.queryWaveformPreamble(source))
+        self.preamble_cache[source] = (settings, scale)
+        return scale
+
+    def readPreambles(self):
+        """The parsed (cached) preamble of every selected source, in the order of readSourceNames"""
+        return [self.queryWaveformScale(source) for source in self.readSourceNames()]
+
+    def openCapture(self, path):
+        """
+        A scope/capture.py CaptureWriter appending to path, for frames of the sources,
+        read length and data width the driver is set to. Write frames with
+        writer.writeFrame(self.readBinaryWaveformData(DECODE_ARRAY_2D), self.readPreambles())
+        """
+        return capture.CaptureWriter(path, self.readSourceNames(), self.num_of_data_points, self._sampleDtype())
+
+    def recordToDisk(self, path, count=None, duration=None, flush_every=DEFAULT_RECORD_FLUSH):
+        """
+        Records binary curves straight into the capture file at path (see openCapture)
+        until count frames were recorded or duration seconds have passed, whichever
+        comes first. Only the block headers of each curve are parsed, the raw bytes
+        go from the reused curve buffer to the file, so memory use stays the same
+        no matter how long the recording runs.
+
+        With a count the room for every frame is reserved in the file up front.
+        The frames are flushed to disk every flush_every frames.
+        The preambles are read once, do not change the settings while recording.
+        Returns the number of frames recorded
+        """
+        if count is None and duration is None:
+            raise Exception("recordToDisk needs a count or a duration")
+        self._prepareBinaryRead()
+        self.verifyReadChannels()
+        preambles = self.readPreambles()
+        writer = self.openCapture(path)
+        recorded = 0
+        try:
+            if count is not None:
+                writer.reserve(count)
+            end = None
+            if duration is not None:
+                end = time.time() + duration
+            while count is None or recorded < count:
+                if end is not None and time.time() >= end:
+                    break
+                data, blocks = self.readRawCurve()
+                writer.writeBlocks(data, blocks, preambles, time.time())
+                recorded = recorded + 1
+                if recorded % flush_every == 0:
+                    writer.flush()
+        finally:
+            writer.close()
+        return recorded
+
+    def invalidatePreambleCache(self):
+        """Forces the preambles to be read again on the next scaled read, and starts a new epoch"""
+        self.preamble_cache.clear()
+        self.epoch_key = None
+
+    def currentEpoch(self):
+        """
+        The settings epoch, a number that goes up every time one of the settings
+        the preambles of the selected sources depend on changes. It is worked out
+        from the settings the driver keeps track of, nothing is sent to the scope.
+        Frames tagged with their epoch can be converted to physical units
+        (see toVolts) long after the settings have changed
+        """
+        self._checkForeignWrites()
+        key = (self.data_source,) + tuple([self._preambleSettings(source) for source in self.readSourceNames()])
+        if key != self.epoch_key:
+            self.epoch_key = key
+            self.settings_epoch = self.settings_epoch + 1
+            self.epochs[self.settings_epoch] = [None, None, None]
+            self.epochs.pop(self.settings_epoch - EPOCH_HISTORY, None)
+        return self.settings_epoch
+
+    def _epoch(self, epoch):
+        entry = self.epochs.get(epoch)
+        if entry is None:
+            raise Exception("Settings epoch %s is unknown or was forgotten, only the last %d are kept"
+                            % (epoch, EPOCH_HISTORY))
+        return entry
+
+    def epochPreambles(self, epoch=None):
+        """
+        The parsed preambles of the sources of epoch (the current one if None),
+        in the order of readSourceNames. They are read once per epoch, so they must
+        have been asked for while epoch was current (the AcquisitionWorker does that)
+        """
+        if epoch is None:
+            epoch = self.currentEpoch()
+        entry = self._epoch(epoch)
+        if entry[0] is None:
+            if epoch != self.currentEpoch():
+                raise Exception("Settings epoch %d is over and its preambles were never read" % epoch)
+            entry[0] = self.readPreambles()
+        return entry[0]
+
+    def epochConversion(self, epoch=None):
+        """
+        (multiplier, offset) numpy arrays of shape (sources, 1) converting the raw
+        samples of epoch to physical units, volts = raw * multiplier + offset.
+        Worked out once per epoch
+        """
+        if epoch is None:
+            epoch = self.currentEpoch()
+        entry = self._epoch(epoch)
+        if entry[1] is None:
+            preambles = self.epochPreambles(epoch)
+            multiplier = numpy.array([[scale['YMULT']] for scale in preambles])
+            # volts = (raw - YOFF) * YMULT + YZERO, folded into one multiply-add
+            offset = numpy.array([[scale['YZERO'] - scale['YOFF'] * scale['YMULT']] for scale in preambles])
+            entry[1] = (multiplier, offset)
+        return entry[1]
+
+    def epochTime(self, points, epoch=None):
+        """The time in seconds (relative to the trigger) of the points samples of a frame of epoch"""
+        if epoch is None:
+            epoch = self.currentEpoch()
+        entry = self._epoch(epoch)
+        if entry[2] is None or len(entry[2]) != points:
+            preambles = self.epochPreambles(epoch)
+            time_axis = numpy.zeros(0)
+            if preambles:
+                time_axis = (numpy.arange(points) - preambles[0]['PT_OFF']) * preambles[0]['XINCR']
+            entry[2] = time_axis
+        return entry[2]
+
+    def toVolts(self, samples, epoch=None):
+        """
+        Converts raw samples read in epoch (the current one if None) to physical units,
+        samples is a (sources, points) frame or a (frames, sources, points) stack of frames
+        """
+        requireNumpy("toVolts")
+        multiplier, offset = self.epochConversion(epoch)
+        return samples * multiplier + offset
+
+    def readSourceNames(self):
+        """Returns the sources in self.data_source as a list, i.e. ['CH1', 'MATH1']"""
+        return [source.strip() for source in self.data_source.strip().split(',') if source.strip()]
+
+    def readScaledWaveform(self):
+        """
+        Reads the waveform of every selected source and converts it to
+        physical units with the conversion of the current settings epoch (see currentEpoch).
+
+        Returns (time, volts) where time is a numpy array with the time of every
+        sample in seconds (relative to the trigger) and volts is a list
+        with one numpy array per source
+        """
+        requireNumpy("readScaledWaveform")
+        raw = self.readBinaryWaveformData(DECODE_ARRAY_2D)
+        epoch = self.currentEpoch()
+        return self.epochTime(raw.shape[1], epoch), list(self.toVolts(raw, epoch))
 
 
     
+
+    """
+    The following methods are asyncio versions of the Scope methods (and the reads),
+    each one runs its blocking counterpart through GpibDevice.callAsync and returns
+    an awaitable, so several scopes can be driven from one event loop
+    """
+    def setReadChannelsAsync(self, channels):
+        return self.driver.callAsync(self.setReadChannels, channels)
+
+    def setTriggerChannelAsync(self, channel):
+        return self.driver.callAsync(self.setTriggerChannel, channel)
+
+    def setTriggerLevelAsync(self, level):
+        return self.driver.callAsync(self.setTriggerLevel, level)
+
+    def setVerticalScaleAsync(self, channel, scale):
+        return self.driver.callAsync(self.setVerticalScale, channel, scale)
+
+    def setVerticalPositionAsync(self, channel, position):
+        return self.driver.callAsync(self.setVerticalPosition, channel, position)
+
+    def setHorizontalScaleAsync(self, scale):
+        return self.driver.callAsync(self.setHorizontalScale, scale)
+
+    def setAcquireModeAsync(self, mode):
+        return self.driver.callAsync(self.setAcquireMode, mode)
+
+    def setReadLengthAsync(self, length):
+        return self.driver.callAsync(self.setReadLength, length)
+
+    def verifyAllFieldsAsync(self):
+        return self.driver.callAsync(self.verifyAllFields)
+
+    def readBinaryWaveformDataAsync(self, decode=DECODE_TUPLE):
+        return self.driver.callAsync(self.readBinaryWaveformData, decode)
+
+    def readAsciiWaveformDataAsync(self, decode=None):
+        return self.driver.callAsync(self.readAsciiWaveformData, decode)
+
+    def readScaledWaveformAsync(self):
+        return self.driver.callAsync(self.readScaledWaveform)
+
+
+class AcquisitionWorker:
+    """
+    Keeps a TDS540_Base reading binary curves on a dedicated thread while a second
+    thread decodes them, so that the transfer of curve N+1 overlaps the decoding
+    (and whatever the consumer does with) curve N.
+
+    Raw curves are handed from the transfer thread to the decode thread through
+    a queue, in a pool of raw_buffers reusable buffers, and decoded frames
+    (see TDS540_Base.frameDtype) are put in a RingBuffer of capacity frames with
+    the given overflow policy. When the decoder falls behind, the transfer thread
+    waits for a free raw buffer.
+
+    start() begins the acquisition of count frames (forever if count is None),
+    get() or iterating over the worker returns the frames, stop() ends the
+    acquisition and throws away whatever was not consumed and drain() ends it
+    and returns every frame that was already transferred.
+    The scope must not be used by other code while the worker runs
+    """
+    def __init__(self, scope, count=None, capacity=DEFAULT_STREAM_CAPACITY,
+                 overflow=ring_buffer.OVERFLOW_DROP_OLDEST, raw_buffers=DEFAULT_RAW_BUFFERS):
+        requireNumpy("AcquisitionWorker")
+        self.scope = scope
+        self.count = count
+        self.capacity = capacity
+        self.overflow = overflow
+        self.raw = queue.Queue()       # (data, blocks, timestamp, epoch) waiting to be decoded, None ends
+        self.free = queue.Queue()      # raw buffers the transfer thread can read into
+        for i in range(raw_buffers):
+            self.free.put(bytearray())
+        self.frames = None
+        self.errors = list()
+        self.running = False
+        self.transferred = 0
+        self.threads = list()
+
+    def start(self):
+        """
+        Reads the first curve (which fixes the number of sources and points)
+        and starts the transfer and decode threads. With a count of 0
+        nothing is read and the worker is finished right away
+        """
+        self.scope._prepareBinaryRead()
+        if self.count is not None and self.count <= 0:
+            self.frames = ring_buffer.RingBuffer(
+                self.capacity, self.scope.frameDtype(len(self.scope.readSourceNames()),
+                                                     self.scope.num_of_data_points), self.overflow)
+            self.frames.close()
+            return
+        data, blocks = self._transfer(self.free.get())
+        points = 0
+        if blocks:
+            points = blocks[0][1] // int(self.scope.data_width)
+        self.frames = ring_buffer.RingBuffer(self.capacity, self.scope.frameDtype(len(blocks), points),
+                                             self.overflow)
+        self.running = True
+        self.threads = [threading.Thread(target=self._transferLoop),
+                        threading.Thread(target=self._decodeLoop)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def _transfer(self, buffer):
+        """Reads one curve into the raw buffer and queues it for decoding"""
+        curve_buffer = self.scope.curve_buffer # the scope's own buffer is kept for its later reads
+        self.scope.curve_buffer = buffer
+        try:
+            data, blocks = self.scope.readRawCurve()
+        finally:
+            self.scope.curve_buffer = curve_buffer
+        epoch = self.scope.currentEpoch()
+        self.scope.epochPreambles(epoch) # read now, the frame may be converted after the epoch is over
+        self.raw.put((data, blocks, time.time(), epoch))
+        self.transferred = self.transferred + 1
+        return data, blocks
+
+    def _transferLoop(self):
+        try:
+            while self.running and (self.count is None or self.transferred < self.count):
+                # wait for a free buffer without missing a stop()
+                try:
+                    buffer = self.free.get(True, WORKER_POLL_INTERVAL)
+                except queue.Empty:
+                    continue
+                self._transfer(buffer)
+        except Exception as error:
+            self.errors.append(error)
+        self.raw.put(None)
+
+    def _decodeLoop(self):
+        try:
+            while True:
+                item = self.raw.get()
+                if item is None:
+                    break
+                data, blocks, timestamp, epoch = item
+                frame = self.frames.reserve()
+                if frame is not None:
+                    frame['timestamp'] = timestamp
+                    frame['epoch'] = epoch
+                    self.scope.decodeCurveInto(data, blocks, frame['samples'])
+                    self.frames.commit()
+                self.free.put(data)
+        except Exception as error:
+            self.errors.append(error)
+        self.frames.close()
+
+    def get(self, timeout=None):
+        """
+        The oldest decoded frame, waiting for it if needed. Returns None once the
+        acquisition has finished and every frame was read (or after timeout seconds)
+        """
+        return self.frames.get(timeout)
+
+    def __iter__(self):
+        while True:
+            frame = self.frames.get()
+            if frame is None:
+                break
+            yield frame
+        if self.errors:
+            raise self.errors[0]
+
+    def stop(self):
+        """Stops the acquisition, frames that were not consumed yet are thrown away"""
+        self.running = False
+        if self.frames is not None:
+            self.frames.close()
+        for thread in self.threads:
+            thread.join()
+
+    def drain(self):
+        """
+        Stops transferring new curves, waits for the curves already transferred
+        to be decoded and returns all the frames that were not consumed yet
+        """
+        self.running = False
+        frames = list()
+        if self.frames is not None:
+            while True:
+                frame = self.frames.get()
+                if frame is None:
+                    break
+                frames.append(frame)
+        for thread in self.threads:
+            thread.join()
+        if self.errors:
+            raise self.errors[0]
+        return frames
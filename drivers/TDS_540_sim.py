@@ -0,0 +1,353 @@
+#######################################################################################
+###### In-process simulation of a TDS540 scope, as a transport for            #########
+###### GpibDevice. Answers the commands used by drivers/TDS_540.py and sends  #########
+###### realistic '#y<len><data>' curve blocks, so the driver can be tested    #########
+###### and benchmarked without a GPIB bus                                     #########
+#######################################################################################
+
+import math
+import random
+import struct
+import time
+
+from ..base.transport import Transport, STB_MAV, STB_ESB, STB_RQS
+from .TDS_540 import *
+from ..scope import measurements
+
+
+# header -> (default value, kind), kind is one of the SIM_* kinds below
+SIM_ENUM = 'enum'       # value is abbreviated to one of SIM_ENUM_VALUES[header]
+SIM_INT = 'int'
+SIM_FLOAT = 'float'
+SIM_SOURCES = 'sources' # comma separated list of waveform sources
+SIM_BOOL = 'bool'       # on/off, answered as 1/0
+
+ESR_COMMAND_ERROR = 0x20 # standard event status bit set by a command the scope could not parse
+
+def _header(command):
+    """'acquire:mode?' or 'acquire:mode ' -> 'acquire:mode'"""
+    return command.strip().rstrip('?').lower()
+
+SIM_SETTINGS = {
+    _header(QUERY_DATA_ENCODING) : ('RIB', SIM_ENUM),
+    _header(QUERY_ACQUIRE_MODE) : ('SAM', SIM_ENUM),
+    _header(QUERY_DATA_WIDTH) : ('1', SIM_INT),
+    _header(QUERY_HORIZONTAL_SCALE) : ('5.0E-4', SIM_FLOAT),
+    _header(QUERY_HORIZONTAL_RECORDLENGTH) : ('500', SIM_INT),
+    _header(QUERY_DATA_START) : ('1', SIM_INT),
+    _header(QUERY_DATA_STOP) : ('500', SIM_INT),
+    _header(QUERY_DATA_SOURCE) : ('CH1', SIM_SOURCES),
+    _header(QUERY_HORIZONTAL_POSITION) : ('5.0E+1', SIM_FLOAT),
+    _header(QUERY_TRIGGER_SOURCE) : ('CH1', SIM_ENUM),
+    _header(QUERY_TRIGGER_LEVEL) : ('0.0E+0', SIM_FLOAT),
+    _header(QUERY_TRIGGER_TYPE) : ('EDGE', SIM_ENUM),
+    _header(QUERY_ACQUIRE_STOPAFTER) : ('RUNST', SIM_ENUM),
+    _header(QUERY_ACQUIRE_NUMAVG) : ('16', SIM_INT),
+}
+for _channel in VERTICAL_CHANNELS:
+    SIM_SETTINGS[_header(_channel + QUERY_VERTICAL_SCALE)] = ('1.0E-1', SIM_FLOAT)
+    SIM_SETTINGS[_header(_channel + QUERY_VERTICAL_POSITION)] = ('0.0E+0', SIM_FLOAT)
+for _slot in range(1, MEASUREMENT_SLOTS + 1):
+    SIM_SETTINGS[_header(QUERY_MEASUREMENT_TYPE % _slot)] = ('PERI', SIM_ENUM)
+    SIM_SETTINGS[_header(QUERY_MEASUREMENT_SOURCE % _slot)] = ('CH1', SIM_ENUM)
+    SIM_SETTINGS[_header(QUERY_MEASUREMENT_STATE % _slot)] = ('0', SIM_BOOL)
+
+# the abbreviations the scope answers with, a set value is matched by prefix
+SIM_ENUM_VALUES = {
+    _header(QUERY_DATA_ENCODING) : ('ASCI', 'RIB', 'RPB', 'SRI', 'SRP'),
+    _header(QUERY_ACQUIRE_MODE) : ('SAM', 'HIR', 'AVE', 'PEAK', 'ENVE'),
+    _header(QUERY_TRIGGER_SOURCE) : ('CH1', 'CH2', 'CH3', 'CH4', 'LINE', 'AUX'),
+    _header(QUERY_TRIGGER_TYPE) : ('EDGE', 'LOGI', 'PUL', 'COMM', 'VID'),
+    _header(QUERY_ACQUIRE_STOPAFTER) : ('RUNST', 'SEQ'),
+}
+for _slot in range(1, MEASUREMENT_SLOTS + 1):
+    SIM_ENUM_VALUES[_header(QUERY_MEASUREMENT_TYPE % _slot)] = \
+        ('AMP', 'ARE', 'BUR', 'CAR', 'CME', 'CRM', 'DEL', 'FALL', 'FREQ', 'HIGH', 'LOW', 'MAXI', 'MEAN',
+         'MINI', 'NCRO', 'NDU', 'NOV', 'NWI', 'PDU', 'PERI', 'PK2', 'POV', 'PWI', 'RIS', 'RMS')
+    SIM_ENUM_VALUES[_header(QUERY_MEASUREMENT_SOURCE % _slot)] = \
+        ('CH1', 'CH2', 'CH3', 'CH4', 'MATH1', 'MATH2', 'MATH3', 'REF1', 'REF2', 'REF3', 'REF4')
+
+# the scope/measurements.py measurement the simulator computes for a measurement type
+SIM_MEASUREMENTS = {'AMP' : None, 'FALL' : measurements.MEASURE_FALL_TIME,
+                    'FREQ' : measurements.MEASURE_FREQUENCY, 'MAXI' : measurements.MEASURE_MAXIMUM,
+                    'MEAN' : measurements.MEASURE_MEAN, 'MINI' : measurements.MEASURE_MINIMUM,
+                    'PERI' : measurements.MEASURE_PERIOD, 'PK2' : measurements.MEASURE_PEAK_TO_PEAK,
+                    'RIS' : measurements.MEASURE_RISE_TIME, 'RMS' : measurements.MEASURE_RMS}
+
+SIM_IDENTITY = 'TEKTRONIX,TDS 540,0,CF:91.1CT FV:v1.0 (simulated)'
+
+# digitizing levels per vertical division, for 1 and 2 byte data
+SIM_LEVELS_PER_DIVISION = {1 : 25, 2 : 25 * 256}
+SIM_HORIZONTAL_DIVISIONS = 10
+
+
+def _formatFloat(value):
+    """Formats value the way the scope does, i.e. 5.0E-2"""
+    return ('%.1E' % value).replace('E-0', 'E-').replace('E+0', 'E+')
+
+
+class SimulatedTDS540(Transport):
+    """
+    A transport that behaves like a TDS540 on the end of a GPIB cable
+
+    record_length sets horizontal:recordlength (and data:stop),
+    latency is the turnaround time in seconds added to every write and read
+    and byte_time is the time in seconds to move one byte over the bus
+    (1E-6 is about 1MB/s, a fast GPIB bus). Settings are kept
+    in self.settings, keyed by lowercase command header.
+
+    A single sequence acquisition (acquire:stopafter sequence, acquire:state run)
+    triggers trigger_time seconds after it is started, *opc, *opc?, *ese, *sre,
+    *esr?, *cls and serial polls behave like IEEE 488.2 status reporting
+
+    The counters transactions, bytes_written and bytes_read can be used to
+    measure how much bus traffic the driver causes
+    """
+    def __init__(self, record_length=500, latency=0.0, byte_time=0.0, sources='CH1', board=0,
+                 trigger_time=0.0):
+        self.board = board
+        self.trigger_time = trigger_time
+        self.acquisition_end = None # time the running single sequence triggers, None when stopped
+        self.event_status = 0       # *esr? register
+        self.event_enable = 0       # *ese mask
+        self.service_enable = 0     # *sre mask
+        self.opc_pending = False    # *opc waits for the acquisition
+        self.opc_query_pending = False # *opc? waits for the acquisition
+        self.command_errors = 0     # messages rejected, see write
+        self.latency = latency
+        self.byte_time = byte_time
+        self.settings = dict()
+        for header in SIM_SETTINGS:
+            self.settings[header] = SIM_SETTINGS[header][0]
+        self.settings[_header(QUERY_HORIZONTAL_RECORDLENGTH)] = str(record_length)
+        self.settings[_header(QUERY_DATA_STOP)] = str(record_length)
+        self.settings[_header(QUERY_DATA_SOURCE)] = sources.upper()
+        self.output = ''
+        self.output_position = 0
+        self.waveforms = dict() # (source, record length, width) -> list of samples
+        self.transactions = 0
+        self.bytes_written = 0
+        self.bytes_read = 0
+
+    def _busTime(self, num_of_bytes):
+        self.transactions = self.transactions + 1
+        delay = self.latency + num_of_bytes * self.byte_time
+        if delay > 0:
+            time.sleep(delay)
+
+    def write(self, command):
+        self._busTime(len(command))
+        self.bytes_written = self.bytes_written + len(command)
+        responses = list()
+        for part in command.strip().split(';'):
+            part = part.strip()
+            if part.startswith(':*'):
+                # common commands have no tree to root, like the scope the rest of the message is dropped
+                self.event_status = self.event_status | ESR_COMMAND_ERROR
+                self.command_errors = self.command_errors + 1
+                break
+            part = part.lstrip(':')
+            if not part:
+                continue
+            if ' ' in part:
+                header, value = part.split(' ', 1)
+            else:
+                header, value = part, ''
+            if header.lower() == QUERY_OPERATION_COMPLETE:
+                self.opc_query_pending = True # answered once the acquisition is done
+                self.output = ''
+            elif header.endswith('?'):
+                responses.append(self.query(header[:-1].lower()))
+            else:
+                self.set(header.lower(), value.strip())
+        if responses:
+            # a new query discards whatever was left of the previous response
+            self.output = ';'.join(responses) + '\n'
+            self.output_position = 0
+        self._updateStatus()
+
+    def read(self, length):
+        return self._take(length)
+
+    def readBinary(self, length):
+        return self._take(length)
+
+    def serialPoll(self):
+        self._busTime(1)
+        self._updateStatus()
+        status = 0
+        if self.output_position < len(self.output):
+            status = status | STB_MAV
+        if self.event_status & self.event_enable:
+            status = status | STB_ESB
+        if status & self.service_enable:
+            status = status | STB_RQS
+        return status
+
+    def _updateStatus(self):
+        """Ends the single sequence once it has triggered and completes the pending *opc(?)"""
+        if self.acquisition_end is not None and time.time() >= self.acquisition_end:
+            self.acquisition_end = None
+        if self.acquisition_end is None:
+            if self.opc_pending:
+                self.opc_pending = False
+                self.event_status = self.event_status | ESR_OPC
+            if self.opc_query_pending:
+                self.opc_query_pending = False
+                self.output = '1\n'
+                self.output_position = 0
+
+    def _take(self, length):
+        if self.opc_query_pending and self.acquisition_end is not None:
+            # like the scope, a read after *opc? only returns once the acquisition is done
+            time.sleep(max(0.0, self.acquisition_end - time.time()))
+        self._updateStatus()
+        if self.output_position >= len(self.output):
+            raise Exception("Simulated TDS540 timed out, nothing to read")
+        data = self.output[self.output_position:self.output_position + length]
+        self.output_position = self.output_position + len(data)
+        self._busTime(len(data))
+        self.bytes_read = self.bytes_read + len(data)
+        return data
+
+    def set(self, header, value):
+        """Apply a set command, unknown commands are ignored like the scope does"""
+        if header == CLEAR_STATUS:
+            self.event_status = 0
+            self.output = ''
+        elif header == SET_EVENT_STATUS_ENABLE.strip():
+            self.event_enable = int(value)
+        elif header == SET_SERVICE_REQUEST_ENABLE.strip():
+            self.service_enable = int(value)
+        elif header == SET_OPERATION_COMPLETE:
+            self.opc_pending = True
+        elif header == _header(SET_ACQUIRE_STATE_RUN.split()[0]):
+            if value.upper() in ('RUN', 'ON', '1') and self._setting(QUERY_ACQUIRE_STOPAFTER) == 'SEQ':
+                self.acquisition_end = time.time() + self.trigger_time
+            elif value.upper() in ('STOP', 'OFF', '0'):
+                self.acquisition_end = None
+        if header not in self.settings:
+            return
+        kind = SIM_SETTINGS[header][1]
+        if kind == SIM_ENUM:
+            value = value.upper()
+            for abbreviation in SIM_ENUM_VALUES[header]:
+                if value.startswith(abbreviation):
+                    self.settings[header] = abbreviation
+        elif kind == SIM_INT:
+            self.settings[header] = str(int(float(value)))
+        elif kind == SIM_FLOAT:
+            self.settings[header] = _formatFloat(float(value))
+        elif kind == SIM_BOOL:
+            self.settings[header] = str(int(value.upper() in ('ON', '1')))
+        else:
+            self.settings[header] = value.upper().replace(' ', '')
+
+    def query(self, header):
+        """The response (without terminator) to the query header?"""
+        if header in self.settings:
+            return self.settings[header]
+        if header == '*idn':
+            return SIM_IDENTITY
+        if header == QUERY_EVENT_STATUS.rstrip('?'):
+            event_status = self.event_status
+            self.event_status = 0
+            return str(event_status)
+        if header == _header(WAVEFORM_READ):
+            return self.curve()
+        if header.startswith('measurement:meas') and header.endswith(':value'):
+            return self.measurementValue(int(header[len('measurement:meas'):-len(':value')]))
+        if header.startswith(QUERY_WAVEFORM_PREAMBLE):
+            return self.preamble(header[len(QUERY_WAVEFORM_PREAMBLE):].upper())
+        return ''
+
+    def _setting(self, header_command):
+        return self.settings[_header(header_command)]
+
+    def _window(self):
+        """The (first, last) 1-based points sent by curve?, clamped to the record"""
+        record_length = int(self._setting(QUERY_HORIZONTAL_RECORDLENGTH))
+        first = max(1, int(self._setting(QUERY_DATA_START)))
+        last = min(record_length, int(self._setting(QUERY_DATA_STOP)))
+        return first, last
+
+    def sources(self):
+        return [source for source in self._setting(QUERY_DATA_SOURCE).split(',') if source]
+
+    def waveform(self, source):
+        """
+        The full record of source in digitizing levels, a sine wave
+        with a few percent of noise, different for every source
+        """
+        record_length = int(self._setting(QUERY_HORIZONTAL_RECORDLENGTH))
+        width = int(self._setting(QUERY_DATA_WIDTH))
+        key = (source, record_length, width)
+        if key not in self.waveforms:
+            generator = random.Random(source)
+            phase = generator.random() * 2 * math.pi
+            top = 2 ** (8 * width - 1) - 1
+            amplitude = 0.75 * top
+            samples = list()
+            for point in range(record_length):
+                value = amplitude * math.sin(2 * math.pi * 5 * point / float(record_length) + phase)
+                value = value + generator.gauss(0, 0.02 * amplitude)
+                samples.append(int(max(-top - 1, min(top, round(value)))))
+            self.waveforms[key] = samples
+        return self.waveforms[key]
+
+    def curve(self):
+        first, last = self._window()
+        width = int(self._setting(QUERY_DATA_WIDTH))
+        is_ascii = self._setting(QUERY_DATA_ENCODING) == DATA_ENCODING_ASCII.strip()
+        pattern_char = STRUCT_SIGNED_BYTE
+        if width == 2:
+            pattern_char = STRUCT_SIGNED_SHORT
+        blocks = list()
+        for source in self.sources():
+            samples = self.waveform(source)[first - 1:last]
+            if is_ascii:
+                blocks.append(','.join([str(sample) for sample in samples]))
+            else:
+                data = struct.pack(STRUCT_BIG_ENDIAN + pattern_char * len(samples), *samples)
+                length = str(len(data))
+                blocks.append(BINARY_DATA_WAVEFORM_START + str(len(length)) + length + data)
+        return ','.join(blocks)
+
+    def preamble(self, source):
+        """The headers-off wfmpre:<source>? response"""
+        record_length = int(self._setting(QUERY_HORIZONTAL_RECORDLENGTH))
+        width = int(self._setting(QUERY_DATA_WIDTH))
+        first, last = self._window()
+        horizontal_scale = float(self._setting(QUERY_HORIZONTAL_SCALE))
+        vertical_scale = 1.0
+        position = 0.0
+        if source in VERTICAL_CHANNELS:
+            vertical_scale = float(self._setting(source + QUERY_VERTICAL_SCALE))
+            position = float(self._setting(source + QUERY_VERTICAL_POSITION))
+        levels = SIM_LEVELS_PER_DIVISION[width]
+        trigger_point = int(record_length * float(self._setting(QUERY_HORIZONTAL_POSITION)) / 100.0)
+        fields = ['"%s, DC coupling, %.1EV/div, %.1Es/div, %d points, Sample mode"'
+                  % (source.capitalize(), vertical_scale, horizontal_scale, record_length),
+                  str(last - first + 1), 'Y', '"s"',
+                  '%.3E' % (horizontal_scale * SIM_HORIZONTAL_DIVISIONS / record_length),
+                  str(trigger_point - (first - 1)), '"V"',
+                  '%.3E' % (vertical_scale / levels),
+                  '%.3E' % (position * levels), '0.0E+0']
+        return ';'.join(fields)
+
+    def measurementValue(self, slot):
+        """
+        The value of measurement slot, worked out from the full record of its source
+        with scope/measurements.py, MEASUREMENT_INVALID if it is off or not simulated
+        """
+        kind = self._setting(QUERY_MEASUREMENT_TYPE % slot)
+        source = self._setting(QUERY_MEASUREMENT_SOURCE % slot)
+        value = MEASUREMENT_INVALID
+        if self._setting(QUERY_MEASUREMENT_STATE % slot) == '1' and SIM_MEASUREMENTS.get(kind) \
+                and measurements.numpy is not None:
+            preamble = parseWaveformPreamble(self.preamble(source))
+            value = measurements.measure(self.waveform(source), preamble, [SIM_MEASUREMENTS[kind]])
+            value = float(value[SIM_MEASUREMENTS[kind]][0])
+            if value != value: # nan
+                value = MEASUREMENT_INVALID
+        return '%.4E' % value
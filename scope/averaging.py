@@ -0,0 +1,88 @@
+#######################################################################################
+###### Host side averaging of waveform frames in exact integer arithmetic,    #########
+###### for averages deeper than the scope's own average mode allows          #########
+#######################################################################################
+
+from ..base.interface import numpy, requireNumpy
+
+
+class Accumulator:
+    """
+    Sums frames of sources x points raw samples into preallocated int64 arrays
+    (the samples and their squares), so no precision is lost however many
+    frames are added and adding a frame allocates nothing.
+
+    frame_averages is the number of acquisitions the scope already averaged into
+    every frame (acquire:numavg in average mode, 1 otherwise), the total depth
+    of the average is count * frame_averages
+    """
+    def __init__(self, sources, points, frame_averages=1):
+        requireNumpy("Accumulator")
+        self.sources = sources
+        self.points = points
+        self.frame_averages = frame_averages
+        self.total = numpy.zeros((sources, points), numpy.int64)
+        self.squares = numpy.zeros((sources, points), numpy.int64)
+        self.scratch = numpy.zeros(points, numpy.int64)
+        self.count = 0
+
+    def reset(self):
+        """Forgets every frame added so far"""
+        self.total[...] = 0
+        self.squares[...] = 0
+        self.count = 0
+
+    def _addSource(self, source, samples):
+        scratch = self.scratch
+        scratch[...] = samples
+        self.total[source] += scratch
+        scratch *= scratch
+        self.squares[source] += scratch
+
+    def add(self, samples):
+        """Adds a frame of raw samples, anything shaped (sources, points)"""
+        if len(samples) != self.sources:
+            raise Exception("Frame has %d sources, the accumulator %d" % (len(samples), self.sources))
+        for source in range(self.sources):
+            if len(samples[source]) != self.points:
+                raise Exception("Frame has %d points, the accumulator %d" % (len(samples[source]), self.points))
+            self._addSource(source, samples[source])
+        self.count = self.count + 1
+
+    def addBlocks(self, data, blocks, dtype):
+        """
+        Adds a frame straight from a raw curve? response, data and blocks as returned
+        by TDS540_Base.readRawCurve and dtype the numpy type of the samples ('>i1' or '>i2')
+        """
+        dtype = numpy.dtype(dtype)
+        if len(blocks) != self.sources:
+            raise Exception("Curve has %d sources, the accumulator %d" % (len(blocks), self.sources))
+        for source in range(self.sources):
+            offset, num_of_bytes = blocks[source]
+            if num_of_bytes != self.points * dtype.itemsize:
+                raise Exception("Curve has %d points, the accumulator %d"
+                                % (num_of_bytes // dtype.itemsize, self.points))
+            self._addSource(source, numpy.frombuffer(data, dtype, self.points, offset))
+        self.count = self.count + 1
+
+    def depth(self):
+        """The number of acquisitions in the average, on the scope and on the host"""
+        return self.count * self.frame_averages
+
+    def mean(self):
+        """The (sources, points) running mean in raw levels, as float64"""
+        if self.count == 0:
+            raise Exception("No frames accumulated")
+        return self.total / float(self.count)
+
+    def variance(self, ddof=0):
+        """
+        The (sources, points) variance of the frames in raw levels squared,
+        ddof=1 for the sample variance. With frame_averages > 1 this is the
+        spread of the scope's averages, not of single acquisitions
+        """
+        if self.count <= ddof:
+            raise Exception("Not enough frames accumulated for the variance")
+        # sum(x^2) - sum(x) * mean, the sums are exact integers, only this step is floating point
+        spread = self.squares - self.total * (self.total / float(self.count))
+        return spread / float(self.count - ddof)
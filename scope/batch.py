@@ -0,0 +1,180 @@
+#######################################################################################
+###### Batch analysis of recorded capture files on every core. The frames of  #########
+###### a set of captures are split into shards, each worker process maps only #########
+###### its shard of the file and reduces it, the partial results are merged   #########
+#######################################################################################
+#
+# A shard is (path, offset, count): count frames starting offset bytes into the
+# capture file at path. Only that tuple and the reduction functions are pickled
+# to the workers, the samples never leave the page cache.
+#
+# A reduction is a pair (function, merge). function(frames) gets the frames of a
+# shard as a numpy record array (see capture.frameDtype) and returns a partial
+# result, merge(partials) gets the partial results of every shard in file and
+# frame order and returns the final result. Both must be picklable, i.e. module
+# level functions or functools.partial of them, not lambdas or nested functions.
+#
+#   results = analyzeCaptures('/data/night', {
+#       'measurements' : (functools.partial(frameMeasurements, source=0), mergeConcatenate),
+#       'spectrum' : (powerSpectrum, mergeSum)})
+
+import fnmatch
+import multiprocessing
+import os
+
+from ..base.interface import numpy, requireNumpy
+
+from . import capture
+from . import measurements
+
+
+DEFAULT_SHARD_FRAMES = 1000 # frames reduced by one task of a worker
+DEFAULT_CAPTURE_PATTERN = '*'
+
+
+def findCaptures(directory, pattern=DEFAULT_CAPTURE_PATTERN):
+    """The capture files in directory whose names match pattern, sorted by name"""
+    paths = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if not fnmatch.fnmatch(name, pattern) or not os.path.isfile(path):
+            continue
+        capture_file = open(path, 'rb')
+        try:
+            if capture_file.read(len(capture.CAPTURE_MAGIC)) == capture.CAPTURE_MAGIC:
+                paths.append(path)
+        finally:
+            capture_file.close()
+    return paths
+
+
+def shardCaptures(paths, frames_per_shard=DEFAULT_SHARD_FRAMES):
+    """Splits the complete frames of the capture files at paths into (path, offset, count) shards"""
+    shards = []
+    for path in paths:
+        reader = capture.CaptureReader(path)
+        try:
+            frames = len(reader)
+            for first in range(0, frames, frames_per_shard):
+                shards.append((path, reader.frameOffset(first), min(frames_per_shard, frames - first)))
+        finally:
+            reader.close()
+    return shards
+
+
+def mapShard(path, offset, count):
+    """The count frames at offset of the capture file at path, as a read only memmap"""
+    requireNumpy("mapShard")
+    capture_file = open(path, 'rb')
+    try:
+        header = capture.readHeader(capture_file)
+    finally:
+        capture_file.close()
+    dtype = capture.frameDtype(len(header['sources']), header['points'], header['sample_dtype'])
+    return numpy.memmap(path, dtype, 'r', offset, (count,))
+
+
+def _reduceShard(task):
+    """Runs in the worker: maps the shard and applies every reduction to it"""
+    path, offset, count, functions = task
+    frames = mapShard(path, offset, count)
+    partials = [function(frames) for function in functions]
+    del frames # unmaps the shard before the next task maps another one
+    return partials
+
+
+def analyze(paths, reductions, frames_per_shard=DEFAULT_SHARD_FRAMES, processes=None):
+    """
+    Applies reductions (a dictionary of name -> (function, merge), see the top of
+    the file) to every frame of the capture files at paths and returns a dictionary
+    of name -> merged result. The shards are spread over a pool of processes
+    workers (one per core if None), processes=1 runs everything in this process
+    """
+    requireNumpy("analyze")
+    names = list(reductions)
+    functions = [reductions[name][0] for name in names]
+    tasks = [(path, offset, count, functions)
+             for path, offset, count in shardCaptures(paths, frames_per_shard)]
+    if processes == 1:
+        shard_results = [_reduceShard(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            # one shard per task, in order, so no worker waits on a batch of slow shards
+            shard_results = list(pool.imap(_reduceShard, tasks, 1))
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    results = dict()
+    for i in range(len(names)):
+        merge = reductions[names[i]][1]
+        results[names[i]] = merge([partials[i] for partials in shard_results])
+    return results
+
+
+def analyzeCaptures(directory, reductions, pattern=DEFAULT_CAPTURE_PATTERN,
+                    frames_per_shard=DEFAULT_SHARD_FRAMES, processes=None):
+    """analyze of every capture file in directory (see findCaptures)"""
+    return analyze(findCaptures(directory, pattern), reductions, frames_per_shard, processes)
+
+
+##Merges
+def mergeConcatenate(partials):
+    """
+    Joins per frame results along the frames: arrays are concatenated,
+    dictionaries of arrays (like frameMeasurements) key by key
+    """
+    if not partials:
+        return partials
+    if isinstance(partials[0], dict):
+        return dict((key, numpy.concatenate([partial[key] for partial in partials]))
+                    for key in partials[0])
+    return numpy.concatenate(partials)
+
+
+def mergeSum(partials):
+    """Adds up the partial results, tuples (i.e. a sum and a count) element by element"""
+    if not partials:
+        return None
+    if isinstance(partials[0], tuple):
+        return tuple(sum(parts[1:], parts[0]) for parts in zip(*partials))
+    return sum(partials[1:], partials[0])
+##
+
+
+##Reductions
+def frameVolts(frames, source=0):
+    """The samples of source (an index) of every frame in volts, each with the preamble stored with it"""
+    preamble = frames['preamble'][:, source]
+    samples = frames['samples'][:, source].astype(numpy.float64)
+    return (samples - preamble['YOFF'][:, None]) * preamble['YMULT'][:, None] + preamble['YZERO'][:, None]
+
+
+def frameMeasurements(frames, source=0, measures=measurements.DEFAULT_MEASUREMENTS):
+    """
+    scope/measurements.py measure of source of every frame, in volts and seconds.
+    Merge with mergeConcatenate
+    """
+    results = measurements.measure(frameVolts(frames, source), None, measures)
+    sample_time = frames['preamble'][:, source]['XINCR']
+    for measurement in results:
+        if measurement in (measurements.MEASURE_RISE_TIME, measurements.MEASURE_FALL_TIME,
+                           measurements.MEASURE_PERIOD):
+            results[measurement] = results[measurement] * sample_time
+        elif measurement == measurements.MEASURE_FREQUENCY:
+            results[measurement] = results[measurement] / sample_time
+    return results
+
+
+def powerSpectrum(frames, source=0):
+    """
+    The summed power spectrum (|rfft|^2 of the volts) of source over the frames
+    and the number of frames, merge with mergeSum and divide for the average
+    """
+    spectrum = numpy.fft.rfft(frameVolts(frames, source), axis=1)
+    power = spectrum.real ** 2 + spectrum.imag ** 2
+    return power.sum(axis=0), len(frames)
+##
@@ -0,0 +1,290 @@
+#######################################################################################
+###### Capture files: an append-only binary file of waveform frames, the raw  #########
+###### samples as the scope sent them plus the scaling and time of each frame. #########
+###### CaptureWriter appends frames, CaptureReader mmaps the file and hands    #########
+###### out numpy views so captures larger than memory can be scanned           #########
+#######################################################################################
+#
+# Layout, all the numbers little endian except the samples:
+#   header   HEADER_SIZE bytes, HEADER_FORMAT padded with zeros
+#   frame 0  framePrefixFormat (timestamp and the PREAMBLE_FIELDS of every source)
+#            followed by the samples of every source, as sent by curve? (big endian)
+#   frame 1  ...
+# Every frame of a file has the same size, so frame i starts at
+# HEADER_SIZE + i * frame_size and the frame count follows from the file size.
+# A frame cut short by a crash is ignored by the reader.
+# A writer that reserves room for frames ahead of time (CaptureWriter.reserve) makes
+# the file longer than its frames, it keeps the frame count in the header instead
+# and updates it on every flush.
+
+import mmap
+import os
+import struct
+import time
+
+from ..base.interface import numpy, requireNumpy
+
+
+CAPTURE_MAGIC = b'SCOPECAP'
+CAPTURE_VERSION = 1
+HEADER_SIZE = 256
+# magic, version, header size, frame size, sources, points, sample dtype, source names,
+# whether the frame count is kept in the header and the frame count
+HEADER_FORMAT = '<8sIIIII8s200sIQ'
+COUNT_FORMAT = '<IQ' # the last two fields of the header
+COUNT_OFFSET = struct.calcsize(HEADER_FORMAT) - struct.calcsize(COUNT_FORMAT)
+
+WRITE_BUFFER_SIZE = 1024 * 1024 # bytes buffered by a CaptureWriter before they go to the file
+
+# the numeric fields of a parsed preamble (see drivers/TDS_540.py parseWaveformPreamble)
+# stored with every frame, fields missing from a preamble are stored as nan
+PREAMBLE_FIELDS = ('XINCR', 'PT_OFF', 'YMULT', 'YOFF', 'YZERO')
+
+SAMPLE_DTYPES = ('>i1', '>i2') # signed big endian bytes and shorts, as the scope sends them
+
+
+def framePrefixFormat(sources):
+    """struct format of the timestamp and preambles in front of the samples of a frame"""
+    return '<d' + 'd' * len(PREAMBLE_FIELDS) * sources
+
+
+def frameSize(sources, points, sample_dtype):
+    """Bytes taken by one frame"""
+    width = int(sample_dtype[-1])
+    return struct.calcsize(framePrefixFormat(sources)) + sources * points * width
+
+
+def frameDtype(sources, points, sample_dtype):
+    """The numpy record type of one frame as it is stored in the file"""
+    requireNumpy("frameDtype")
+    preamble = numpy.dtype([(name, '<f8') for name in PREAMBLE_FIELDS])
+    return numpy.dtype([('timestamp', '<f8'), ('preamble', preamble, (sources,)),
+                        ('samples', sample_dtype, (sources, points))])
+
+
+def _packHeader(sources, points, sample_dtype):
+    names = ','.join(sources).encode('ascii')
+    header = struct.pack(HEADER_FORMAT, CAPTURE_MAGIC, CAPTURE_VERSION, HEADER_SIZE,
+                         frameSize(len(sources), points, sample_dtype), len(sources), points,
+                         sample_dtype.encode('ascii'), names, 0, 0)
+    return header + b'\0' * (HEADER_SIZE - len(header))
+
+
+def readHeader(capture_file):
+    """
+    Reads the header at the start of the open capture_file, returns a dictionary with
+    version, header_size, frame_size, sources (a list of names), points, sample_dtype
+    and frames, the frame count if it is kept in the header (None if it follows from the file size)
+    """
+    capture_file.seek(0)
+    data = capture_file.read(struct.calcsize(HEADER_FORMAT))
+    if len(data) < struct.calcsize(HEADER_FORMAT):
+        raise Exception("Not a capture file, the header is cut short")
+    magic, version, header_size, frame_size, sources, points, sample_dtype, names, counted, frames = \
+        struct.unpack(HEADER_FORMAT, data)
+    if magic != CAPTURE_MAGIC:
+        raise Exception("Not a capture file, bad magic %r" % magic)
+    if version != CAPTURE_VERSION:
+        raise Exception("Unsupported capture file version %d" % version)
+    names = names.rstrip(b'\0').decode('ascii')
+    if not counted:
+        frames = None
+    return {'version' : version, 'header_size' : header_size, 'frame_size' : frame_size,
+            'sources' : [name for name in names.split(',') if name], 'points' : points,
+            'sample_dtype' : sample_dtype.rstrip(b'\0').decode('ascii'),
+            'frames' : frames}
+
+
+class CaptureWriter:
+    """
+    Appends frames to the capture file at path, every frame holds points samples
+    of each of the sources (a list of names) in sample_dtype (one of SAMPLE_DTYPES).
+
+    If the file already exists and was written with the same layout the frames are
+    added at its end, otherwise it is created. Frames only ever go after the last frame,
+    the header is only rewritten to keep the frame count once reserve has been used.
+    buffering is the size of the write buffer in bytes
+    """
+    def __init__(self, path, sources, points, sample_dtype='>i1', buffering=WRITE_BUFFER_SIZE):
+        if sample_dtype not in SAMPLE_DTYPES:
+            raise Exception("Unsupported sample type %s, use one of %s" % (sample_dtype, SAMPLE_DTYPES))
+        self.path = path
+        self.sources = list(sources)
+        self.points = int(points)
+        self.sample_dtype = sample_dtype
+        self.frame_size = frameSize(len(self.sources), self.points, sample_dtype)
+        self.sample_bytes = self.points * int(sample_dtype[-1]) # bytes of one source in a frame
+        self.prefix = struct.Struct(framePrefixFormat(len(self.sources)))
+        self.prefix_values = [0.0] * (1 + len(PREAMBLE_FIELDS) * len(self.sources))
+        self.counted = False # whether the frame count is kept in the header
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self.file = open(path, 'r+b', buffering)
+            header = readHeader(self.file)
+            if (header['sources'] != self.sources or header['points'] != self.points
+                    or header['sample_dtype'] != sample_dtype):
+                self.file.close()
+                raise Exception("Capture file %s holds %s x %d %s frames, cannot append %s x %d %s frames"
+                                % (path, ','.join(header['sources']), header['points'], header['sample_dtype'],
+                                   ','.join(self.sources), self.points, sample_dtype))
+            self.frames = (os.path.getsize(path) - HEADER_SIZE) // self.frame_size
+            if header['frames'] is not None:
+                self.frames = min(self.frames, header['frames'])
+                self.counted = True
+            self.file.truncate(HEADER_SIZE + self.frames * self.frame_size) # drop a frame cut short
+            self.file.seek(0, os.SEEK_END)
+        else:
+            self.file = open(path, 'wb', buffering)
+            self.file.write(_packHeader(self.sources, self.points, sample_dtype))
+            self.file.flush() # readers can open the capture right away
+            self.frames = 0
+
+    def _writePrefix(self, preambles, timestamp):
+        if timestamp is None:
+            timestamp = time.time()
+        values = self.prefix_values
+        values[0] = timestamp
+        position = 1
+        for i in range(len(self.sources)):
+            preamble = dict()
+            if preambles is not None:
+                preamble = preambles[i]
+            for name in PREAMBLE_FIELDS:
+                values[position] = preamble.get(name, float('nan'))
+                position = position + 1
+        self.file.write(self.prefix.pack(*values))
+
+    def writeFrame(self, samples, preambles=None, timestamp=None):
+        """
+        Appends one frame. samples is anything numpy can turn into a (sources, points)
+        array (i.e. the result of readBinaryWaveformData in any decode mode),
+        preambles a list with the parsed preamble of every source (or None)
+        and timestamp the time of the frame (now if None)
+        """
+        requireNumpy("CaptureWriter.writeFrame")
+        samples = numpy.asarray(samples)
+        if samples.shape != (len(self.sources), self.points):
+            raise Exception("Frame of shape %s does not fit a capture of %d sources x %d points"
+                            % (samples.shape, len(self.sources), self.points))
+        self._writePrefix(preambles, timestamp)
+        self.file.write(samples.astype(self.sample_dtype).tobytes())
+        self.frames = self.frames + 1
+
+    def writeBlocks(self, data, blocks, preambles=None, timestamp=None):
+        """
+        Appends one frame straight from a raw curve? response without decoding it,
+        data and blocks as returned by TDS540_Base.readRawCurve
+        """
+        if len(blocks) != len(self.sources):
+            raise Exception("Curve has %d sources, the capture holds %d" % (len(blocks), len(self.sources)))
+        for offset, num_of_bytes in blocks:
+            if num_of_bytes != self.sample_bytes:
+                raise Exception("Curve block of %d bytes, the capture holds %d bytes per source"
+                                % (num_of_bytes, self.sample_bytes))
+        self._writePrefix(preambles, timestamp)
+        view = memoryview(data)
+        for offset, num_of_bytes in blocks:
+            self.file.write(view[offset:offset + num_of_bytes])
+        self.frames = self.frames + 1
+
+    def reserve(self, frames):
+        """
+        Makes room in the file for frames more frames up front, so that a long
+        recording does not grow (and fragment) the file frame by frame.
+        From then on the frame count is kept in the header
+        """
+        self.file.flush()
+        end = HEADER_SIZE + (self.frames + frames) * self.frame_size
+        size = os.fstat(self.file.fileno()).st_size
+        if end > size:
+            if hasattr(os, 'posix_fallocate'): # python 3.3 and later
+                os.posix_fallocate(self.file.fileno(), size, end - size)
+            else:
+                self.file.truncate(end)
+        self.counted = True
+        self._writeCount()
+
+    def _writeCount(self):
+        """Stores the frame count in the header, the frames must be flushed first"""
+        self.file.seek(COUNT_OFFSET)
+        self.file.write(struct.pack(COUNT_FORMAT, 1, self.frames))
+        self.file.seek(HEADER_SIZE + self.frames * self.frame_size)
+        self.file.flush()
+
+    def flush(self):
+        """Pushes the frames written so far to the file"""
+        self.file.flush()
+        if self.counted:
+            self._writeCount()
+
+    def close(self):
+        """Writes out the frames and gives back the room reserved for frames that were not written"""
+        self.flush()
+        if self.counted:
+            self.file.truncate(HEADER_SIZE + self.frames * self.frame_size)
+        self.file.close()
+
+
+class CaptureReader:
+    """
+    Memory maps the capture file at path. self.frames is a numpy record array
+    (see frameDtype) viewing every complete frame in the file, indexing it
+    only pages in the frames that are used. The views are only valid until close
+    """
+    def __init__(self, path):
+        requireNumpy("CaptureReader")
+        self.path = path
+        self.file = open(path, 'rb')
+        try:
+            header = readHeader(self.file)
+            self.sources = header['sources']
+            self.points = header['points']
+            self.sample_dtype = header['sample_dtype']
+            self.header_size = header['header_size']
+            self.frame_size = header['frame_size']
+            self.dtype = frameDtype(len(self.sources), self.points, self.sample_dtype)
+            if self.dtype.itemsize != self.frame_size:
+                raise Exception("Capture frame size %d does not match its layout (%d)"
+                                % (self.frame_size, self.dtype.itemsize))
+            count = (os.fstat(self.file.fileno()).st_size - self.header_size) // self.frame_size
+            if header['frames'] is not None:
+                count = min(count, header['frames'])
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self.file.close()
+            raise
+        self.frames = numpy.frombuffer(self.map, self.dtype, count, self.header_size)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, index):
+        return self.frames[index]
+
+    def frameOffset(self, index):
+        """Where frame index starts in the file"""
+        return self.header_size + index * self.frame_size
+
+    def timestamps(self):
+        """The time of every frame, a view"""
+        return self.frames['timestamp']
+
+    def samples(self, index, source=None):
+        """The raw (sources, points) samples of frame index, or the points of one source (by name)"""
+        if source is None:
+            return self.frames['samples'][index]
+        return self.frames['samples'][index][self.sources.index(source)]
+
+    def volts(self, index, source):
+        """Frame index of source (by name) converted to physical units with its stored preamble"""
+        i = self.sources.index(source)
+        preamble = self.frames['preamble'][index][i]
+        return (self.frames['samples'][index][i] - preamble['YOFF']) * preamble['YMULT'] + preamble['YZERO']
+
+    def close(self):
+        """Unmaps the file, every array handed out before becomes invalid"""
+        self.frames = None
+        try:
+            self.map.close()
+        except BufferError:
+            pass # a view is still alive, the map is closed once it is garbage collected
+        self.file.close()
@@ -0,0 +1,122 @@
+#######################################################################################
+###### Decimation of waveform frames for display. A frame is reduced to one   #########
+###### min/max pair per pixel column (or to a few points picked by LTTB)      #########
+###### so that drawing it costs the width of the screen, not the record length #########
+#######################################################################################
+#
+# Everything works on the raw samples (int8/int16 as decoded by the driver) of a
+# (points,) frame, a (sources, points) frame or any stack of them, the points are
+# always the last axis. Scale the (much smaller) result to volts afterwards,
+# i.e. with TDS540_Base.toVolts. With a negative YMULT the scaled minimum and
+# maximum swap places.
+
+from ..base.interface import numpy, requireNumpy
+
+
+##Decimation methods
+DECIMATE_MINMAX = 'minmax' # the smallest and largest sample of every bucket
+DECIMATE_LTTB = 'lttb'     # largest triangle three buckets, one sample per bucket
+##
+
+
+def bucketEdges(points, buckets):
+    """The first sample of each of buckets (nearly) equal buckets over points samples"""
+    return (numpy.arange(buckets) * points) // buckets
+
+
+def minMaxEnvelope(samples, buckets):
+    """
+    Splits the points of samples into buckets buckets and returns (minimums, maximums),
+    two arrays shaped like samples with buckets points, in the type of samples.
+    A frame with no more points than buckets is returned as it is (twice)
+    """
+    requireNumpy("minMaxEnvelope")
+    if buckets < 1:
+        raise ValueError("minMaxEnvelope needs at least one bucket, not %d" % buckets)
+    samples = numpy.asarray(samples)
+    points = samples.shape[-1]
+    if points <= buckets:
+        return samples, samples
+    edges = bucketEdges(points, buckets)
+    return (numpy.minimum.reduceat(samples, edges, axis=-1),
+            numpy.maximum.reduceat(samples, edges, axis=-1))
+
+
+def envelopeLine(minimums, maximums):
+    """
+    Interleaves an envelope into a single line that zigzags from the minimum to the
+    maximum of every bucket, returns (bucket index, value) arrays with twice the points,
+    ready to be drawn as one line
+    """
+    shape = minimums.shape[:-1] + (2 * minimums.shape[-1],)
+    line = numpy.empty(shape, minimums.dtype)
+    line[..., 0::2] = minimums
+    line[..., 1::2] = maximums
+    return numpy.arange(shape[-1]) // 2, line
+
+
+def lttb(samples, threshold):
+    """
+    Largest triangle three buckets: picks threshold samples of every frame that
+    keep its visual shape, always including the first and last sample.
+    Returns (indices, values), both shaped like samples with threshold points,
+    the indices differ from frame to frame. The loop is over the threshold buckets,
+    all the frames and the points of a bucket are handled at once.
+    A threshold below 3 leaves no room for the middle buckets and raises ValueError
+    """
+    requireNumpy("lttb")
+    if threshold < 3:
+        raise ValueError("LTTB needs a threshold of at least 3, not %d" % threshold)
+    samples = numpy.asarray(samples)
+    points = samples.shape[-1]
+    if points <= threshold:
+        indices = numpy.broadcast_to(numpy.arange(points), samples.shape)
+        return numpy.array(indices), samples
+    frames = samples.reshape((-1, points))
+    values = frames.astype(numpy.float64)
+    rows = numpy.arange(frames.shape[0])
+    selected = numpy.zeros((frames.shape[0], threshold), numpy.intp)
+    selected[:, -1] = points - 1
+    every = (points - 2) / float(threshold - 2)
+    previous = numpy.zeros(frames.shape[0], numpy.intp) # the sample picked in the last bucket
+    for bucket in range(threshold - 2):
+        start = int(bucket * every) + 1
+        end = int((bucket + 1) * every) + 1
+        next_start = end
+        next_end = min(int((bucket + 2) * every) + 1, points)
+        if bucket == threshold - 3:
+            next_start, next_end = points - 1, points # the last sample is the next point
+        next_x = (next_start + next_end - 1) / 2.0
+        next_y = values[:, next_start:next_end].mean(axis=1)
+        previous_y = values[rows, previous]
+        x = numpy.arange(start, end)
+        # twice the area of the triangle (previous, candidate, average of the next bucket)
+        area = numpy.abs((previous - next_x)[:, None] * (values[:, start:end] - previous_y[:, None])
+                         - (previous[:, None] - x) * (next_y - previous_y)[:, None])
+        previous = start + numpy.argmax(area, axis=1)
+        selected[:, bucket + 1] = previous
+    picked = frames[rows[:, None], selected]
+    return selected.reshape(samples.shape[:-1] + (threshold,)), picked.reshape(samples.shape[:-1] + (threshold,))
+
+
+def decimate(samples, buckets, method=DECIMATE_MINMAX):
+    """minMaxEnvelope or lttb of samples, by method"""
+    if method == DECIMATE_MINMAX:
+        return minMaxEnvelope(samples, buckets)
+    if method == DECIMATE_LTTB:
+        return lttb(samples, buckets)
+    raise Exception("Unknown decimation method: %s" % method)
+
+
+def decimateFrames(frames, buckets, method=DECIMATE_MINMAX):
+    """
+    Generator stage for continuous acquisitions: for every frame of the iterable frames
+    (i.e. TDS540_Base.streamWaveforms, or arrays of raw samples) yields (frame, decimated)
+    where decimated is decimate(samples of the frame, buckets, method).
+    Frames are pulled one at a time, nothing is buffered
+    """
+    for frame in frames:
+        samples = frame
+        if getattr(getattr(frame, 'dtype', None), 'names', None) and 'samples' in frame.dtype.names:
+            samples = frame['samples']
+        yield frame, decimate(samples, buckets, method)
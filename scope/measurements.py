@@ -0,0 +1,177 @@
+#######################################################################################
+###### Host side measurements over stacks of waveform frames. Every function  #########
+###### works on a whole (frames, samples) numpy array at once, so thousands    #########
+###### of frames are reduced without a python loop over frames or samples     #########
+#######################################################################################
+#
+# A stack is the raw samples of one source, i.e. readBinaryWaveformData(DECODE_ARRAY_2D)
+# of several frames stacked with numpy.array, the 'samples' of streamed frames
+# (frames['samples'][:, source]) or the frames of a capture file (see scope/capture.py).
+# The preamble is the parsed preamble of that source (TDS540_Base.queryWaveformScale),
+# it turns the samples into volts and the sample index into seconds.
+
+from ..base.interface import numpy, requireNumpy
+
+
+##Measurements
+MEASURE_MEAN = 'mean'
+MEASURE_RMS = 'rms'
+MEASURE_MINIMUM = 'minimum'
+MEASURE_MAXIMUM = 'maximum'
+MEASURE_PEAK_TO_PEAK = 'pk2pk'
+MEASURE_RISE_TIME = 'rise'       # 10% to 90% of the first rising edge
+MEASURE_FALL_TIME = 'fall'       # 90% to 10% of the first falling edge
+MEASURE_PERIOD = 'period'        # mean time between rising edges
+MEASURE_FREQUENCY = 'frequency'
+##
+
+DEFAULT_MEASUREMENTS = (MEASURE_MEAN, MEASURE_RMS, MEASURE_PEAK_TO_PEAK, MEASURE_RISE_TIME, MEASURE_FREQUENCY)
+
+REFERENCE_LOW = 0.1  # low reference level of rise/fall times, as a fraction of peak to peak above the minimum
+REFERENCE_HIGH = 0.9 # high reference level
+HYSTERESIS = 0.1     # edges for period/frequency must cross the middle by this fraction of peak to peak
+
+
+def toPhysical(stack, preamble=None):
+    """The stack as float volts, using YMULT/YOFF/YZERO of preamble (the raw values if None)"""
+    requireNumpy("toPhysical")
+    stack = numpy.atleast_2d(numpy.asarray(stack, dtype=numpy.float64))
+    if preamble is None:
+        return stack
+    return (stack - preamble['YOFF']) * preamble['YMULT'] + preamble['YZERO']
+
+
+def _crossingTime(volts, before, level):
+    """
+    The fractional sample index where each frame crosses level between sample
+    before and before + 1 (linear interpolation), nan where before is nan
+    """
+    valid = ~numpy.isnan(before)
+    index = numpy.where(valid, before, 0).astype(numpy.intp)
+    rows = numpy.arange(volts.shape[0])
+    first = volts[rows, index]
+    second = volts[rows, numpy.minimum(index + 1, volts.shape[1] - 1)]
+    step = second - first
+    fraction = numpy.where(step != 0, (level - first) / numpy.where(step != 0, step, 1), 0)
+    return numpy.where(valid, index + fraction, numpy.nan)
+
+
+def _firstTrue(mask):
+    """Index of the first True of every row of mask, nan for rows without one"""
+    index = numpy.argmax(mask, axis=1).astype(numpy.float64)
+    index[~mask.any(axis=1)] = numpy.nan
+    return index
+
+
+def _levelStates(volts, lower, upper):
+    """
+    Classifies every sample as below lower (-1) or above upper (+1), a sample in
+    between keeps the state of the last sample outside the band (0 before the first one).
+    Returns (states, last) where last is the index of that last sample outside the band
+    """
+    above = volts >= upper[:, None]
+    below = volts <= lower[:, None]
+    columns = numpy.arange(volts.shape[1], dtype=numpy.int32) # half the memory traffic of intp
+    last = numpy.maximum.accumulate(numpy.where(above | below, columns, 0), axis=1)
+    rows = numpy.arange(volts.shape[0])[:, None]
+    return above[rows, last].astype(numpy.int8) - below[rows, last], last
+
+
+def _edgeTime(volts, low, high, rising):
+    """
+    Transition time in samples of the first rising (low to high) or falling
+    (high to low) edge of every frame, from the level crossings interpolated
+    between the samples around them
+    """
+    states, last = _levelStates(volts, low, high)
+    if rising:
+        edges = (states[:, :-1] == -1) & (states[:, 1:] == 1)
+        start_level, end_level = low, high
+    else:
+        edges = (states[:, :-1] == 1) & (states[:, 1:] == -1)
+        start_level, end_level = high, low
+    # the edge ends between sample end and end + 1 and starts right after the
+    # last sample on the other side of the band, which is last[end]
+    end = _firstTrue(edges)
+    rows = numpy.arange(volts.shape[0])
+    start = numpy.where(numpy.isnan(end), numpy.nan,
+                        last[rows, numpy.where(numpy.isnan(end), 0, end).astype(numpy.intp)])
+    return _crossingTime(volts, end, end_level) - _crossingTime(volts, start, start_level)
+
+
+def _middleCrossing(volts, middle, below, edge):
+    """
+    The interpolated time each frame crosses middle on the rising edge that ends
+    between sample edge and edge + 1, nan where edge is nan. below is the index
+    of the last sample under middle up to every sample
+    """
+    rows = numpy.arange(volts.shape[0])
+    index = numpy.where(numpy.isnan(edge), 0, edge).astype(numpy.intp)
+    before = numpy.where(numpy.isnan(edge), numpy.nan, below[rows, index])
+    return _crossingTime(volts, before, middle)
+
+
+def _period(volts, minimum, maximum):
+    """Mean number of samples between the middle level crossings of rising edges, with hysteresis"""
+    middle = (minimum + maximum) / 2.0
+    band = (maximum - minimum) * HYSTERESIS
+    states, last = _levelStates(volts, middle - band, middle + band)
+    edges = (states[:, :-1] == -1) & (states[:, 1:] == 1)
+    count = edges.sum(axis=1)
+    columns = numpy.arange(volts.shape[1], dtype=numpy.int32)
+    below = numpy.maximum.accumulate(numpy.where(volts < middle[:, None], columns, 0), axis=1)
+    first = _middleCrossing(volts, middle, below, _firstTrue(edges))
+    final = _middleCrossing(volts, middle, below, edges.shape[1] - 1 - _firstTrue(edges[:, ::-1]))
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return numpy.where(count >= 2, (final - first) / (count - 1.0), numpy.nan)
+
+
+def measure(stack, preamble=None, measurements=DEFAULT_MEASUREMENTS):
+    """
+    Computes measurements (MEASURE_* names) of every frame of stack, a (frames, samples)
+    array of the raw samples of one source (a single frame is taken as one row).
+    Returns a dictionary of measurement -> numpy array with one value per frame,
+    in volts and seconds with the preamble of the source, in raw levels and samples
+    without it. Measurements that do not apply to a frame (no edge, a single sample...) are nan
+    """
+    volts = toPhysical(stack, preamble)
+    sample_time = 1.0
+    if preamble is not None:
+        sample_time = preamble['XINCR']
+    results = dict()
+    minimum = volts.min(axis=1)
+    maximum = volts.max(axis=1)
+    span = maximum - minimum
+    low = minimum + REFERENCE_LOW * span
+    high = minimum + REFERENCE_HIGH * span
+    period = None
+    no_edges = volts.shape[1] < 2 # no edge fits in a single sample
+    if no_edges:
+        period = numpy.full(volts.shape[0], numpy.nan)
+    for measurement in measurements:
+        if measurement == MEASURE_MEAN:
+            results[measurement] = volts.mean(axis=1)
+        elif measurement == MEASURE_RMS:
+            results[measurement] = numpy.sqrt(numpy.einsum('ij,ij->i', volts, volts) / volts.shape[1])
+        elif measurement == MEASURE_MINIMUM:
+            results[measurement] = minimum
+        elif measurement == MEASURE_MAXIMUM:
+            results[measurement] = maximum
+        elif measurement == MEASURE_PEAK_TO_PEAK:
+            results[measurement] = span
+        elif measurement in (MEASURE_RISE_TIME, MEASURE_FALL_TIME) and no_edges:
+            results[measurement] = numpy.full(volts.shape[0], numpy.nan)
+        elif measurement == MEASURE_RISE_TIME:
+            results[measurement] = _edgeTime(volts, low, high, True) * sample_time
+        elif measurement == MEASURE_FALL_TIME:
+            results[measurement] = _edgeTime(volts, low, high, False) * sample_time
+        elif measurement in (MEASURE_PERIOD, MEASURE_FREQUENCY):
+            if period is None:
+                period = _period(volts, minimum, maximum) * sample_time
+            if measurement == MEASURE_PERIOD:
+                results[measurement] = period
+            else:
+                results[measurement] = 1.0 / period
+        else:
+            raise Exception("Unknown measurement: %s" % measurement)
+    return results
@@ -0,0 +1,448 @@
+#######################################################################################
+###### Tests of the TDS540 driver against the simulated scope, no GPIB bus    #########
+###### needed. The library is python 2, run them from the directory holding   #########
+###### the package with: python -m unittest package.tests.test_TDS_540_sim    #########
+#######################################################################################
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from ..base import gpib_base as lldriver
+from ..base.device_pool import DevicePool
+from ..base.interface import numpy
+from ..drivers import TDS_540 as T
+from ..drivers.TDS_540_sim import SimulatedTDS540
+from ..scope import capture
+
+
+class RecordingSim(SimulatedTDS540):
+    """A SimulatedTDS540 that keeps every command written to it"""
+    def __init__(self, *args, **kwargs):
+        SimulatedTDS540.__init__(self, *args, **kwargs)
+        self.commands = list()
+
+    def write(self, command):
+        self.commands.append(command)
+        SimulatedTDS540.write(self, command)
+
+
+def _scope(record_length=200, sources='CH1', **kwargs):
+    sim = RecordingSim(record_length=record_length, sources=sources)
+    scope = T.TDS540_Base('sim', transport=sim, **kwargs)
+    return sim, scope
+
+
+class DecodeTest(unittest.TestCase):
+    def setUp(self):
+        self.sim, self.scope = _scope(sources='CH1,CH2')
+
+    def expected(self):
+        return [self.sim.waveform(source) for source in ('CH1', 'CH2')]
+
+    def test_tuple(self):
+        for width in (self.scope.setDataWidth8Bit, self.scope.setDataWidth16Bit):
+            width()
+            self.assertEqual([list(data) for data in self.scope.readBinaryWaveformData()], self.expected())
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_arrays(self):
+        for width in (self.scope.setDataWidth8Bit, self.scope.setDataWidth16Bit):
+            width()
+            arrays = self.scope.readBinaryWaveformData(T.DECODE_ARRAY)
+            self.assertEqual([list(data) for data in arrays], self.expected())
+            array_2d = self.scope.readBinaryWaveformData(T.DECODE_ARRAY_2D)
+            self.assertEqual(array_2d.shape, (2, 200))
+            self.assertEqual(array_2d.tolist(), self.expected())
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_ascii(self):
+        self.scope.setDataWidth16Bit()
+        self.assertEqual(self.scope.readAsciiWaveformData(T.DECODE_ARRAY_2D).tolist(), self.expected())
+        self.assertEqual([list(data) for data in self.scope.readAsciiWaveformData(T.DECODE_TUPLE)],
+                         self.expected())
+
+    def test_truncated_ascii_curve(self):
+        self.scope.setDataModeAscii()
+        responses = ['12,-3,4', '']
+        self.sim.read = lambda length: responses.pop(0)
+        self.assertRaises(Exception, self.scope.readAsciiWaveformData)
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_read_sources(self):
+        sources = self.scope.readSources()
+        self.assertEqual(sorted(sources), ['CH1', 'CH2'])
+        self.assertEqual(sources['CH2'].tolist(), self.sim.waveform('CH2'))
+
+
+class StateCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.sim, self.scope = _scope(cache_max_age=None)
+
+    def test_init_is_one_compound_query(self):
+        self.assertEqual(len(self.sim.commands), 1)
+        self.assertEqual(self.sim.commands[0].count(lldriver.BATCH_SEPARATOR), len(T.FIELD_QUERIES) - 1)
+
+    def test_verify_all_fields(self):
+        del self.sim.commands[:]
+        self.assertTrue(self.scope.verifyAllFields())
+        self.assertEqual(self.sim.commands, [])
+        self.scope.invalidateStateCache()
+        self.assertTrue(self.scope.verifyAllFields())
+        self.assertEqual(len(self.sim.commands), 1)
+
+    def test_hits_and_misses(self):
+        del self.sim.commands[:]
+        self.assertTrue(self.scope.setDataWidth16Bit())
+        self.assertEqual(self.sim.commands, [T.SET_DATA_WIDTH + T.DATA_WIDTH_16BIT])
+        self.scope.setDataWidth16Bit()
+        self.assertEqual(self.scope.queryDataWidth(), T.DATA_WIDTH_16BIT)
+        self.assertEqual(len(self.sim.commands), 1)
+        self.scope.invalidateStateCache(T.QUERY_DATA_WIDTH)
+        self.assertEqual(self.scope.queryDataWidth(), T.DATA_WIDTH_16BIT)
+        self.assertEqual(self.sim.commands[1:], [T.QUERY_DATA_WIDTH])
+
+    def test_no_cache(self):
+        sim, scope = _scope(cache_max_age=0)
+        del sim.commands[:]
+        scope.queryDataWidth()
+        scope.queryDataWidth()
+        self.assertEqual(sim.commands, [T.QUERY_DATA_WIDTH] * 2)
+
+    def test_trust_front_panel(self):
+        self.scope.setTrustFrontPanel()
+        del self.sim.commands[:]
+        self.sim.set('data:width', '2')
+        self.assertEqual(self.scope.queryDataWidth(), T.DATA_WIDTH_16BIT)
+        self.assertEqual(self.sim.commands, [T.QUERY_DATA_WIDTH])
+
+
+class WindowTest(unittest.TestCase):
+    def setUp(self):
+        self.sim, self.scope = _scope()
+
+    def test_window(self):
+        data = self.scope.readWindow(10, 50)
+        self.assertEqual(list(data[0]), self.sim.waveform('CH1')[9:50])
+        self.assertEqual(self.scope.num_of_data_points, 41)
+
+    def test_window_is_clipped(self):
+        self.scope.setReadWindow(150, 1000)
+        self.assertEqual(self.scope.stop_point, '200\n')
+        self.assertEqual(len(self.scope.readBinaryWaveformData()[0]), 51)
+        self.assertRaises(Exception, self.scope.setReadWindow, 0, 10)
+
+    def test_pages(self):
+        pages = list(self.scope.readPages(64))
+        self.assertEqual([first for first, data in pages], [1, 65, 129, 193])
+        samples = list()
+        for first, data in pages:
+            samples.extend(data[0])
+        self.assertEqual(samples, self.sim.waveform('CH1'))
+
+
+class CaptureSingleTest(unittest.TestCase):
+    def setUp(self):
+        self.sim, self.scope = _scope()
+        self.sim.trigger_time = 0.02
+
+    def test_wait_modes(self):
+        for wait in (T.WAIT_OPC_QUERY, T.WAIT_SERIAL_POLL, T.WAIT_SRQ):
+            data = self.scope.captureSingle(wait=wait, timeout=2.0)
+            self.assertEqual(list(data[0]), self.sim.waveform('CH1'))
+        self.assertEqual(self.sim.command_errors, 0)
+
+    def test_status_polls_take_a_turn_on_the_board(self):
+        polls = list() # whether the board was held during every serial poll
+        transport_poll = self.sim.serialPoll
+        def serialPoll():
+            polls.append(self.scope.driver.scheduler.busy)
+            return transport_poll()
+        self.sim.serialPoll = serialPoll
+        instrumentation = self.scope.setInstrumentation()
+        for wait in (T.WAIT_SERIAL_POLL, T.WAIT_SRQ):
+            del polls[:]
+            instrumentation.reset()
+            self.scope.armSingleSequence(wait)
+            self.scope.waitForAcquisition(wait, 2.0)
+            self.assertTrue(polls)
+            self.assertEqual(set(polls), set([True]))
+            self.assertEqual(instrumentation.snapshot()['serialPoll']['calls'], len(polls))
+
+    def test_common_commands_are_not_rooted(self):
+        self.scope.armSingleSequence(T.WAIT_SERIAL_POLL)
+        self.assertFalse(':*' in self.sim.commands[-1])
+        self.assertEqual(lldriver.joinCommands(['*cls', 'data:width?', ':*opc?']), '*cls;:data:width?;*opc?')
+
+    def test_rooted_common_command_is_rejected(self):
+        self.sim.write(':*cls;:*opc')
+        self.assertEqual(self.sim.command_errors, 1)
+        self.assertFalse(self.sim.opc_pending)
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class CaptureFileTest(unittest.TestCase):
+    def setUp(self):
+        self.sim, self.scope = _scope(sources='CH1,CH2')
+        self.scope.setDataWidth16Bit()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.cap')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_record_and_read(self):
+        self.assertEqual(self.scope.recordToDisk(self.path, count=5), 5)
+        reader = capture.CaptureReader(self.path)
+        try:
+            self.assertEqual(len(reader), 5)
+            self.assertEqual(reader.sources, ['CH1', 'CH2'])
+            preambles = self.scope.readPreambles()
+            for i in range(len(reader)):
+                self.assertEqual(reader.samples(i, 'CH2').tolist(), self.sim.waveform('CH2'))
+                self.assertEqual(reader[i]['preamble'][0]['YMULT'], preambles[0]['YMULT'])
+        finally:
+            reader.close()
+
+    def test_append(self):
+        writer = self.scope.openCapture(self.path)
+        writer.writeFrame(self.scope.readBinaryWaveformData(T.DECODE_ARRAY_2D), self.scope.readPreambles())
+        writer.close()
+        self.scope.recordToDisk(self.path, count=2)
+        reader = capture.CaptureReader(self.path)
+        try:
+            self.assertEqual(len(reader), 3)
+            self.assertEqual(reader.samples(0, 'CH1').tolist(), reader.samples(2, 'CH1').tolist())
+        finally:
+            reader.close()
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class EpochTest(unittest.TestCase):
+    def setUp(self):
+        self.sim, self.scope = _scope(sources='CH1,CH2')
+
+    def test_epoch_follows_the_settings(self):
+        epoch = self.scope.currentEpoch()
+        del self.sim.commands[:]
+        self.assertEqual(self.scope.currentEpoch(), epoch)
+        self.assertEqual(self.sim.commands, []) # worked out without asking the scope
+        self.scope.setCH1VerticalScale('5.0E-1')
+        self.assertEqual(self.scope.currentEpoch(), epoch + 1)
+        self.scope.setDataWidth16Bit()
+        self.assertEqual(self.scope.currentEpoch(), epoch + 2)
+        self.scope.setDataWidth16Bit()
+        self.assertEqual(self.scope.currentEpoch(), epoch + 2)
+
+    def test_to_volts(self):
+        raw = numpy.array([self.sim.waveform('CH1'), self.sim.waveform('CH2')])
+        volts = self.scope.toVolts(raw)
+        preambles = self.scope.readPreambles()
+        for source in range(2):
+            scale = preambles[source]
+            numpy.testing.assert_allclose(volts[source],
+                                          (raw[source] - scale['YOFF']) * scale['YMULT'] + scale['YZERO'])
+        stack = self.scope.toVolts(numpy.array([raw, raw]))
+        self.assertEqual(stack.shape, (2, 2, 200))
+        numpy.testing.assert_allclose(stack[1], volts)
+        time_axis = self.scope.epochTime(200)
+        self.assertAlmostEqual(time_axis[1] - time_axis[0], preambles[0]['XINCR'])
+
+    def test_old_epochs_stay_convertible(self):
+        epoch = self.scope.currentEpoch()
+        before = self.scope.toVolts(numpy.ones((2, 10)))
+        self.scope.setCH1VerticalScale('5.0E-1')
+        self.assertNotEqual(self.scope.toVolts(numpy.ones((2, 10)))[0, 0], before[0, 0])
+        numpy.testing.assert_allclose(self.scope.toVolts(numpy.ones((2, 10)), epoch), before)
+
+    def test_unknown_epochs(self):
+        epoch = self.scope.currentEpoch()
+        self.assertRaises(Exception, self.scope.toVolts, numpy.ones((2, 10)), epoch + 1)
+        self.scope.setDataWidth16Bit()
+        # the preambles of epoch were never read while it was current
+        self.assertRaises(Exception, self.scope.epochPreambles, epoch)
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class MeasurementSlotTest(unittest.TestCase):
+    def setUp(self):
+        self.sim, self.scope = _scope(record_length=2000, sources='CH1,CH2')
+
+    def test_read_measurements(self):
+        self.assertRaises(Exception, self.scope.readMeasurements)
+        self.scope.configureMeasurements([(T.MEASUREMENT_TYPE_FREQUENCY, 'CH1'),
+                                          (T.MEASUREMENT_TYPE_AMPLITUDE, 'CH1'), # not simulated
+                                          (T.MEASUREMENT_TYPE_PK2PK, T.DATA_SOURCE_CH2)])
+        del self.sim.commands[:]
+        frequency, amplitude, peak_to_peak = self.scope.readMeasurements()
+        self.assertEqual(len(self.sim.commands), 1) # one compound query
+        self.assertAlmostEqual(frequency, 1000.0, delta=2.0)
+        self.assertTrue(numpy.isnan(amplitude))
+        self.assertEqual(peak_to_peak, float(self.sim.measurementValue(3)))
+        self.assertEqual(float(self.sim.measurementValue(4)), T.MEASUREMENT_INVALID) # turned off
+
+    def test_configure_only_sends_changes(self):
+        measurements = [(T.MEASUREMENT_TYPE_MEAN, 'CH1'), (T.MEASUREMENT_TYPE_RMS, 'CH2')]
+        self.scope.configureMeasurements(measurements)
+        del self.sim.commands[:]
+        self.scope.configureMeasurements(measurements)
+        self.assertEqual(self.sim.commands, [])
+        self.scope.configureMeasurements(measurements[:1])
+        self.assertEqual(len(self.sim.commands), 1) # slot 2 turned off
+        self.assertEqual(len(self.scope.readMeasurements()), 1)
+        self.assertRaises(Exception, self.scope.configureMeasurements, measurements * 3)
+
+    def test_capture_measurements(self):
+        self.scope.configureMeasurements([(T.MEASUREMENT_TYPE_PERIOD, 'CH1')])
+        period, = self.scope.captureMeasurements(T.WAIT_OPC_QUERY)
+        self.assertAlmostEqual(period, 1e-3, delta=2e-6)
+
+
+class AcquisitionWorkerTest(unittest.TestCase):
+    def setUp(self):
+        self.sim, self.scope = _scope(sources='CH1,CH2')
+
+    def test_frames(self):
+        worker = T.AcquisitionWorker(self.scope, 5, capacity=10, overflow=T.ring_buffer.OVERFLOW_BLOCK)
+        worker.start()
+        frames = list(worker)
+        worker.stop()
+        self.assertEqual(len(frames), 5)
+        for frame in frames:
+            self.assertEqual(frame['samples'].tolist(), [self.sim.waveform('CH1'), self.sim.waveform('CH2')])
+            self.assertEqual(frame['epoch'], self.scope.currentEpoch())
+
+    def test_scope_keeps_its_curve_buffer(self):
+        self.scope.readBinaryWaveformData()
+        curve_buffer = self.scope.curve_buffer
+        worker = T.AcquisitionWorker(self.scope, 3)
+        worker.start()
+        list(worker)
+        worker.stop()
+        self.assertTrue(self.scope.curve_buffer is curve_buffer)
+        self.assertTrue(len(curve_buffer) > 0)
+
+    def test_count_zero_reads_nothing(self):
+        worker = T.AcquisitionWorker(self.scope, 0)
+        del self.sim.commands[:]
+        worker.start()
+        self.assertEqual(list(worker), [])
+        worker.stop()
+        self.assertFalse(T.WAVEFORM_READ in self.sim.commands)
+
+    def test_drain(self):
+        worker = T.AcquisitionWorker(self.scope, None, capacity=1000, overflow=T.ring_buffer.OVERFLOW_BLOCK)
+        worker.start()
+        first = worker.get(2.0)
+        frames = worker.drain()
+        self.assertEqual(first['samples'][0].tolist(), self.sim.waveform('CH1'))
+        self.assertEqual(worker.transferred, len(frames) + 1)
+        self.assertFalse([thread for thread in worker.threads if thread.is_alive()])
+
+    def test_transfer_errors_are_raised(self):
+        worker = T.AcquisitionWorker(self.scope, None, overflow=T.ring_buffer.OVERFLOW_BLOCK)
+        worker.start()
+        def fail(length):
+            raise IOError("bus error")
+        self.sim.readBinary = fail
+        self.assertRaises(IOError, list, worker)
+        worker.stop()
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class StreamTest(unittest.TestCase):
+    def setUp(self):
+        self.sim, self.scope = _scope(sources='CH1,CH2')
+        self.scope.setDataWidth16Bit()
+
+    def test_count(self):
+        frames = list(self.scope.streamWaveforms(4, overflow=T.ring_buffer.OVERFLOW_BLOCK))
+        self.assertEqual(len(frames), 4)
+        for frame in frames:
+            self.assertEqual(frame['samples'].dtype, numpy.dtype(T.NUMPY_SIGNED_SHORT))
+            self.assertEqual(frame['samples'][1].tolist(), self.sim.waveform('CH2'))
+        self.assertTrue(frames[0]['timestamp'] <= frames[-1]['timestamp'])
+
+    def test_closing_stops_the_acquisition(self):
+        stream = self.scope.streamWaveforms(capacity=2)
+        next(stream)
+        stream.close()
+        reads = self.sim.commands.count(T.WAVEFORM_READ)
+        time.sleep(0.05)
+        self.assertEqual(self.sim.commands.count(T.WAVEFORM_READ), reads)
+
+
+@unittest.skipIf(lldriver.asyncio is None, "asyncio (trollius on python 2) is not installed")
+class AsyncTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = lldriver.asyncio.new_event_loop()
+        lldriver.asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        lldriver.asyncio.set_event_loop(None)
+
+    def _wait(self, *futures):
+        return self.loop.run_until_complete(lldriver.asyncio.gather(*futures))
+
+    def test_reads(self):
+        sim, scope = _scope()
+        self.assertTrue(self._wait(scope.setReadLengthAsync(50))[0])
+        data, = self._wait(scope.readBinaryWaveformDataAsync())
+        self.assertEqual(list(data[0]), sim.waveform('CH1')[:50])
+
+    def test_scopes_overlap(self):
+        scopes = list()
+        for i in range(2):
+            sim = SimulatedTDS540(record_length=200, latency=0.02, board=100 + i) # boards of their own
+            scopes.append((sim, T.TDS540_Base('sim%d' % i, transport=sim)))
+        started = time.time()
+        for sim, scope in scopes:
+            scope.readBinaryWaveformData()
+        one_after_the_other = time.time() - started
+        started = time.time()
+        results = self._wait(*[scope.readBinaryWaveformDataAsync() for sim, scope in scopes])
+        together = time.time() - started
+        self.assertEqual([list(data[0]) for data in results], [sim.waveform('CH1') for sim, scope in scopes])
+        self.assertTrue(together < 0.8 * one_after_the_other)
+
+    def test_calls_to_one_scope_are_serialized(self):
+        sim, scope = _scope()
+        futures = [scope.readBinaryWaveformDataAsync() for i in range(8)]
+        futures.append(scope.verifyAllFieldsAsync())
+        results = self._wait(*futures)
+        for data in results[:-1]:
+            self.assertEqual(list(data[0]), sim.waveform('CH1'))
+        self.assertTrue(results[-1])
+
+
+class SharedDeviceTest(unittest.TestCase):
+    def setUp(self):
+        self.sim = SimulatedTDS540(record_length=100)
+        self.pool = DevicePool()
+        self.held = self.pool.acquire('sim', lambda name: self.sim)
+
+    def tearDown(self):
+        self.pool.closeAll()
+
+    def test_writes_are_seen_by_every_driver(self):
+        first = T.TDS540_Base('sim', pool=self.pool)
+        second = T.TDS540_Base('sim', pool=self.pool)
+        first.setDataWidth16Bit()
+        data = second.readBinaryWaveformData()
+        self.assertEqual(second.data_width, T.DATA_WIDTH_16BIT)
+        self.assertEqual(list(data[0]), self.sim.waveform('CH1'))
+
+    def test_failed_init_releases_the_device(self):
+        def fail(length):
+            raise IOError("bus error")
+        self.sim.read = fail
+        self.assertRaises(IOError, T.TDS540_Base, 'sim', cache_max_age=0, pool=self.pool)
+        self.assertEqual(self.pool.entries['sim'][1], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
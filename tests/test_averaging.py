@@ -0,0 +1,80 @@
+#######################################################################################
+###### Tests of the host side averaging, on frames with known answers and on   #########
+###### curves of the simulated scope                                          #########
+#######################################################################################
+
+import unittest
+
+from ..base.interface import numpy
+from ..drivers import TDS_540 as T
+from ..scope import averaging as A
+from .test_TDS_540_sim import _scope
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class AccumulatorTest(unittest.TestCase):
+    def setUp(self):
+        generator = numpy.random.RandomState(1)
+        self.frames = generator.randint(-128, 128, (50, 2, 300)).astype(numpy.int8)
+
+    def test_mean_and_variance(self):
+        accumulator = A.Accumulator(2, 300)
+        for frame in self.frames:
+            accumulator.add(frame)
+        self.assertEqual(accumulator.depth(), 50)
+        numpy.testing.assert_allclose(accumulator.mean(), self.frames.mean(axis=0))
+        numpy.testing.assert_allclose(accumulator.variance(), self.frames.astype(float).var(axis=0))
+        numpy.testing.assert_allclose(accumulator.variance(1), self.frames.astype(float).var(axis=0, ddof=1))
+        accumulator.reset()
+        self.assertRaises(Exception, accumulator.mean)
+
+    def test_blocks_match_frames(self):
+        wide = (self.frames.astype(numpy.int16) * 200).astype('>i2')
+        from_frames = A.Accumulator(2, 300)
+        from_blocks = A.Accumulator(2, 300, 4)
+        for frame in wide:
+            from_frames.add(frame)
+            data = b'#3600' + frame[0].tobytes() + b',#3600' + frame[1].tobytes() + b'\n'
+            from_blocks.addBlocks(data, [(5, 600), (611, 600)], '>i2')
+        numpy.testing.assert_allclose(from_blocks.mean(), from_frames.mean())
+        numpy.testing.assert_allclose(from_blocks.variance(), from_frames.variance())
+        self.assertEqual(from_blocks.depth(), 200) # 50 frames of 4 scope averages
+
+    def test_shapes(self):
+        accumulator = A.Accumulator(2, 300)
+        self.assertRaises(Exception, accumulator.add, self.frames[0][:1])
+        self.assertRaises(Exception, accumulator.add, self.frames[0][:, :100])
+        data = self.frames[0].tobytes()
+        self.assertRaises(Exception, accumulator.addBlocks, data, [(0, 300)], 'i1')
+        self.assertRaises(Exception, accumulator.addBlocks, data, [(0, 200), (300, 200)], 'i1')
+        accumulator.add(self.frames[0])
+        self.assertRaises(Exception, accumulator.variance, 1) # one frame has no sample variance
+        self.assertEqual(accumulator.count, 1)
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class AverageWaveformsTest(unittest.TestCase):
+    def test_sample_mode(self):
+        sim, scope = _scope(sources='CH1,CH2')
+        del sim.commands[:]
+        accumulator = scope.averageWaveforms(5)
+        self.assertEqual(accumulator.depth(), 5)
+        self.assertFalse([command for command in sim.commands if T.SET_ACQUIRE_STATE_RUN in command])
+        numpy.testing.assert_allclose(accumulator.mean(), [sim.waveform('CH1'), sim.waveform('CH2')])
+        numpy.testing.assert_allclose(accumulator.variance(), 0.0)
+
+    def test_average_mode_waits_for_every_average(self):
+        sim, scope = _scope()
+        scope.setAcquireModeAverage(16)
+        del sim.commands[:]
+        accumulator = scope.averageWaveforms(3)
+        self.assertEqual(accumulator.frame_averages, scope.queryAcquireAverages())
+        self.assertEqual(accumulator.depth(), 3 * scope.queryAcquireAverages())
+        self.assertEqual(len([command for command in sim.commands if T.SET_ACQUIRE_STATE_RUN in command]), 3)
+
+    def test_into_an_accumulator(self):
+        sim, scope = _scope()
+        accumulator = scope.averageWaveforms(2)
+        self.assertTrue(scope.averageWaveforms(3, accumulator) is accumulator)
+        self.assertEqual(accumulator.count, 5)
+        self.assertRaises(Exception, scope.averageWaveforms, 1, A.Accumulator(2, 200))
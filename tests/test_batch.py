@@ -0,0 +1,76 @@
+#######################################################################################
+###### Tests of the batch analysis of capture files recorded from the         #########
+###### simulated scope                                                        #########
+#######################################################################################
+
+import functools
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..base.interface import numpy
+from ..scope import batch as B
+from ..scope import capture
+from ..scope import measurements as M
+from .test_TDS_540_sim import _scope
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.sim, scope = _scope(record_length=2000, sources='CH1,CH2')
+        scope.recordToDisk(os.path.join(self.directory, 'a.cap'), 7)
+        scope.recordToDisk(os.path.join(self.directory, 'b.cap'), 5)
+        open(os.path.join(self.directory, 'notes.txt'), 'w').write('not a capture')
+        os.mkdir(os.path.join(self.directory, 'c.cap'))
+        self.paths = [os.path.join(self.directory, name) for name in ('a.cap', 'b.cap')]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_find_captures(self):
+        self.assertEqual(B.findCaptures(self.directory), self.paths)
+        self.assertEqual(B.findCaptures(self.directory, 'b*'), self.paths[1:])
+
+    def test_shards(self):
+        shards = B.shardCaptures(self.paths, 3)
+        self.assertEqual([(path, count) for path, offset, count in shards],
+                         [(self.paths[0], 3), (self.paths[0], 3), (self.paths[0], 1),
+                          (self.paths[1], 3), (self.paths[1], 2)])
+        reader = capture.CaptureReader(self.paths[0])
+        try:
+            self.assertEqual([offset for path, offset, count in shards[:3]],
+                             [reader.frameOffset(0), reader.frameOffset(3), reader.frameOffset(6)])
+            frames = B.mapShard(*shards[1])
+            self.assertEqual(frames['samples'].tolist(), reader[3:6]['samples'].tolist())
+            del frames
+        finally:
+            reader.close()
+
+    def test_analyze(self):
+        reductions = {'measurements' : (functools.partial(B.frameMeasurements, source=1), B.mergeConcatenate),
+                      'spectrum' : (B.powerSpectrum, B.mergeSum)}
+        here = B.analyze(self.paths, reductions, 3, processes=1)
+        pooled = B.analyzeCaptures(self.directory, reductions, frames_per_shard=3, processes=2)
+        for measurement in here['measurements']:
+            self.assertEqual(len(here['measurements'][measurement]), 12)
+            numpy.testing.assert_allclose(pooled['measurements'][measurement], here['measurements'][measurement])
+        self.assertAlmostEqual(here['measurements'][M.MEASURE_FREQUENCY][0], 1000.0, delta=2.0)
+        total, frames = here['spectrum']
+        self.assertEqual(frames, 12)
+        numpy.testing.assert_allclose(pooled['spectrum'][0], total)
+        # the simulator returns the same curve every time, so the average is the spectrum of one frame
+        volts = B.frameVolts(B.mapShard(*B.shardCaptures(self.paths[:1], 1)[0]))[0]
+        spectrum = numpy.abs(numpy.fft.rfft(volts)) ** 2
+        numpy.testing.assert_allclose(total / frames, spectrum, rtol=1e-9, atol=1e-12)
+
+    def test_merges(self):
+        self.assertEqual(B.mergeConcatenate([]), [])
+        self.assertEqual(B.mergeSum([]), None)
+        self.assertEqual(B.mergeConcatenate([numpy.arange(2), numpy.arange(3)]).tolist(), [0, 1, 0, 1, 2])
+        merged = B.mergeConcatenate([{'x' : numpy.ones(2)}, {'x' : numpy.zeros(1)}])
+        self.assertEqual(merged['x'].tolist(), [1, 1, 0])
+        self.assertEqual(B.mergeSum([(numpy.ones(2), 3), (numpy.ones(2), 4)])[1], 7)
+        self.assertEqual(B.mergeSum([1, 2, 3]), 6)
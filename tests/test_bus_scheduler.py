@@ -0,0 +1,94 @@
+#######################################################################################
+###### Tests of the per board scheduling of the GPIB transactions             #########
+#######################################################################################
+
+import sys
+import threading
+import time
+import types
+import unittest
+
+from ..base import bus_scheduler as B
+from ..base import gpib_base as lldriver
+from ..base import transport as T
+from ..drivers.TDS_540_sim import SimulatedTDS540
+
+
+def _queue(scheduler, waiters):
+    """
+    Holds the board, lines up one thread per (name, priority) of waiters in
+    that order and lets them through, returns the names in the order they got their turn
+    """
+    order = list()
+    def transaction(name, priority):
+        scheduler.acquire(priority)
+        order.append(name)
+        scheduler.release()
+    scheduler.acquire(B.PRIORITY_HIGH)
+    threads = list()
+    for name, priority in waiters:
+        thread = threading.Thread(target=transaction, args=(name, priority))
+        thread.start()
+        threads.append(thread)
+        while len(scheduler.waiting) < len(threads): # tickets follow the order of waiters
+            time.sleep(0.001)
+    scheduler.release()
+    for thread in threads:
+        thread.join()
+    return order
+
+
+class BusSchedulerTest(unittest.TestCase):
+    def test_priorities(self):
+        scheduler = B.BusScheduler()
+        order = _queue(scheduler, [('bulk', B.PRIORITY_BULK), ('normal 1', B.PRIORITY_NORMAL),
+                                   ('high', B.PRIORITY_HIGH), ('normal 2', B.PRIORITY_NORMAL)])
+        self.assertEqual(order, ['high', 'normal 1', 'normal 2', 'bulk'])
+        self.assertEqual(scheduler.transactions, 5)
+        self.assertFalse(scheduler.busy)
+
+    def test_bulk_is_not_starved(self):
+        scheduler = B.BusScheduler(starvation_limit=2)
+        order = _queue(scheduler, [('bulk', B.PRIORITY_BULK)] +
+                                  [('high %d' % i, B.PRIORITY_HIGH) for i in range(4)])
+        self.assertEqual(order, ['high 0', 'high 1', 'bulk', 'high 2', 'high 3'])
+
+    def test_one_scheduler_per_board(self):
+        self.assertTrue(B.getBusScheduler(0) is B.getBusScheduler(0))
+        self.assertFalse(B.getBusScheduler(0) is B.getBusScheduler(1))
+        first = lldriver.GpibDevice('first', transport=SimulatedTDS540())
+        second = lldriver.GpibDevice('second', transport=SimulatedTDS540())
+        other = lldriver.GpibDevice('other', transport=SimulatedTDS540(board=1))
+        self.assertTrue(first.scheduler is second.scheduler)
+        self.assertTrue(other.scheduler is B.getBusScheduler(1))
+
+    def test_other_boards_are_not_held_up(self):
+        busy = lldriver.GpibDevice('busy', transport=SimulatedTDS540(board=200))
+        other = lldriver.GpibDevice('other', transport=SimulatedTDS540(board=201))
+        busy.scheduler.acquire()
+        try:
+            self.assertTrue(other.query('*IDN?'))
+        finally:
+            busy.scheduler.release()
+
+
+class BoardLookupTest(unittest.TestCase):
+    def setUp(self):
+        self.previous = sys.modules.get('gpib')
+        boards = {'scope' : 0, 'generator' : 1}
+        gpib = types.ModuleType('gpib')
+        gpib.find = lambda name: name
+        gpib.ask = lambda device, option: boards[device] if option == T.IBA_BNA else 0
+        sys.modules['gpib'] = gpib
+
+    def tearDown(self):
+        if self.previous is None:
+            del sys.modules['gpib']
+        else:
+            sys.modules['gpib'] = self.previous
+
+    def test_board_from_linux_gpib(self):
+        self.assertEqual(T.LinuxGpibTransport('scope').board, 0)
+        self.assertEqual(T.LinuxGpibTransport('generator').board, 1)
+        device = lldriver.GpibDevice('generator')
+        self.assertTrue(device.scheduler is B.getBusScheduler(1))
@@ -0,0 +1,86 @@
+#######################################################################################
+###### Tests of the display decimation, on waveforms of the simulated scope   #########
+#######################################################################################
+
+import unittest
+
+from ..base.interface import numpy
+from ..drivers.TDS_540_sim import SimulatedTDS540
+from ..scope import decimate as D
+
+
+def _referenceLttb(values, threshold):
+    """Straight python LTTB, one bucket and one candidate at a time"""
+    points = len(values)
+    every = (points - 2) / float(threshold - 2)
+    selected = [0]
+    previous = 0
+    for bucket in range(threshold - 2):
+        start = int(bucket * every) + 1
+        end = int((bucket + 1) * every) + 1
+        next_start, next_end = end, min(int((bucket + 2) * every) + 1, points)
+        if bucket == threshold - 3:
+            next_start, next_end = points - 1, points
+        next_x = (next_start + next_end - 1) / 2.0
+        next_y = sum(values[next_start:next_end]) / float(next_end - next_start)
+        best, best_area = start, -1.0
+        for candidate in range(start, end):
+            area = abs((previous - next_x) * (values[candidate] - values[previous])
+                       - (previous - candidate) * (next_y - values[previous]))
+            if area > best_area:
+                best, best_area = candidate, area
+        selected.append(best)
+        previous = best
+    selected.append(points - 1)
+    return selected
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class DecimateTest(unittest.TestCase):
+    def setUp(self):
+        self.sim = SimulatedTDS540(record_length=5000, sources='CH1,CH2')
+        self.frame = numpy.array([self.sim.waveform('CH1'), self.sim.waveform('CH2')], numpy.int8)
+
+    def test_min_max_envelope(self):
+        minimums, maximums = D.minMaxEnvelope(self.frame, 300)
+        self.assertEqual(minimums.shape, (2, 300))
+        self.assertEqual(minimums.dtype, self.frame.dtype)
+        edges = list(D.bucketEdges(5000, 300)) + [5000]
+        for bucket in range(300):
+            part = self.frame[:, edges[bucket]:edges[bucket + 1]]
+            self.assertEqual(minimums[:, bucket].tolist(), part.min(axis=1).tolist())
+            self.assertEqual(maximums[:, bucket].tolist(), part.max(axis=1).tolist())
+
+    def test_short_frames_are_not_decimated(self):
+        minimums, maximums = D.minMaxEnvelope(self.frame[:, :100], 300)
+        self.assertEqual(minimums.tolist(), self.frame[:, :100].tolist())
+        indices, values = D.lttb(self.frame[:, :100], 300)
+        self.assertEqual(values.tolist(), self.frame[:, :100].tolist())
+        self.assertEqual(indices[1].tolist(), list(range(100)))
+
+    def test_envelope_line(self):
+        columns, line = D.envelopeLine(*D.minMaxEnvelope(self.frame, 10))
+        self.assertEqual(columns.tolist(), [i // 2 for i in range(20)])
+        self.assertTrue((line[:, 0::2] <= line[:, 1::2]).all())
+
+    def test_lttb_matches_reference(self):
+        indices, values = D.lttb(self.frame, 100)
+        self.assertEqual(indices.shape, (2, 100))
+        for source in range(2):
+            expected = _referenceLttb([float(value) for value in self.frame[source]], 100)
+            self.assertEqual(indices[source].tolist(), expected)
+            self.assertEqual(values[source].tolist(), self.frame[source][expected].tolist())
+
+    def test_small_thresholds(self):
+        for threshold in (0, 1, 2):
+            self.assertRaises(ValueError, D.lttb, self.frame, threshold)
+        self.assertRaises(ValueError, D.minMaxEnvelope, self.frame, 0)
+        self.assertEqual(D.lttb(self.frame[0], 3)[0].tolist()[::2], [0, 4999])
+
+    def test_decimate_frames(self):
+        frames = numpy.zeros(3, [('timestamp', 'f8'), ('samples', 'i1', (2, 5000))])
+        frames['samples'] = self.frame
+        results = list(D.decimateFrames(frames, 50, D.DECIMATE_LTTB))
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[2][1][1].tolist(), D.lttb(self.frame, 50)[1].tolist())
+        self.assertRaises(Exception, D.decimate, self.frame, 50, 'median')
@@ -0,0 +1,70 @@
+#######################################################################################
+###### Tests of the opt-in timing of the transactions and the curve decoding  #########
+#######################################################################################
+
+import unittest
+
+from ..base import instrumentation as I
+from ..drivers import TDS_540 as T
+from ..drivers.TDS_540_sim import SimulatedTDS540
+
+
+class InstrumentationTest(unittest.TestCase):
+    def test_record(self):
+        instrumentation = I.Instrumentation(bounds=(0.001, 0.01))
+        for seconds in (0.0005, 0.001, 0.005, 0.5):
+            instrumentation.record(I.OP_READ, seconds, 10)
+        stats = instrumentation.snapshot()[I.OP_READ]
+        self.assertEqual(stats['calls'], 4)
+        self.assertEqual(stats['bytes'], 40)
+        self.assertAlmostEqual(stats['seconds'], 0.5065)
+        self.assertAlmostEqual(stats['mean_seconds'], 0.5065 / 4)
+        self.assertEqual(stats['max_seconds'], 0.5)
+        # an edge is the upper bound of its bucket
+        self.assertEqual(stats['histogram'], [(0.001, 2), (0.01, 1), (None, 1)])
+
+    def test_call(self):
+        calls = list()
+        instrumentation = I.Instrumentation(lambda *args: calls.append(args))
+        self.assertEqual(instrumentation.call(I.OP_QUERY, None, str.upper, 'abc'), 'ABC')
+        self.assertEqual(instrumentation.call(I.OP_WRITE, 7, len, 'abc'), 3)
+        snapshot = instrumentation.snapshot()
+        self.assertEqual(snapshot[I.OP_QUERY]['bytes'], 3) # None counts the result
+        self.assertEqual(snapshot[I.OP_WRITE]['bytes'], 7)
+        self.assertEqual([(operation, num_of_bytes) for operation, seconds, num_of_bytes in calls],
+                         [(I.OP_QUERY, 3), (I.OP_WRITE, 7)])
+        instrumentation.reset()
+        self.assertEqual(instrumentation.snapshot(), {})
+
+
+class ScopeInstrumentationTest(unittest.TestCase):
+    def setUp(self):
+        self.sim = SimulatedTDS540(record_length=200)
+        self.scope = T.TDS540_Base('sim', transport=self.sim)
+        self.instrumentation = self.scope.setInstrumentation()
+
+    def test_binary_curve(self):
+        self.scope.readBinaryWaveformData()
+        snapshot = self.instrumentation.snapshot()
+        self.assertEqual(snapshot[I.OP_READ_BINARY]['calls'], 1)
+        self.assertTrue(snapshot[I.OP_READ_BINARY]['bytes'] > 200) # the samples and the block header
+        self.assertEqual(snapshot[T.OP_DECODE]['calls'], 1)
+        self.assertEqual(snapshot[T.OP_DECODE]['bytes'], 200)
+
+    def test_ascii_curve(self):
+        self.scope.readAsciiWaveformData(T.DECODE_TUPLE)
+        snapshot = self.instrumentation.snapshot()
+        self.assertEqual(snapshot[T.OP_PARSE_ASCII]['calls'], 1)
+        self.assertEqual(snapshot[T.OP_PARSE_ASCII]['bytes'], snapshot[I.OP_READ]['bytes'])
+
+    def test_queries(self):
+        self.assertTrue(self.scope.verifyAllFields())
+        self.assertEqual(self.instrumentation.snapshot(), {}) # answered from the settings cache
+        self.scope.driver.query('*IDN?')
+        self.assertEqual(list(self.instrumentation.snapshot()), [I.OP_QUERY])
+
+    def test_clear(self):
+        self.scope.clearInstrumentation()
+        self.scope.readBinaryWaveformData()
+        self.assertEqual(self.instrumentation.snapshot(), {})
+        self.assertEqual(self.scope.driver.instrumentation, None)
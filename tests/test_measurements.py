@@ -0,0 +1,63 @@
+#######################################################################################
+###### Tests of the host side measurements, on waveforms of the simulated     #########
+###### scope and on frames with known answers                                 #########
+#######################################################################################
+
+import unittest
+
+from ..base.interface import numpy
+from ..drivers.TDS_540 import parseWaveformPreamble
+from ..drivers.TDS_540_sim import SimulatedTDS540
+from ..scope import measurements as M
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class MeasureTest(unittest.TestCase):
+    def test_simulated_sine(self):
+        sim = SimulatedTDS540(record_length=2000)
+        preamble = parseWaveformPreamble(sim.preamble('CH1'))
+        samples = numpy.array(sim.waveform('CH1'))
+        volts = (samples - preamble['YOFF']) * preamble['YMULT'] + preamble['YZERO']
+        results = M.measure(samples, preamble, M.DEFAULT_MEASUREMENTS + (M.MEASURE_PERIOD,))
+        self.assertAlmostEqual(results[M.MEASURE_MEAN][0], volts.mean())
+        self.assertAlmostEqual(results[M.MEASURE_PEAK_TO_PEAK][0], volts.max() - volts.min())
+        self.assertAlmostEqual(results[M.MEASURE_RMS][0], numpy.sqrt((volts ** 2).mean()))
+        # five periods in the record, 1 kHz with the simulator's time base
+        self.assertAlmostEqual(results[M.MEASURE_FREQUENCY][0], 1000.0, delta=2.0)
+        self.assertAlmostEqual(results[M.MEASURE_PERIOD][0] * results[M.MEASURE_FREQUENCY][0], 1.0)
+        # 10-90% of a sine is about 0.295 of a period
+        self.assertAlmostEqual(results[M.MEASURE_RISE_TIME][0], 0.295e-3, delta=0.03e-3)
+
+    def test_period_is_interpolated(self):
+        time = numpy.arange(4000)
+        phases = numpy.linspace(0, 6, 20)[:, None]
+        stack = numpy.sin(2 * numpy.pi * time / 123.4 + phases)
+        numpy.testing.assert_allclose(M.measure(stack, None, (M.MEASURE_PERIOD,))[M.MEASURE_PERIOD], 123.4, rtol=1e-5)
+
+    def test_ramp_edges(self):
+        frame = numpy.concatenate([numpy.zeros(20), numpy.linspace(0, 100, 101), numpy.ones(20) * 100,
+                                   numpy.linspace(100, 0, 51), numpy.zeros(20)])
+        results = M.measure(frame, None, (M.MEASURE_RISE_TIME, M.MEASURE_FALL_TIME))
+        self.assertAlmostEqual(results[M.MEASURE_RISE_TIME][0], 80.0)
+        self.assertAlmostEqual(results[M.MEASURE_FALL_TIME][0], 40.0)
+
+    def test_stack_matches_single_frames(self):
+        sim = SimulatedTDS540(record_length=500, sources='CH1,CH2,CH3')
+        stack = numpy.array([sim.waveform(source) for source in ('CH1', 'CH2', 'CH3')])
+        together = M.measure(stack)
+        for i in range(len(stack)):
+            alone = M.measure(stack[i])
+            for measurement in together:
+                self.assertAlmostEqual(together[measurement][i], alone[measurement][0])
+
+    def test_frames_without_edges(self):
+        for frame in (numpy.ones((3, 50)), numpy.array([[5.0], [7.0]])):
+            results = M.measure(frame, None, M.DEFAULT_MEASUREMENTS + (M.MEASURE_FALL_TIME, M.MEASURE_PERIOD))
+            for measurement in (M.MEASURE_RISE_TIME, M.MEASURE_FALL_TIME, M.MEASURE_PERIOD, M.MEASURE_FREQUENCY):
+                self.assertEqual(results[measurement].shape, (len(frame),))
+                self.assertTrue(numpy.isnan(results[measurement]).all())
+            numpy.testing.assert_allclose(results[M.MEASURE_MEAN], frame[:, 0])
+            numpy.testing.assert_allclose(results[M.MEASURE_PEAK_TO_PEAK], 0.0)
+
+    def test_unknown_measurement(self):
+        self.assertRaises(Exception, M.measure, numpy.zeros(10), None, ('median',))
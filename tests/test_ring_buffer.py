@@ -0,0 +1,72 @@
+#######################################################################################
+###### Tests of the ring buffer that hands frames between threads             #########
+#######################################################################################
+
+import threading
+import time
+import unittest
+
+from ..base import ring_buffer as R
+from ..base.interface import numpy
+
+
+RECORD = [('index', 'i4'), ('samples', 'i1', (4,))]
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class RingBufferTest(unittest.TestCase):
+    def test_first_in_first_out(self):
+        buffer = R.RingBuffer(4, RECORD)
+        for i in range(3):
+            self.assertTrue(buffer.put((i, [i] * 4)))
+        self.assertEqual(len(buffer), 3)
+        self.assertEqual([buffer.get()['index'] for i in range(3)], [0, 1, 2])
+        self.assertEqual(buffer.get(0.01), None)
+
+    def test_drop_oldest(self):
+        buffer = R.RingBuffer(3, RECORD, R.OVERFLOW_DROP_OLDEST)
+        for i in range(5):
+            buffer.put((i, [i] * 4))
+        self.assertEqual(buffer.dropped, 2)
+        self.assertEqual([buffer.get()['index'] for i in range(3)], [2, 3, 4])
+
+    def test_block(self):
+        buffer = R.RingBuffer(2, RECORD, R.OVERFLOW_BLOCK)
+        buffer.put((0, [0] * 4))
+        buffer.put((1, [1] * 4))
+        self.assertFalse(buffer.put((2, [2] * 4), 0.01))
+        consumer = threading.Timer(0.02, buffer.get)
+        consumer.start()
+        self.assertTrue(buffer.put((2, [2] * 4), 2.0))
+        consumer.join()
+        self.assertEqual(buffer.dropped, 0)
+        self.assertEqual([buffer.get()['index'] for i in range(2)], [1, 2])
+
+    def test_reserve_in_place(self):
+        buffer = R.RingBuffer(2, RECORD)
+        record = buffer.reserve()
+        record['index'] = 7
+        record['samples'][:] = [1, 2, 3, 4]
+        self.assertRaises(Exception, buffer.reserve)
+        self.assertEqual(buffer.get(0.01), None) # not readable before commit
+        buffer.commit()
+        self.assertRaises(Exception, buffer.commit)
+        copy = buffer.get()
+        self.assertEqual(copy['samples'].tolist(), [1, 2, 3, 4])
+        record['index'] = 8
+        self.assertEqual(copy['index'], 7) # get returns a copy
+
+    def test_close(self):
+        buffer = R.RingBuffer(2, RECORD, R.OVERFLOW_BLOCK)
+        buffer.put((0, [0] * 4))
+        threading.Timer(0.02, buffer.close).start()
+        self.assertEqual(buffer.get()['index'], 0)
+        started = time.time()
+        self.assertEqual(buffer.get(), None) # woken up by close
+        self.assertTrue(time.time() - started < 2.0)
+        self.assertFalse(buffer.put((1, [1] * 4)))
+        self.assertEqual(buffer.reserve(), None)
+
+    def test_invalid_buffers(self):
+        self.assertRaises(Exception, R.RingBuffer, 0, RECORD)
+        self.assertRaises(Exception, R.RingBuffer, 2, RECORD, 'drop-newest')